@@ -12,14 +12,21 @@ import sys
 import paho.mqtt.client as mqtt
 import threading
 import time
-from collections import deque
+import random
 
 from habd_common.habd_log import Log
+from habd_common.habd_spool import PublishSpool
+from habd_common.habd_ack import AckTracker, bound_delivery, current_delivery
 
 
 class MqttClient:
 
-    def __init__(self, ip_addr, port, client_id, username='', password='', name='MQTT'):
+    # Seconds to wait for the CONNACK of a connect attempt
+    CONNECT_TIMEOUT_SEC = 30
+
+    def __init__(self, ip_addr, port, client_id, username='', password='', name='MQTT', spool=None,
+                 replay_rate_per_sec=100, backoff_base_sec=1.0, backoff_max_sec=60.0, manual_ack=False,
+                 ack_window=100, redelivery_delay_sec=30, max_delivery_attempts=0, dead_letter_topic=''):
         self.name = name
         self.broker_ip = ip_addr
         self.broker_port = port
@@ -27,7 +34,12 @@ class MqttClient:
         self.user_name = username
         self.pwd = password
         self.sub_cbak_fn = {}
-        self.pub_msg_queue = deque()
+        self.sub_qos = {}
+        # Messages published while the broker is down, RAM bounded by default
+        self.spool = spool if spool is not None else PublishSpool()
+        self.replay_rate_per_sec = replay_rate_per_sec
+        self.pub_lock = threading.Lock()
+        self.replay_th = None
         self.is_connected = False
         self.con_error = False
         self.retry = False
@@ -35,9 +47,30 @@ class MqttClient:
         self.thread_quit = False
         self.th = None
         self.manual_discon = False
+        # on_con / on_discon change the connection state under con_state and notify the waiting threads,
+        # quit_event ends the reconnect thread and its backoff wait
+        self.con_state = threading.Condition()
+        self.quit_event = threading.Event()
+        self.backoff_base_sec = backoff_base_sec
+        self.backoff_max_sec = backoff_max_sec
+        self.reconnect_attempts = 0
+        self.reconnects = 0
+        self.disconnected_since = time.monotonic()
+        self.disconnected_sec = 0.0
+        # QoS 1 messages are acknowledged by the AckTracker after their data is committed. The session is kept
+        # by the broker, so messages that were not acknowledged are redelivered after a reconnect
+        # A message failing max_delivery_attempts times is acknowledged and published to
+        # <dead_letter_topic>/<topic>, or only logged without a dead_letter_topic
+        self.manual_ack = manual_ack
+        self.dead_letter_topic = dead_letter_topic
+        self.ack_tracker = AckTracker(self.ack, ack_window, redelivery_delay_sec, self.request_redelivery,
+                                      max_delivery_attempts, self.dead_letter) if manual_ack else None
+        # mid -> Delivery of the forwarded QoS 1 messages, released on the PUBACK of the forward
+        self.forwarding = {}
+        self.forward_lock = threading.Lock()
         if Log.logger is None:
             Log("MQTT")
-        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id, clean_session=True, userdata=None)
+        self.client = self.new_client()
         # self.client = mqtt.Client(client_id, clean_session=True, userdata=None)
         Log.logger.info(f'{self.name}: Connecting to Broker IP: {ip_addr}  portNo: {port} client_id: {client_id}')
 
@@ -47,18 +80,20 @@ class MqttClient:
             Log.logger.info(f'{self.name}: Disconnect MQTT Client')
             self.client.disconnect()
 
+    def new_client(self):
+        return mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, self.client_id, clean_session=not self.manual_ack,
+                           userdata=None, manual_ack=self.manual_ack)
+
     def connect(self):
         try:
             self.setup_pre_con_params()
             self.client.connect(self.broker_ip, self.broker_port, 60)
             self.client.loop_start()
-            while not self.is_connected and not self.con_error:
-                pass
-            if self.is_connected:
+            if self.wait_con_result():
                 Log.logger.warning(f'{self.name}: ***** CONNECT MQTT broker : {self.broker_ip}  Success *****')
                 self.setup_post_con_params()
                 self.thread_started = False
-            if self.con_error:
+            else:
                 Log.logger.error(f'{self.name}: ***** Unable to CONNECT to  MQTT broker : {self.broker_ip}'
                                  f'Retrying ******')
                 if not self.thread_started:
@@ -68,14 +103,28 @@ class MqttClient:
             if not self.thread_started:
                 self.start_reconnect_th()
 
+    def wait_con_result(self):
+        '''Block until on_con reports the result of the connect attempt, True when connected'''
+        with self.con_state:
+            self.con_state.wait_for(lambda: self.is_connected or self.con_error or self.quit_event.is_set(),
+                                    self.CONNECT_TIMEOUT_SEC)
+            return self.is_connected
+
+    def backoff_delay(self, attempt):
+        '''Exponential backoff capped at backoff_max_sec, with the upper half jittered'''
+        delay = min(self.backoff_max_sec, self.backoff_base_sec * (2 ** min(attempt, 30)))
+        return delay / 2 + random.uniform(0, delay / 2)
+
     def setup_pre_con_params(self):
         self.client.loop_stop()
-        self.is_connected = False
-        self.con_error = False
+        with self.con_state:
+            self.is_connected = False
+            self.con_error = False
         self.manual_discon = False
         self.client.on_connect = self.on_con
         self.client.on_disconnect = self.on_discon
         self.client.on_message = self.on_msg
+        self.client.on_publish = self.on_pub
         if self.user_name != '':
             self.client.username_pw_set(self.user_name, self.pwd)
         self.client.will_set(f'WILL_{self.client_id}', 'Client Dead')
@@ -83,22 +132,47 @@ class MqttClient:
     def setup_post_con_params(self):
         for topic in self.sub_cbak_fn:
             Log.logger.info(f'{self.name}: Post Connection Subscribing: {topic}')
-            self.client.subscribe(topic)
-            self.client.message_callback_add(topic, self.sub_cbak_fn[topic])
-        while len(self.pub_msg_queue) > 0:
-            pub_msg = self.pub_msg_queue.popleft()
-            try:
-                self.client.publish(pub_msg[0], pub_msg[1])
-                Log.logger.info(f'{self.name}: Post Connection - Publish : {pub_msg[0]},  {pub_msg[1]}')
-            except Exception as ex:
-                self.pub_msg_queue.appendleft(pub_msg)
-                Log.logger.exception(f'{self.name}: *** Post Connection {self.broker_ip}  '
-                                     f'Pub Failed {sys.exc_info()[0]} Exception: {ex}***')
-                break
+            self.client.subscribe(topic, self.sub_qos.get(topic, 0))
+            self.client.message_callback_add(self.callback_filter(topic), self.sub_cbak_fn[topic])
+        self.start_replay()
+
+    def start_replay(self):
+        '''Publish the spooled messages on a thread, so connecting does not wait for a long backlog'''
+        if self.replay_th is not None and self.replay_th.is_alive():
+            return
+        self.replay_th = threading.Thread(target=self.replay, name=f'{self.name}_replay', args=())
+        self.replay_th.daemon = True
+        self.replay_th.start()
+
+    def replay(self):
+        '''Publish the spool in order at up to replay_rate_per_sec messages, stops on disconnect'''
+        interval = 1.0 / self.replay_rate_per_sec if self.replay_rate_per_sec > 0 else 0
+        replayed = 0
+        while self.is_connected and not self.manual_discon:
+            with self.pub_lock:
+                pub_msg = self.spool.peek()
+                if pub_msg is None or not self.publish(pub_msg[0], pub_msg[1]):
+                    break
+                self.spool.pop()
+            replayed += 1
+            if interval:
+                time.sleep(interval)
+        if replayed:
+            Log.logger.warning('%s: Post Connection - %d spooled messages published, %d left', self.name, replayed,
+                               len(self.spool))
+
+    def publish(self, topic, msg):
+        '''Hand one message to the MQTT client, False when it was not accepted'''
+        try:
+            return self.client.publish(topic, msg).rc == mqtt.MQTT_ERR_SUCCESS
+        except Exception as ex:
+            Log.logger.error(f'{self.name}: *** Publish to {self.broker_ip} Failed topic = {topic} Exception: {ex}***')
+            return False
 
     def start_reconnect_th(self):
         self.thread_started = True
         self.thread_quit = False
+        self.quit_event.clear()
         Log.logger.warning(f'{self.name}: *** Starting reconnect Thread Broker: {self.broker_ip}  ***')
         self.client.loop_stop()
         if self.is_connected:
@@ -111,20 +185,28 @@ class MqttClient:
 
     def reconnect(self):
         try:
-            self.client.reinitialise(mqtt.CallbackAPIVersion.VERSION1, self.client_id)
+            # A new client keeps the callback API version, session and manual ack settings
+            self.client = self.new_client()
             self.setup_pre_con_params()
         except Exception as ex:
             Log.logger.exception(f'***** {self.name}-{self.broker_ip}: Failed reinitialize  MQTT broker *****'
                                  f'\nException: {ex}')
-        while not self.is_connected and not self.thread_quit:
-            time.sleep(10)
+        attempt = 0
+        while not self.is_connected and not self.quit_event.is_set():
+            # Sleeps without polling, disconnect() ends the wait at once
+            if self.quit_event.wait(self.backoff_delay(attempt)):
+                break
+            attempt += 1
+            self.reconnect_attempts += 1
             try:
-                Log.logger.warning(f'{self.name}: ***** Trying to RECONNECT to  MQTT broker : {self.broker_ip}  *****')
+                Log.logger.warning(f'{self.name}: ***** Trying to RECONNECT to  MQTT broker : {self.broker_ip} '
+                                   f'attempt: {attempt} *****')
+                with self.con_state:
+                    self.con_error = False
                 self.client.connect(self.broker_ip, self.broker_port, 60)
                 self.client.loop_start()
-                while not self.is_connected and not self.con_error and not self.thread_quit:
-                    pass
-                if self.is_connected:
+                if self.wait_con_result():
+                    self.reconnects += 1
                     Log.logger.warning(f'{self.name}: ***** RECONNECT MQTT broker : {self.broker_ip}  Success *****')
                     self.setup_post_con_params()
                     self.thread_started = False
@@ -137,6 +219,9 @@ class MqttClient:
     def disconnect(self):
         Log.logger.info(f'{self.name}: In disconnect fn loop stop')
         self.manual_discon = True
+        if self.ack_tracker is not None:
+            # Wakes a network thread waiting for the ack window, the rest is redelivered on the next start
+            self.ack_tracker.close()
         self.client.loop_stop()
         if self.is_connected:
             Log.logger.info(f'{self.name}: In disconnect fn calling disconnect')
@@ -149,10 +234,14 @@ class MqttClient:
             if self.thread_started:
                 # exit the thread
                 self.thread_quit = True
+                self.quit_event.set()
+                with self.con_state:
+                    self.con_state.notify_all()
             Log.logger.info(
                 f'{self.name}: Already Disconnected  MQTT broker : {self.broker_ip} client_id: {self.client_id}')
         self.sub_cbak_fn = {}
-        self.pub_msg_queue = deque()
+        with self.pub_lock:
+            self.spool.persist()
 
     def on_con(self, client, user_data, flags, rc, properties):
         if rc == 0:
@@ -171,16 +260,30 @@ class MqttClient:
             err_text = "Connection refused: Unknown reason"
         if rc == 0:
             Log.logger.info(f'{self.name}: Broker: {self.broker_ip} Connect Result: {err_text}')
-            self.is_connected = True
-            self.con_error = False
+            with self.con_state:
+                self.is_connected = True
+                self.con_error = False
+                if self.disconnected_since is not None:
+                    self.disconnected_sec += time.monotonic() - self.disconnected_since
+                    self.disconnected_since = None
+                self.con_state.notify_all()
         else:
             Log.logger.error(f'{self.name}: Broker: {self.broker_ip} Connect Result: {err_text}')
-            self.is_connected = False
-            self.con_error = True
+            with self.con_state:
+                self.is_connected = False
+                self.con_error = True
+                self.con_state.notify_all()
 
-    def on_discon(self, client, user_data, rc):
-        if not self.manual_discon:
+    def on_discon(self, client, user_data, flags, rc, properties):
+        with self.con_state:
             self.is_connected = False
+            if self.disconnected_since is None:
+                self.disconnected_since = time.monotonic()
+            self.con_state.notify_all()
+        if self.ack_tracker is not None:
+            self.ack_tracker.reset()
+        self.release_forwards()
+        if not self.manual_discon:
             Log.logger.error(
                 f'{self.name}: ***** Unexpectedly DISCONNECTED - MQTT broker : {self.broker_ip} Retrying *****')
             if not self.thread_started:
@@ -193,27 +296,140 @@ class MqttClient:
         Log.logger.info(f'{self.name}: Received Message from Broker: {self.broker_ip}')
         Log.logger.info(f'\n{self.name}: topic: {message.topic} \nmessage: {message.payload}\nQoS: {message.qos}'
                         f'\nUser data : {user_data}')
+        if self.ack_tracker is not None and message.qos > 0:
+            self.ack_tracker.received(message.mid, message.qos).release()
+
+    def ack(self, mid, qos):
+        self.client.ack(mid, qos)
+
+    def request_redelivery(self):
+        '''Reconnect, so the broker redelivers the messages left unacknowledged'''
+        if self.is_connected:
+            Log.logger.warning(f'{self.name}: Reconnecting to {self.broker_ip} for the redelivery of failed messages')
+            self.client.disconnect()
+
+    def dead_letter(self, message):
+        Log.logger.error(f'{self.name}: message topic: {message.topic} ({len(message.payload)} bytes) failed '
+                         f'{self.ack_tracker.max_attempts} times, acknowledged as dead letter')
+        if self.dead_letter_topic:
+            self.pub(f'{self.dead_letter_topic}/{message.topic}', message.payload)
+        else:
+            Log.logger.error(f'{self.name}: dead letter payload: {message.payload[:1024]}')
+
+    def acked_callback(self, call_back_fn):
+        '''
+        Wrap a subscribe callback for manual ack: the message is acknowledged once the callback and everything
+        that held its Delivery (see habd_ack) released it
+        '''
+        def on_message(client, user_data, message):
+            if message.qos == 0:
+                call_back_fn(client, user_data, message)
+                return
+            delivery = self.ack_tracker.received(message.mid, message.qos, message)
+            failed = True
+            try:
+                with bound_delivery(delivery):
+                    call_back_fn(client, user_data, message)
+                failed = False
+            finally:
+                delivery.release(failed)
+        return on_message
+
+    def ack_stats(self):
+        return self.ack_tracker.stats() if self.ack_tracker is not None else None
 
     def pub(self, topic, msg):
-        self.pub_msg_queue.append((topic, msg))
         # Log.logger.warning(f'{self.name}: received message: topic = {topic}')
+        with self.pub_lock:
+            # Behind a spooled backlog the message is spooled as well, to keep the publish order
+            if self.is_connected and len(self.spool) == 0 and self.publish(topic, msg):
+                Log.logger.info('%s: Publish : %s', self.name, topic)
+                return
+            if self.spool.append(topic, msg):
+                Log.logger.warning('%s: Broker not connected - Queuing Publish : topic = %s (%d bytes), spooled: %d',
+                                   self.name, topic, len(msg), len(self.spool))
+            else:
+                Log.logger.error('%s: Publish spool full - Dropped : topic = %s (%d bytes)', self.name, topic,
+                                 len(msg))
         if self.is_connected:
-            while len(self.pub_msg_queue) > 0:
-                pub_msg = self.pub_msg_queue.popleft()
-                # Log.logger.warning(f'{self.name}: Broker connected - Publishing : topic = {pub_msg[0]}')
-                try:
-                    self.client.publish(pub_msg[0], pub_msg[1])
-                    Log.logger.info(f'{self.name}: Publish : {pub_msg[0]}')
-                except:
-                    self.pub_msg_queue.appendleft(pub_msg)
-                    break
-        else:
-            Log.logger.warning(f'{self.name}: Broker not connected - Queuing Publish : topic = {topic} Message = {msg}')
+            self.start_replay()
+
+    def forward(self, topic, msg, qos=1):
+        '''
+        Republish a received message. The Delivery of the message (see habd_ack) is held until the broker
+        acknowledged the forward, so the message is redelivered when the forward is lost. Without a
+        Delivery, or at QoS 0, the message is published with pub()
+        '''
+        delivery = current_delivery()
+        if delivery is None or qos == 0:
+            self.pub(topic, msg)
+            return
+        # The PUBACK is read by this receiving thread, the hold must not pause it
+        delivery.hold(outside_window=True)
+        info = None
+        if self.is_connected:
+            try:
+                info = self.client.publish(topic, msg, qos)
+            except Exception as e:
+                Log.logger.error(f'{self.name}: Forward to {topic} failed: {e}')
+        if info is None or info.rc != mqtt.MQTT_ERR_SUCCESS:
+            Log.logger.warning(f'{self.name}: Forward to {topic} failed, message left unacknowledged')
+            delivery.release(failed=True, outside_window=True)
+            return
+        with self.forward_lock:
+            self.forwarding[info.mid] = delivery
+        # Forwards are made on the receiving thread, which handles the PUBACKs as well; checked for other callers
+        if info.is_published():
+            self.forward_done(info.mid, False)
+
+    def forward_done(self, mid, failed):
+        with self.forward_lock:
+            delivery = self.forwarding.pop(mid, None)
+        if delivery is not None:
+            delivery.release(failed, outside_window=True)
+
+    def on_pub(self, client, user_data, mid, reason_code, properties):
+        self.forward_done(mid, getattr(reason_code, 'is_failure', False))
+
+    def release_forwards(self):
+        '''Forwards not acknowledged before a disconnect are failed, the broker redelivers their messages'''
+        with self.forward_lock:
+            deliveries = list(self.forwarding.values())
+            self.forwarding.clear()
+        for delivery in deliveries:
+            delivery.release(failed=True, outside_window=True)
+
+    def connection_stats(self):
+        with self.con_state:
+            disconnected_sec = self.disconnected_sec
+            if self.disconnected_since is not None:
+                disconnected_sec += time.monotonic() - self.disconnected_since
+        return {"connected": self.is_connected, "reconnect_attempts": self.reconnect_attempts,
+                "reconnects": self.reconnects, "disconnected_sec": round(disconnected_sec, 1)}
+
+    def spool_stats(self):
+        with self.pub_lock:
+            return self.spool.stats()
+
+    @staticmethod
+    def callback_filter(topic):
+        '''
+        Topic filter the callback of a subscription is matched with. Messages of a shared subscription
+        $share/<group>/<filter> arrive on their own topic, which paho matches against <filter> only
+        '''
+        if topic.startswith('$share/'):
+            parts = topic.split('/', 2)
+            if len(parts) == 3:
+                return parts[2]
+        return topic
 
-    def sub(self, topic, call_back_fn):
+    def sub(self, topic, call_back_fn, qos=0):
+        if self.ack_tracker is not None:
+            call_back_fn = self.acked_callback(call_back_fn)
+        self.sub_qos[topic] = qos
         if self.is_connected:
-            self.client.subscribe(topic)
-            self.client.message_callback_add(topic, call_back_fn)
+            self.client.subscribe(topic, qos)
+            self.client.message_callback_add(self.callback_filter(topic), call_back_fn)
             Log.logger.info(f'{self.name}: Subscribe : topic = {topic} Success')
         else:
             Log.logger.info(f'{self.name}: Broker not connected - Unable to Subscribe : topic = {topic}')
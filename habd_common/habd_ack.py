@@ -0,0 +1,263 @@
+'''
+*****************************************************************************
+*File : habd_ack.py
+*Module : habd_common
+*Purpose : habd data logging module (DLM) MQTT QoS 1 manual acknowledgement
+*Author : HABD Team
+*Copyright : Copyright 2025, Lab to Market Innovations Private Limited
+*****************************************************************************
+
+A received QoS 1 message becomes a Delivery. Everything that takes over the message (the ingest queue, a
+write-behind batch, a train assembly, the pending habd_info buffer) hold()s it and release()s it once its
+data is committed, the PUBACK is sent when the last hold is released. The thread handling a message finds
+its Delivery with current_delivery(), so the handlers keep their signatures. Holds that wait for something
+the receiving thread itself has to read (a forward's PUBACK) or for further messages (a train assembly)
+are taken with outside_window, so they do not pause the receive.
+'''
+
+# '''import python packages'''
+import time
+import zlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# '''import habd packages'''
+from habd_common.habd_log import Log
+
+thread_state = threading.local()
+
+
+def current_delivery():
+    '''Delivery of the message handled by this thread, None outside of a manual ack message'''
+    return getattr(thread_state, 'delivery', None)
+
+
+@contextmanager
+def bound_delivery(delivery):
+    '''Make delivery the current_delivery() of this thread for the with block'''
+    previous = current_delivery()
+    thread_state.delivery = delivery
+    try:
+        yield delivery
+    finally:
+        thread_state.delivery = previous
+
+
+def fail_current_delivery():
+    '''Keep the current message unacknowledged, called where a write failed and the error was handled'''
+    delivery = current_delivery()
+    if delivery is not None:
+        delivery.fail()
+
+
+class Delivery:
+    '''One received QoS 1 message, acknowledged when every holder released it without failure'''
+
+    __slots__ = ('tracker', 'generation', 'seq', 'mid', 'qos', 'message', 'key', 'holds', 'outside_holds',
+                 'failed', 'done')
+
+    def __init__(self, tracker, generation, seq, mid, qos, message=None):
+        self.tracker = tracker
+        self.generation = generation
+        self.seq = seq
+        self.mid = mid
+        self.qos = qos
+        # The MQTT message, failures of a redelivered message are counted by the crc of its topic and payload
+        self.message = message
+        self.key = zlib.crc32(message.payload, zlib.crc32(message.topic.encode('utf-8'))) if message else None
+        self.holds = 1
+        self.outside_holds = 0
+        self.failed = False
+        self.done = False
+
+    def hold(self, outside_window=False):
+        '''Take over the message, with outside_window it does not count toward the AckTracker window'''
+        with self.tracker.cond:
+            self.holds += 1
+            if outside_window:
+                self.outside_holds += 1
+                if self.outside_holds == 1:
+                    self.tracker.outside_window(self, 1)
+
+    def fail(self):
+        with self.tracker.cond:
+            self.failed = True
+
+    def release(self, failed=False, outside_window=False):
+        '''Hand the message back, outside_window releases a hold taken with outside_window'''
+        redeliver = False
+        dead_letters = None
+        with self.tracker.cond:
+            self.failed = self.failed or failed
+            if outside_window:
+                self.outside_holds -= 1
+                if self.outside_holds == 0:
+                    self.tracker.outside_window(self, -1)
+            self.holds -= 1
+            if self.holds == 0:
+                redeliver = self.tracker.complete(self)
+                dead_letters = self.tracker.take_dead_letters()
+        # Outside the lock, on_failed disconnects the client and on_dead_letter publishes
+        if dead_letters:
+            for message in dead_letters:
+                self.tracker.on_dead_letter(message)
+        if redeliver:
+            self.tracker.on_failed()
+
+
+class AckTracker:
+    '''
+    Sends the PUBACKs in the order the messages were received, as MQTT 3.1.1 requires, and blocks the
+    receiving MQTT thread while window messages are not yet committed. A failed message is not acknowledged,
+    on_failed is called (at most once per redelivery_delay_sec) so the client can reconnect and have the
+    broker redeliver it; the persistent session keeps it until then. A message failing max_attempts times is
+    acknowledged and handed to on_dead_letter instead, so it does not come back forever.
+    '''
+
+    # Failure counts kept for at most this many messages, the oldest are forgotten
+    ATTEMPTS_MAX_KEYS = 4096
+
+    def __init__(self, ack_fn, window, redelivery_delay_sec=30, on_failed=None, max_attempts=0,
+                 on_dead_letter=None):
+        self.ack_fn = ack_fn
+        self.window = max(1, window)
+        self.redelivery_delay_sec = redelivery_delay_sec
+        self.on_failed = on_failed
+        self.max_attempts = max_attempts
+        self.on_dead_letter = on_dead_letter
+        # Delivery key -> failed attempts, kept across reconnects
+        self.attempts = OrderedDict()
+        self.dead_letters = []
+        self.cond = threading.Condition()
+        # seq -> Delivery in receive order, acknowledged from the head
+        self.pending = OrderedDict()
+        self.next_seq = 0
+        self.generation = 0
+        self.closed = False
+        self.last_failed_time = None
+        self.redelivery_timer = None
+        self.received_count = 0
+        self.acked = 0
+        self.failed = 0
+        self.dead_lettered = 0
+        self.window_waits = 0
+        # Pending deliveries held outside of the window (see Delivery.hold)
+        self.outside = 0
+
+    def received(self, mid, qos, message=None):
+        '''Delivery of a received message, waits while the window is full'''
+        with self.cond:
+            if len(self.pending) - self.outside >= self.window and not self.closed:
+                self.window_waits += 1
+                while len(self.pending) - self.outside >= self.window and not self.closed:
+                    if not self.cond.wait(10):
+                        Log.logger.warning(f'AckTracker: {len(self.pending)} messages waiting for commit, '
+                                           f'receive paused')
+            delivery = Delivery(self, self.generation, self.next_seq, mid, qos, message)
+            self.next_seq += 1
+            self.received_count += 1
+            if not self.closed:
+                self.pending[delivery.seq] = delivery
+            return delivery
+
+    def complete(self, delivery):
+        '''
+        Called with cond held when the last hold of a delivery is released, returns True when on_failed
+        has to be called
+        '''
+        delivery.done = True
+        if delivery.generation != self.generation or delivery.seq not in self.pending:
+            # Received before a disconnect, the broker redelivers it
+            return False
+        redeliver = False
+        while self.pending:
+            seq, head = next(iter(self.pending.items()))
+            if not head.done:
+                break
+            del self.pending[seq]
+            if head.failed and not self.dead_letter(head):
+                self.failed += 1
+                redeliver = True
+                continue
+            if not head.failed and head.key is not None:
+                self.attempts.pop(head.key, None)
+            try:
+                self.ack_fn(head.mid, head.qos)
+                self.acked += 1
+            except Exception as e:
+                Log.logger.error(f'AckTracker: PUBACK of mid {head.mid} failed: {e}')
+        self.cond.notify_all()
+        if not redeliver or self.on_failed is None or self.redelivery_timer is not None:
+            return False
+        Log.logger.error('AckTracker: message write failed, left unacknowledged for redelivery')
+        now = time.monotonic()
+        delay = 0 if self.last_failed_time is None else self.last_failed_time + self.redelivery_delay_sec - now
+        if delay <= 0:
+            self.last_failed_time = now
+            return True
+        # Failures within redelivery_delay_sec of the last redelivery are redelivered together
+        self.redelivery_timer = threading.Timer(delay, self.redeliver)
+        self.redelivery_timer.daemon = True
+        self.redelivery_timer.start()
+        return False
+
+    def dead_letter(self, delivery):
+        '''Count a failed attempt with cond held, True when the message failed max_attempts times'''
+        if self.max_attempts <= 0 or delivery.key is None:
+            return False
+        attempts = self.attempts.pop(delivery.key, 0) + 1
+        if attempts < self.max_attempts:
+            self.attempts[delivery.key] = attempts
+            while len(self.attempts) > AckTracker.ATTEMPTS_MAX_KEYS:
+                self.attempts.popitem(last=False)
+            return False
+        self.dead_lettered += 1
+        if self.on_dead_letter is not None:
+            self.dead_letters.append(delivery.message)
+        return True
+
+    def take_dead_letters(self):
+        '''Messages to hand to on_dead_letter, called with cond held'''
+        dead_letters = self.dead_letters
+        if dead_letters:
+            self.dead_letters = []
+        return dead_letters
+
+    def redeliver(self):
+        with self.cond:
+            self.redelivery_timer = None
+            self.last_failed_time = time.monotonic()
+            if self.closed:
+                return
+        self.on_failed()
+
+    def outside_window(self, delivery, count):
+        '''A pending delivery entered (1) or left (-1) the holds outside of the window, called with cond held'''
+        if delivery.generation == self.generation and delivery.seq in self.pending:
+            self.outside += count
+            self.cond.notify_all()
+
+    def reset(self):
+        '''Forget the messages of the previous connection, the broker redelivers the unacknowledged ones'''
+        with self.cond:
+            self.generation += 1
+            self.pending.clear()
+            self.outside = 0
+            self.cond.notify_all()
+
+    def close(self):
+        '''Stop waiting for the window, called on shutdown'''
+        with self.cond:
+            self.closed = True
+            self.pending.clear()
+            if self.redelivery_timer is not None:
+                self.redelivery_timer.cancel()
+                self.redelivery_timer = None
+            self.cond.notify_all()
+
+    def stats(self):
+        with self.cond:
+            return {"in_flight": len(self.pending), "received": self.received_count, "acked": self.acked,
+                    "failed": self.failed, "dead_lettered": self.dead_lettered, "window_waits": self.window_waits,
+                    "outside_window": self.outside}
@@ -11,27 +11,128 @@
 # '''import python packages '''
 import json
 import time
+import threading
 
 # '''import habd packages'''
 from habd_common.MqttClient import MqttClient
 from habd_common.habd_log import Log
 
 
+class StormState:
+    '''Token bucket and coalescing state of one (kind, module, id)'''
+
+    __slots__ = ('tokens', 'last_time', 'last_seen', 'pending', 'pending_since', 'severity', 'desc',
+                 'storm_suppressed', 'storm_start')
+
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.last_time = now
+        self.last_seen = now
+        # Calls suppressed since the last coalesced message
+        self.pending = 0
+        self.pending_since = None
+        self.severity = 0
+        self.desc = None
+        # Calls suppressed since the storm started
+        self.storm_suppressed = 0
+        self.storm_start = None
+
+
 class EventErrorPub:
 
     INFO = 1
     WARNING = 2
     CRITICAL = 3
 
-    '''Publish DLM Events and Errors'''
+    '''
+    Publish DLM Events and Errors. Each (module, error_id / event_id) has a token bucket of burst messages
+    refilled at rate_per_sec. Calls finding the bucket empty are coalesced: once per coalesce_window_sec
+    one message with the last description and a repeat_count is published, and when no call came for a
+    whole window a summary of the suppressed messages ends the storm. rate_per_sec 0 publishes every call.
+    '''
 
-    def __init__(self, mq_client, dpu_id):
+    def __init__(self, mq_client, dpu_id, rate_per_sec=1.0, burst=5, coalesce_window_sec=10.0):
         if Log.logger is None:
             Log("event_err_pub")
         self.event_msg_id = 1
         self.error_msg_id = 1
         self.mqtt_client = mq_client
         self.dpu_id = dpu_id
+        self.rate_per_sec = rate_per_sec
+        self.burst = max(1, burst)
+        self.coalesce_window_sec = coalesce_window_sec
+        self.lock = threading.Lock()
+        self.storms = {}
+        self.flush_th = None
+        self.suppressed = 0
+
+    def admit(self, key, severity, desc):
+        '''True when the message is published now, False when it is coalesced'''
+        if not self.rate_per_sec:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            state = self.storms.get(key)
+            if state is None:
+                state = self.storms[key] = StormState(self.burst, now)
+            state.tokens = min(self.burst, state.tokens + (now - state.last_time) * self.rate_per_sec)
+            state.last_time = state.last_seen = now
+            if state.tokens >= 1 and not state.pending:
+                state.tokens -= 1
+                return True
+            if not state.pending:
+                state.pending_since = now
+                state.severity = 0
+            if state.storm_start is None:
+                state.storm_start = now
+            state.pending += 1
+            state.storm_suppressed += 1
+            state.severity = max(state.severity, severity)
+            state.desc = desc
+            self.suppressed += 1
+            if self.flush_th is None:
+                self.flush_th = threading.Thread(target=self.flush_loop, name="habd_evt_err_flush", args=())
+                self.flush_th.daemon = True
+                self.flush_th.start()
+        return False
+
+    def flush_loop(self):
+        '''Publish the coalesced messages and storm summaries, exits when no storm is left'''
+        while True:
+            time.sleep(min(1.0, self.coalesce_window_sec / 4))
+            now = time.monotonic()
+            coalesced = []
+            summaries = []
+            with self.lock:
+                for key, state in list(self.storms.items()):
+                    if state.pending and now - state.pending_since >= self.coalesce_window_sec:
+                        coalesced.append((key, state.severity, state.desc, state.pending, now - state.pending_since))
+                        state.pending = 0
+                    elif state.storm_start is not None and not state.pending and \
+                            now - state.last_seen >= self.coalesce_window_sec:
+                        summaries.append((key, state.severity, state.storm_suppressed,
+                                          state.last_seen - state.storm_start))
+                        state.storm_start = None
+                        state.storm_suppressed = 0
+                    if state.storm_start is None and now - state.last_seen >= self.burst / self.rate_per_sec:
+                        # Bucket full again, forget the key
+                        del self.storms[key]
+                if not any(state.storm_start is not None for state in self.storms.values()):
+                    self.flush_th = None
+            for (kind, module_name, msg_id), severity, desc, count, window in coalesced:
+                desc = f'{desc} [repeated {count} times in {window:.0f}s]'
+                if kind == "error":
+                    self.send_error_info(module_name, msg_id, severity, desc, count)
+                else:
+                    self.send_event_info(module_name, msg_id, desc, count)
+            for (kind, module_name, msg_id), severity, count, duration in summaries:
+                desc = f'{msg_id} storm ended: {count} messages suppressed over {duration:.0f}s'
+                if kind == "error":
+                    self.send_error_info(module_name, msg_id, severity, desc)
+                else:
+                    self.send_event_info(module_name, msg_id, desc)
+            if self.flush_th is None:
+                break
 
     def publish_error_info(self, module_name, msg_error_id, msg_error_severity, msg_error_desc):
         '''
@@ -44,17 +145,29 @@ class EventErrorPub:
             “error_desc”: <string>
         }
         '''
+        try:
+            if self.admit(("error", module_name, str(msg_error_id)), int(msg_error_severity), str(msg_error_desc)):
+                self.send_error_info(module_name, msg_error_id, msg_error_severity, msg_error_desc)
+        except Exception as e:
+            Log.logger.error(f'EventErrorPub: publish_error_info: {e}', exc_info=True)
+
+    def send_error_info(self, module_name, msg_error_id, msg_error_severity, msg_error_desc, repeat_count=None):
+        '''Publish one error message, repeat_count is added to coalesced messages'''
         try:
             error_ts = round(time.time(), 6)
             error_id = str(msg_error_id)
             error_severity = int(msg_error_severity)
             error_desc = str(msg_error_desc)
-            error_msg = {"msg_id": self.error_msg_id, "ts": error_ts, "dpu_id": self.dpu_id, "error_id": error_id,
+            with self.lock:
+                msg_id = self.error_msg_id
+                self.error_msg_id = self.error_msg_id + 1
+            error_msg = {"msg_id": msg_id, "ts": error_ts, "dpu_id": self.dpu_id, "error_id": error_id,
                          "error_severity": error_severity, "error_desc": error_desc}
+            if repeat_count is not None:
+                error_msg["repeat_count"] = repeat_count
             error_json_msg = json.dumps(error_msg)
             topic = "dpu_" + module_name + "/errors"
             self.mqtt_client.pub(topic, error_json_msg)
-            self.error_msg_id = self.error_msg_id + 1
             Log.logger.info(f'publish_error_info:\ntopic: {topic}\n Message: {error_json_msg}')
         except Exception as e:
             Log.logger.error(f'EventErrorPub: publish_error_info: {e}', exc_info=True)
@@ -69,16 +182,28 @@ class EventErrorPub:
             “event_desc”: <string>
         }
         '''
+        try:
+            if self.admit(("event", module_name, str(msg_event_id)), 0, str(msg_event_desc)):
+                self.send_event_info(module_name, msg_event_id, msg_event_desc)
+        except Exception as e:
+            Log.logger.error(f'EventErrorPub: publish_event_info: {e}', exc_info=True)
+
+    def send_event_info(self, module_name, msg_event_id, msg_event_desc, repeat_count=None):
+        '''Publish one event message, repeat_count is added to coalesced messages'''
         try:
             event_ts = round(time.time(), 6)
             event_id = str(msg_event_id)
             event_desc = str(msg_event_desc)
-            event_msg = {"msg_id": self.event_msg_id, "ts": event_ts, "dpu_id": self.dpu_id, "event_id": event_id,
+            with self.lock:
+                msg_id = self.event_msg_id
+                self.event_msg_id = self.event_msg_id + 1
+            event_msg = {"msg_id": msg_id, "ts": event_ts, "dpu_id": self.dpu_id, "event_id": event_id,
                          "event_desc": event_desc}
+            if repeat_count is not None:
+                event_msg["repeat_count"] = repeat_count
             event_json_msg = json.dumps(event_msg)
             topic = "dpu_" + module_name + "/events"
             self.mqtt_client.pub(topic, event_json_msg)
-            self.event_msg_id = self.event_msg_id + 1
             Log.logger.info(f'publish_event_info:\ntopic: {topic}\n Message: {event_json_msg}')
         except Exception as e:
             Log.logger.error(f'EventErrorPub: publish_event_info: {e}', exc_info=True)
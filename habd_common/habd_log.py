@@ -13,12 +13,17 @@ import smtplib
 import threading
 import email.utils
 import time
+import gzip
+import os
+import queue
+import shutil
 import logging.handlers as handlers
 #from logging.handlers import SMTPHandler
 
 
 class Log:
     logger = None
+    listener = None
 
     def __init__(self, module_name):
         Log.logger = logging.getLogger('HABD')
@@ -66,6 +71,42 @@ class Log:
         # eh.setFormatter(formatter)
         # Log.logger.addHandler(eh)
 
+    @staticmethod
+    def start_async(log_file=None, max_bytes=5 * 1024 * 1024, backup_count=5, compress=True, rate_per_sec=0,
+                    burst=0):
+        '''
+        Move log formatting and I/O off the calling threads: records go through a QueueHandler to a
+        QueueListener thread that feeds the existing handlers plus an optional size rotated log file
+        (rotated files gzip compressed). With rate_per_sec each call site may emit WARNING and lower
+        records at that rate (burst records at once), suppressed records are counted in the next one.
+        Logger arguments are formatted on the listener thread, so pass %-style arguments rather than
+        f-strings on hot paths.
+        '''
+        if Log.listener is not None:
+            return
+        target_handlers = list(Log.logger.handlers)
+        if log_file is not None:
+            fh = CompressedRotatingFileHandler(log_file, max_bytes, backup_count, compress)
+            fh.setLevel(Log.logger.level)
+            fh.setFormatter(target_handlers[0].formatter if target_handlers else logging.Formatter())
+            target_handlers.append(fh)
+
+        qh = DeferredQueueHandler(queue.SimpleQueue())
+        if rate_per_sec > 0:
+            qh.addFilter(RateLimitFilter(rate_per_sec, max(burst, 1)))
+        for handler in list(Log.logger.handlers):
+            Log.logger.removeHandler(handler)
+        Log.logger.addHandler(qh)
+        Log.listener = handlers.QueueListener(qh.queue, *target_handlers, respect_handler_level=True)
+        Log.listener.start()
+
+    @staticmethod
+    def stop_async():
+        '''Write out the queued records and stop the listener thread, called on shutdown'''
+        if Log.listener is not None:
+            Log.listener.stop()
+            Log.listener = None
+
     def fn1(self):
         print("Function 1")
         try:
@@ -83,6 +124,60 @@ class Log:
         print(f'i={i}, j={j}, k={k} l={m}')
 
 
+class DeferredQueueHandler(handlers.QueueHandler):
+    '''QueueHandler that leaves message formatting to the listener thread'''
+
+    def prepare(self, record):
+        return record
+
+
+class CompressedRotatingFileHandler(handlers.RotatingFileHandler):
+    '''Size rotated log file, rotated files are gzip compressed'''
+
+    def __init__(self, filename, max_bytes, backup_count, compress=True):
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        super().__init__(filename, mode='a', maxBytes=max_bytes, backupCount=backup_count)
+        if compress:
+            self.namer = lambda name: name + '.gz'
+            self.rotator = self.gzip_rotator
+
+    @staticmethod
+    def gzip_rotator(source, dest):
+        with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.remove(source)
+
+
+class RateLimitFilter(logging.Filter):
+    '''
+    Token bucket per call site (file and line) for WARNING and lower records, ERROR and CRITICAL always pass.
+    The number of records dropped since the last one that passed is appended to that record.
+    '''
+
+    def __init__(self, rate_per_sec, burst):
+        super().__init__()
+        self.rate_per_sec = rate_per_sec
+        self.burst = burst
+        self.sites = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self.lock:
+            tokens, last_time, suppressed = self.sites.get(key, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - last_time) * self.rate_per_sec)
+            if tokens < 1:
+                self.sites[key] = (tokens, now, suppressed + 1)
+                return False
+            self.sites[key] = (tokens - 1, now, 0)
+        if suppressed:
+            record.msg = f'{record.msg} [{suppressed} similar messages suppressed]'
+        return True
+
+
 def smtpThreadHolder(mail_host, port, username, password, from_addr, toaddrs, msg):
     smtp = None
     try:
@@ -0,0 +1,339 @@
+'''
+*****************************************************************************
+*File : habd_spool.py
+*Module : habd_common
+*Purpose : habd data logging module (DLM) bounded publish spool for MQTT outages
+*Author : HABD Team
+*Copyright : Copyright 2025, Lab to Market Innovations Private Limited
+*****************************************************************************
+
+Messages published while the broker is down are held in RAM up to ram_max_bytes, further messages go to
+append-only segment files in spool_dir that are memory mapped. RAM always holds the oldest messages, once
+anything is on disk new messages are appended there too, so pop() returns messages in publish order.
+
+Segment file layout, little-endian:
+    header      magic b'HBSP', u32 read offset, u32 write offset                              (12 bytes)
+    records     u32 crc32 of topic + payload, u32 payload length, u16 topic length, u8 priority,
+                topic (UTF-8), payload
+Segments are preallocated to segment_bytes. The offsets are updated in the mapping after every append and
+pop, so messages still on disk are replayed after a restart; records failing the crc end the segment.
+'''
+
+# '''import python packages'''
+import os
+import mmap
+import struct
+import zlib
+from collections import deque
+
+# '''import habd packages'''
+from habd_common.habd_log import Log
+
+MAGIC = b'HBSP'
+HEADER = struct.Struct('<4sII')
+RECORD = struct.Struct('<IIHB')
+
+DROP_OLDEST = "oldest"
+DROP_PRIORITY = "priority"
+
+
+class SpoolSegment:
+    '''One memory mapped segment file, appended at the write offset and consumed from the read offset'''
+
+    def __init__(self, file_name, number, size=None):
+        self.file_name = file_name
+        self.number = number
+        # (offset, topic length, payload length, priority) of the unread records
+        self.index = deque()
+        # Set on recovered segments, nothing is appended to them; never written to the header
+        self.sealed = False
+        if size is not None:
+            with open(file_name, 'wb') as f:
+                f.truncate(size)
+        self.fd = os.open(file_name, os.O_RDWR)
+        self.size = os.fstat(self.fd).st_size
+        self.mm = mmap.mmap(self.fd, self.size)
+        if size is not None:
+            self.read_offset = self.write_offset = HEADER.size
+            self.write_header()
+        else:
+            self.recover()
+
+    def write_header(self):
+        HEADER.pack_into(self.mm, 0, MAGIC, self.read_offset, self.write_offset)
+
+    def recover(self):
+        '''Index the unread records of an existing segment, stops at the first torn or corrupt record'''
+        if self.size < HEADER.size:
+            self.read_offset = self.write_offset = self.size
+            return
+        magic, self.read_offset, self.write_offset = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or not HEADER.size <= self.read_offset <= self.write_offset <= self.size:
+            Log.logger.error(f'SpoolSegment: {self.file_name}: invalid header, segment skipped')
+            self.read_offset = self.write_offset = self.size
+            return
+        offset = self.read_offset
+        while offset + RECORD.size <= self.write_offset:
+            crc, payload_len, topic_len, priority = RECORD.unpack_from(self.mm, offset)
+            end = offset + RECORD.size + topic_len + payload_len
+            # A zero filled tail passes the crc (crc32(b'') == 0), no record has an empty topic
+            if topic_len == 0 or end > self.write_offset or zlib.crc32(self.mm[offset + RECORD.size:end]) != crc:
+                Log.logger.error(f'SpoolSegment: {self.file_name}: corrupt record at {offset}, rest dropped')
+                break
+            self.index.append((offset, topic_len, payload_len, priority))
+            offset = end
+        self.write_offset = offset
+
+    def free_bytes(self):
+        return 0 if self.sealed else self.size - self.write_offset
+
+    def append(self, topic_bytes, payload, priority):
+        '''Write one record, the caller checks free_bytes() first'''
+        offset = self.write_offset
+        body = topic_bytes + payload
+        RECORD.pack_into(self.mm, offset, zlib.crc32(body), len(payload), len(topic_bytes), priority)
+        self.mm[offset + RECORD.size:offset + RECORD.size + len(body)] = body
+        self.write_offset = offset + RECORD.size + len(body)
+        self.write_header()
+        self.index.append((offset, len(topic_bytes), len(payload), priority))
+
+    def read(self, record):
+        '''(topic bytes, payload) of an index entry'''
+        offset, topic_len, payload_len, _ = record
+        start = offset + RECORD.size
+        return self.mm[start:start + topic_len], self.mm[start + topic_len:start + topic_len + payload_len]
+
+    def peek(self):
+        topic, payload = self.read(self.index[0])
+        return topic.decode('utf-8'), payload
+
+    def pop(self):
+        self.index.popleft()
+        self.read_offset = self.index[0][0] if self.index else self.write_offset
+        self.write_header()
+
+    def close(self, remove=False):
+        self.mm.flush()
+        self.mm.close()
+        os.close(self.fd)
+        if remove:
+            os.remove(self.file_name)
+
+
+class PublishSpool:
+    '''
+    Bounded FIFO of (topic, payload) for messages that could not be published. When the disk budget is
+    exhausted (or RAM is full and there is no spool_dir) the drop policy makes room: "oldest" drops the
+    oldest messages, "priority" drops the oldest messages of the lowest priority below the new message's
+    and drops the new message when nothing of lower priority is held. Topic priorities are matched by
+    the longest topic prefix of topic_priorities, unmatched topics have priority 0.
+    Not thread safe, MqttClient serialises the calls.
+    '''
+
+    def __init__(self, spool_dir=None, ram_max_bytes=8 * 1024 * 1024, disk_max_bytes=256 * 1024 * 1024,
+                 segment_bytes=4 * 1024 * 1024, drop_policy=DROP_OLDEST, topic_priorities=None):
+        if drop_policy not in (DROP_OLDEST, DROP_PRIORITY):
+            raise ValueError(f'PublishSpool: unknown drop policy: {drop_policy}')
+        self.spool_dir = spool_dir
+        self.ram_max_bytes = ram_max_bytes
+        self.segment_bytes = max(segment_bytes, 64 * 1024)
+        self.disk_max_bytes = max(disk_max_bytes, 2 * self.segment_bytes)
+        self.drop_policy = drop_policy
+        self.topic_priorities = sorted((topic_priorities or {}).items(), key=lambda item: -len(item[0]))
+        self.priority_cache = {}
+        # (topic, payload, priority) of the oldest messages
+        self.ram = deque()
+        self.ram_bytes = 0
+        self.segments = deque()
+        self.disk_msgs = 0
+        self.disk_bytes = 0
+        self.spooled = 0
+        self.dropped = 0
+        if spool_dir is not None:
+            os.makedirs(spool_dir, exist_ok=True)
+            self.recover()
+
+    def priority(self, topic):
+        priority = self.priority_cache.get(topic)
+        if priority is None:
+            priority = next((level for prefix, level in self.topic_priorities if topic.startswith(prefix)), 0)
+            self.priority_cache[topic] = priority = min(max(priority, 0), 255)
+        return priority
+
+    def segment_name(self, number):
+        return os.path.join(self.spool_dir, f'seg-{number}.spool')
+
+    def recover(self):
+        '''Load the segments left by the previous run, oldest first'''
+        numbers = []
+        for name in os.listdir(self.spool_dir):
+            if name.startswith('seg-') and name.endswith('.spool'):
+                try:
+                    numbers.append(int(name[4:-6]))
+                except ValueError:
+                    continue
+        for number in sorted(numbers):
+            if os.path.getsize(self.segment_name(number)) < HEADER.size:
+                os.remove(self.segment_name(number))
+                continue
+            segment = SpoolSegment(self.segment_name(number), number)
+            if not segment.index:
+                segment.close(remove=True)
+                continue
+            # Recovered segments are sealed, appends start a new segment
+            segment.sealed = True
+            self.segments.append(segment)
+            self.disk_msgs += len(segment.index)
+            self.disk_bytes += segment.size
+        if self.disk_msgs:
+            Log.logger.warning(f'PublishSpool: {self.disk_msgs} messages recovered from {self.spool_dir}')
+
+    def __len__(self):
+        return len(self.ram) + self.disk_msgs
+
+    def append(self, topic, payload):
+        '''Hold one message, returns False when the drop policy dropped it'''
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        priority = self.priority(topic)
+        size = len(topic) + len(payload)
+        self.spooled += 1
+        if not self.disk_msgs and self.ram_bytes + size <= self.ram_max_bytes:
+            self.ram.append((topic, payload, priority))
+            self.ram_bytes += size
+            return True
+        if self.spool_dir is None:
+            if not self.make_ram_room(size, priority):
+                self.dropped += 1
+                return False
+            self.ram.append((topic, payload, priority))
+            self.ram_bytes += size
+            return True
+        return self.append_disk(topic.encode('utf-8'), payload, priority)
+
+    def append_disk(self, topic_bytes, payload, priority):
+        needed = RECORD.size + len(topic_bytes) + len(payload)
+        segment = self.segments[-1] if self.segments else None
+        if segment is None or segment.free_bytes() < needed:
+            size = max(self.segment_bytes, HEADER.size + needed)
+            if not self.make_disk_room(size, priority):
+                self.dropped += 1
+                return False
+            number = self.segments[-1].number + 1 if self.segments else 0
+            segment = SpoolSegment(self.segment_name(number), number, size)
+            self.segments.append(segment)
+            self.disk_bytes += size
+        segment.append(topic_bytes, payload, priority)
+        self.disk_msgs += 1
+        return True
+
+    def make_ram_room(self, size, priority):
+        while self.ram and self.ram_bytes + size > self.ram_max_bytes:
+            if self.drop_policy == DROP_OLDEST:
+                idx = 0
+            else:
+                lowest = min(msg[2] for msg in self.ram)
+                if lowest >= priority:
+                    return False
+                idx = next(idx for idx, msg in enumerate(self.ram) if msg[2] == lowest)
+            topic, payload, _ = self.ram[idx]
+            del self.ram[idx]
+            self.ram_bytes -= len(topic) + len(payload)
+            self.dropped += 1
+        return self.ram_bytes + size <= self.ram_max_bytes
+
+    def make_disk_room(self, size, priority):
+        while self.segments and self.disk_bytes + size > self.disk_max_bytes:
+            if self.drop_policy == DROP_OLDEST:
+                segment = self.segments.popleft()
+                self.drop_segment(segment)
+                continue
+            lowest = min((record[3] for segment in self.segments for record in segment.index), default=None)
+            if lowest is None or lowest >= priority:
+                return False
+            self.compact(lowest)
+        return self.disk_bytes + size <= self.disk_max_bytes
+
+    def drop_segment(self, segment):
+        self.disk_msgs -= len(segment.index)
+        self.disk_bytes -= segment.size
+        self.dropped += len(segment.index)
+        Log.logger.warning(f'PublishSpool: disk budget exhausted, {len(segment.index)} messages of '
+                           f'{segment.file_name} dropped')
+        segment.close(remove=True)
+
+    def compact(self, priority):
+        '''Rewrite every segment without its messages of the given priority, oldest first'''
+        compacted = deque()
+        dropped = 0
+        for segment in self.segments:
+            keep = [record for record in segment.index if record[3] != priority]
+            dropped += len(segment.index) - len(keep)
+            self.disk_msgs -= len(segment.index)
+            self.disk_bytes -= segment.size
+            if not keep:
+                segment.close(remove=True)
+                continue
+            size = HEADER.size + sum([RECORD.size + record[1] + record[2] for record in keep])
+            tmp_name = segment.file_name + '.tmp'
+            new_segment = SpoolSegment(tmp_name, segment.number, size)
+            for record in keep:
+                new_segment.append(*segment.read(record), record[3])
+            segment.close()
+            os.replace(tmp_name, segment.file_name)
+            new_segment.file_name = segment.file_name
+            compacted.append(new_segment)
+            self.disk_msgs += len(new_segment.index)
+            self.disk_bytes += new_segment.size
+        self.segments = compacted
+        self.dropped += dropped
+        Log.logger.warning(f'PublishSpool: disk budget exhausted, {dropped} messages of priority {priority} dropped')
+
+    def peek(self):
+        '''(topic, payload) of the oldest message, None when the spool is empty'''
+        if self.ram:
+            return self.ram[0][:2]
+        if self.segments:
+            return self.segments[0].peek()
+        return None
+
+    def pop(self):
+        '''Remove the oldest message, after it was published'''
+        if self.ram:
+            topic, payload, _ = self.ram.popleft()
+            self.ram_bytes -= len(topic) + len(payload)
+            return
+        segment = self.segments[0]
+        segment.pop()
+        self.disk_msgs -= 1
+        if not segment.index and (len(self.segments) > 1 or segment.free_bytes() == 0):
+            self.segments.popleft()
+            self.disk_bytes -= segment.size
+            segment.close(remove=True)
+
+    def persist(self):
+        '''
+        Write the RAM messages to a segment in front of the disk ones and sync the segments, so a restart
+        replays everything. Called on shutdown, the RAM part is written regardless of the disk budget.
+        '''
+        if self.spool_dir is None:
+            return
+        if self.ram:
+            number = self.segments[0].number - 1 if self.segments else 0
+            records = [(topic.encode('utf-8'), payload, priority) for topic, payload, priority in self.ram]
+            size = HEADER.size + sum([RECORD.size + len(topic) + len(payload) for topic, payload, _ in records])
+            segment = SpoolSegment(self.segment_name(number), number, size)
+            for topic, payload, priority in records:
+                segment.append(topic, payload, priority)
+            self.segments.appendleft(segment)
+            self.disk_msgs += len(records)
+            self.disk_bytes += size
+            self.ram.clear()
+            self.ram_bytes = 0
+        for segment in self.segments:
+            segment.mm.flush()
+
+    def stats(self):
+        return {"depth": len(self), "ram_msgs": len(self.ram), "ram_bytes": self.ram_bytes,
+                "disk_msgs": self.disk_msgs, "disk_bytes": self.disk_bytes, "segments": len(self.segments),
+                "spooled": self.spooled, "dropped": self.dropped}
@@ -1,3 +1,5 @@
+import os
+import sys
 import time
 import random
 import json
@@ -21,6 +23,8 @@ OUTPUT_TOPIC = "habd/habd_info"
 DPU_ID = "DPU_01"
 SAMPLING_TIME = 0.001
 REF_SENSOR = "T2"
+# train_processed_info encoding: "json", "binary" or "binary_zlib" (see src/habd_wire.py)
+PROCESSED_INFO_FORMAT = "json"
 
 
 LOCO_TYPES = ["WAP7", "WAP5", "WDP4D", "WDP4", "WAG5", "WAG7", "WAG9"]
@@ -267,6 +271,17 @@ def generate_train_data():
     return processed_info, consolidated_info, rake_info, output_info
 
 
+def encode_processed_info(processed_info):
+    if PROCESSED_INFO_FORMAT == "json":
+        return json.dumps(processed_info)
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+    from habd_wire import encode_train_processed
+    return encode_train_processed(processed_info["train_id"], processed_info["dpu_id"], processed_info["ts"],
+                                  processed_info["axle_ids"], processed_info["axle_speeds"],
+                                  processed_info["temp_lefts"], processed_info["temp_rights"],
+                                  processed_info["rake_ids"], compress=PROCESSED_INFO_FORMAT == "binary_zlib")
+
+
 def on_connect(client, userdata, flags, reasonCode, properties=None):
     print(f"[MQTT] Connected to broker with reason code {reasonCode}")
 
@@ -280,7 +295,7 @@ def main():
     processed_info, consolidated_info, rake_info, output_info = generate_train_data()
     
     # Publish all messages
-    client.publish(PROCESSED_INFO_TOPIC, json.dumps(processed_info))
+    client.publish(PROCESSED_INFO_TOPIC, encode_processed_info(processed_info))
     client.publish(CONSOLIDATED_TOPIC, json.dumps(consolidated_info))
     client.publish(RAKE_INFO_TOPIC, json.dumps(rake_info))
     client.publish(OUTPUT_TOPIC, json.dumps(output_info))
@@ -17,17 +17,25 @@
 '''
 
 # '''Import python packages'''
+import io
 import sys
+import functools
 import json
+import logging
 import time
-from datetime import datetime, timedelta
+import threading
 from peewee import *
 
 # '''Import HABD packages '''
-from habd_model import TrainProcessedInfo, TrainConsolidatedInfo, EventInfo, ErrorInfo, HealthInfo
+from habd_model import TrainProcessedInfo, TrainConsolidatedInfo, EventInfo, ErrorInfo, HealthInfo, init_database, \
+    db_breaker, DatabaseUnavailable
 
 from habd_dlm_conf import HabdDlmConfRead
+from habd_write_buffer import WriteBehindBuffer
+from habd_cache import TrainAggregate, TrainAggregateCache, PendingTemperatureBuffer
+from habd_axles import AxleLimits, processed_axle_arrays, habd_temp_arrays, db_list
 from habd_event_error_pub import EventErrorPub
+from habd_common.habd_ack import fail_current_delivery
 from habd_log import Log
 from mqtt_client import *
 sys.path.insert(1, "/home/l2m/habd-v1/src/habd_common")
@@ -36,385 +44,510 @@ sys.path.insert(1, "/home/l2m/habd-v1/src/habd_common")
 class HabdAPI:
     '''HABD Database operations such as Select, Insert, Delete records'''
 
+    # One statement per train whatever its length, the per axle columns are bound as arrays
+    PROCESSED_INFO_UPSERT_SQL = '''
+        INSERT INTO train_processed_info
+        (ts, train_id, dpu_id, axle_id, axle_speed, rake_id,
+         left_temp, right_temp, wheel_status_left, wheel_status_right,
+         temp_difference)
+        SELECT %s, %s, %s, v.axle_id, v.axle_speed, v.rake_id, v.left_temp, v.right_temp, 1, 1, v.temp_difference
+        FROM unnest(%s::integer[], %s::float8[], %s::text[], %s::float8[], %s::float8[], %s::float8[])
+             AS v(axle_id, axle_speed, rake_id, left_temp, right_temp, temp_difference)
+        ON CONFLICT (train_id, axle_id)
+        DO UPDATE SET
+            ts = EXCLUDED.ts,
+            axle_speed = COALESCE(EXCLUDED.axle_speed, train_processed_info.axle_speed),
+            rake_id = COALESCE(EXCLUDED.rake_id, train_processed_info.rake_id),
+            left_temp = COALESCE(EXCLUDED.left_temp, train_processed_info.left_temp),
+            right_temp = COALESCE(EXCLUDED.right_temp, train_processed_info.right_temp),
+            temp_difference = COALESCE(EXCLUDED.temp_difference, train_processed_info.temp_difference)
+        RETURNING (xmax = 0) AS inserted
+    '''
+    HABD_TEMP_MERGE_SQL = '''
+        UPDATE train_processed_info AS t
+        SET left_temp = v.left_temp, right_temp = v.right_temp, temp_difference = v.temp_difference
+        FROM unnest(%s::integer[], %s::float8[], %s::float8[], %s::float8[])
+             AS v(axle_id, left_temp, right_temp, temp_difference)
+        WHERE t.train_id = %s AND t.axle_id = v.axle_id
+        RETURNING t.axle_id
+    '''
+    # Per-train temperature maxima computed over train_processed_info, first parameter is the train_id
+    MAX_TEMP_SUBQUERY_SQL = '''
+        SELECT MAX(left_temp) AS max_left_temp, MAX(right_temp) AS max_right_temp,
+               MAX(temp_difference) AS max_temp_difference
+        FROM train_processed_info WHERE train_id = %s
+    '''
+    CONSOLIDATED_TEMP_UPDATE_SQL = '''
+        UPDATE train_consolidated_info AS c
+        SET max_left_temp = m.max_left_temp, max_right_temp = m.max_right_temp,
+            max_temp_difference = m.max_temp_difference
+        FROM ({max_temps}) AS m
+        WHERE c.train_id = %s
+    '''.format(max_temps=MAX_TEMP_SUBQUERY_SQL)
+    # Same update with the maxima taken from the TrainAggregateCache
+    CONSOLIDATED_TEMP_UPDATE_CACHED_SQL = '''
+        UPDATE train_consolidated_info
+        SET max_left_temp = %s, max_right_temp = %s, max_temp_difference = %s
+        WHERE train_id = %s
+    '''
+    CONSOLIDATED_UPSERT_TEMPLATE = '''
+        {with_clause}
+        INSERT INTO train_consolidated_info
+        (train_id, dpu_id, entry_time, exit_time, total_axles, total_wheels,
+         direction, train_speed, train_type, train_processed, remark,
+         max_left_temp, max_right_temp, max_temp_difference)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, {max_temps})
+        ON CONFLICT (train_id)
+        DO UPDATE SET
+            dpu_id = EXCLUDED.dpu_id,
+            entry_time = EXCLUDED.entry_time,
+            exit_time = EXCLUDED.exit_time,
+            total_axles = EXCLUDED.total_axles,
+            total_wheels = EXCLUDED.total_wheels,
+            direction = EXCLUDED.direction,
+            train_speed = EXCLUDED.train_speed,
+            train_type = EXCLUDED.train_type,
+            train_processed = EXCLUDED.train_processed,
+            remark = EXCLUDED.remark,
+            max_left_temp = EXCLUDED.max_left_temp,
+            max_right_temp = EXCLUDED.max_right_temp,
+            max_temp_difference = EXCLUDED.max_temp_difference
+        RETURNING (xmax = 0) AS inserted
+    '''
+    # The aggregate runs once in the CTE, VALUES keeps the target column types for NULL parameters
+    CONSOLIDATED_UPSERT_SQL = CONSOLIDATED_UPSERT_TEMPLATE.format(
+        with_clause='WITH m AS ({max_temps})'.format(max_temps=MAX_TEMP_SUBQUERY_SQL),
+        max_temps='(SELECT max_left_temp FROM m), (SELECT max_right_temp FROM m), '
+                  '(SELECT max_temp_difference FROM m)')
+    CONSOLIDATED_UPSERT_CACHED_SQL = CONSOLIDATED_UPSERT_TEMPLATE.format(with_clause='', max_temps='%s, %s, %s')
+    # Train ids are time ordered (TYYYYmmddHHMMSS), so the oldest trains come first on the primary key.
+    # The axle rows of the evicted trains are deleted with them. train_processed_info cannot reference
+    # train_consolidated_info with a cascading foreign key because axle rows are written before their
+    # consolidated row arrives; axle rows that never got one are purged by age (ORPHAN_AXLE_SQL).
+    TRAIN_EVICT_SQL = '''
+        WITH evicted AS (
+            DELETE FROM train_consolidated_info
+            WHERE train_id IN (SELECT train_id FROM train_consolidated_info ORDER BY train_id LIMIT %s)
+            RETURNING train_id
+        ), axles AS (
+            DELETE FROM train_processed_info p USING evicted e
+            WHERE p.train_id = e.train_id
+            RETURNING 1
+        )
+        SELECT (SELECT COUNT(*) FROM evicted), (SELECT COUNT(*) FROM axles)
+    '''
+    ORPHAN_AXLE_SQL = '''
+        DELETE FROM train_processed_info WHERE id IN (
+            SELECT p.id FROM train_processed_info p
+            WHERE p.ts < %s
+              AND NOT EXISTS (SELECT 1 FROM train_consolidated_info c WHERE c.train_id = p.train_id)
+            LIMIT %s)
+    '''
+    PROCESSED_INFO_COLUMNS = ('ts, train_id, dpu_id, axle_id, axle_speed, rake_id, left_temp, right_temp, '
+                              'wheel_status_left, wheel_status_right, temp_difference')
+    # Session private staging table, emptied at every commit so pooled connections can reuse it
+    PROCESSED_INFO_STAGE_SQL = '''
+        CREATE TEMP TABLE IF NOT EXISTS train_processed_info_stage ON COMMIT DELETE ROWS AS
+        SELECT {columns} FROM train_processed_info WITH NO DATA
+    '''
+    PROCESSED_INFO_COPY_SQL = 'COPY train_processed_info_stage ({columns}) FROM STDIN'
+    PROCESSED_INFO_MERGE_SQL = '''
+        INSERT INTO train_processed_info ({columns})
+        SELECT {columns} FROM train_processed_info_stage
+        ON CONFLICT (train_id, axle_id)
+        DO UPDATE SET
+            ts = EXCLUDED.ts,
+            axle_speed = COALESCE(EXCLUDED.axle_speed, train_processed_info.axle_speed),
+            rake_id = COALESCE(EXCLUDED.rake_id, train_processed_info.rake_id),
+            left_temp = COALESCE(EXCLUDED.left_temp, train_processed_info.left_temp),
+            right_temp = COALESCE(EXCLUDED.right_temp, train_processed_info.right_temp),
+            temp_difference = COALESCE(EXCLUDED.temp_difference, train_processed_info.temp_difference)
+        RETURNING (xmax = 0) AS inserted
+    '''
+
     def __init__(self, cfg_obj, mq_client):
         self.mqtt_client = mq_client
         self.event_msg_id = 0
         self.error_msg_id = 0
         self.dpu_id = cfg_obj.dpu_id
-        self.dlm_pub = EventErrorPub(mq_client, self.dpu_id)
+        self.dlm_pub = EventErrorPub(mq_client, self.dpu_id, cfg_obj.event_error_pub.RATE_PER_SEC,
+                                     cfg_obj.event_error_pub.BURST, cfg_obj.event_error_pub.COALESCE_WINDOW_SEC)
         self.psql_db = None  # Initialize psql_db
+        self.processed_info_mode = cfg_obj.ingest.PROCESSED_INFO_MODE
+        self.copy_min_axles = cfg_obj.ingest.COPY_MIN_AXLES
+        self.axle_limits = AxleLimits(cfg_obj.ingest.AXLE_TEMP_MIN, cfg_obj.ingest.AXLE_TEMP_MAX,
+                                      cfg_obj.ingest.AXLE_SPEED_MAX)
+        self.max_trains = cfg_obj.retention.MAX_TRAINS
+        self.train_evict_batch = cfg_obj.retention.TRAIN_EVICT_BATCH
+        self.consolidated_count = None
+        # Worker processes writing the table (see habd_supervisor). Each process counts its own inserts only,
+        # with more than one the count is estimated from them and read again before an eviction
+        self.table_writers = 1
+        # Writer threads share this object, the consolidated row count is updated under this lock
+        self.consolidated_count_lock = threading.Lock()
+        self.event_info_days = cfg_obj.retention.EVENT_INFO_DAYS
+        self.error_info_days = cfg_obj.retention.ERROR_INFO_DAYS
+        self.health_info_days = cfg_obj.retention.HEALTH_INFO_DAYS
+        self.purge_chunk_size = cfg_obj.retention.PURGE_CHUNK_SIZE
+        self.orphan_axle_hours = cfg_obj.retention.ORPHAN_AXLE_HOURS
+
+        self.aggregate_cache = TrainAggregateCache(cfg_obj.ingest.AGGREGATE_CACHE_TRAINS,
+                                                   cfg_obj.ingest.AGGREGATE_CACHE_TTL_SEC)
+        # habd_info temperatures that arrived before the train_processed_info of their train
+        self.pending_temps = PendingTemperatureBuffer(cfg_obj.ingest.PENDING_TEMP_MAX_AXLES,
+                                                      cfg_obj.ingest.PENDING_TEMP_TTL_SEC)
+
+        # Event, error and health rows are group committed by one write-behind buffer per table
+        batch_rows = cfg_obj.ingest.LOG_BATCH_ROWS
+        batch_delay_ms = cfg_obj.ingest.LOG_BATCH_DELAY_MS
+        self.event_buffer = WriteBehindBuffer(EventInfo, batch_rows, batch_delay_ms, functools.partial(
+            self.publish_write_error, "DLM-ERROR-022", "insert_habd_event_info"))
+        # Failed error_info writes are only logged, as before, so they cannot feed back into more errors
+        self.error_buffer = WriteBehindBuffer(ErrorInfo, batch_rows, batch_delay_ms)
+        self.health_buffer = WriteBehindBuffer(HealthInfo, batch_rows, batch_delay_ms, functools.partial(
+            self.publish_write_error, "DLM-ERROR-025", "insert_habd_health_info"))
 
     def connect_database(self, config):
-        '''Establish connection with database'''
+        '''Establish connection with database through the pool shared with the models'''
         try:
             db_name = config.database.DB_NAME
-            user = config.database.USER
-            password = config.database.PASSWORD
-            host = config.database.HOST
-            port = 5432
 
             if len(db_name) == 0:
                 Log.logger.critical("habd_api: connect_database:  database name missing")
                 self.dlm_pub.publish_error_info("dlm", "DLM-ERROR-011", EventErrorPub.CRITICAL,
                                                 "habd_api: connect_database: database name missing")
             else:
-                self.psql_db = PostgresqlDatabase(db_name, user=user, password=password, host=host, port=port)
+                db_breaker.on_transition = self.on_db_transition
+                self.psql_db = init_database(config.database)
                 if self.psql_db:
                     try:
-                        self.psql_db.connect()
+                        self.psql_db.connect(reuse_if_open=True)
                         Log.logger.info(f'habd_api: database connection successful')
                         return self.psql_db
                     except Exception as e:
                         Log.logger.critical(f'habd_api: connect_database: {e}', exc_info=True)
-                        self.dlm_pub.publish_error_info("dlm", "DLM-ERROR-012", EventErrorPub.CRITICAL,
-                                                        "habd_api: connect_database:" + str(e))
-                        sys.exit(1)
+                        self.publish_db_error("DLM-ERROR-012", e,
+                                              "habd_api: connect_database:" + str(e))
+                        # Keep running, the ingest journal holds the messages until the database is reachable
+                        return self.psql_db
                 else:
                     return None
 
         except Exception as e:
             Log.logger.critical(f"habd_api: connect_database: Exception: {e}", exc_info=True)
-            self.dlm_pub.publish_error_info("dlm", "DLM-ERROR-013", EventErrorPub.CRITICAL,
-                                            "habd_api: connect_database: Exception: " + str(e))
+            self.publish_db_error("DLM-ERROR-013", e,
+                                  "habd_api: connect_database: Exception: " + str(e))
 
-    def insert_train_processed_info(self, data):
-        '''insert train processed info in database table'''
+    def insert_train_processed_info(self, msg):
+        '''insert train processed info (TrainProcessedMsg) in database table'''
+        pending = None
         try:
-            json_data = json.loads(data)
-
-            Log.logger.warning(f'=== TRAIN PROCESSED INFO ===')
-            Log.logger.warning(f'Train ID: {json_data["train_id"]}')
-            Log.logger.warning(f'Number of axle_ids: {len(json_data["axle_ids"])}')
+            # Hot path: %-style arguments are only formatted when the record is written
+            Log.logger.warning('=== TRAIN PROCESSED INFO === Train ID: %s, axle_ids: %d, temperatures left: %d, '
+                               'right: %d, rake_ids: %d', msg.train_id, len(msg.axle_ids), len(msg.temp_lefts),
+                               len(msg.temp_rights), len(msg.rake_ids))
 
-            # Check if temperature data is available in this message
-            has_temp_data = "temp_lefts" in json_data and "temp_rights" in json_data
-            Log.logger.warning(f'Temperature data available: {has_temp_data}')
+            axles = self.build_train_processed_arrays(msg)
 
-            # Default values for required fields
-            wheel_status_left = 1
-            wheel_status_right = 1
+            # Temperatures of an earlier habd_info go into the same upsert
+            pending = self.pending_temps.pop(msg.train_id)
+            if pending is not None:
+                axles = self.apply_pending_temperatures(axles, pending)
 
-            # Use get() method with default empty lists for temperature fields
-            temp_lefts = json_data.get("temp_lefts", [])
-            temp_rights = json_data.get("temp_rights", [])
-            
-            # Get rake_ids - handle both "rake_id" and "rake_ids" keys
-            rake_ids = json_data.get("rake_id", json_data.get("rake_ids", []))
+            cached = self.aggregate_cache.get(msg.train_id)
+            aggregate = cached if cached is not None else TrainAggregate()
+            aggregate.merge_processed_rows(axles.rows())
 
-            Log.logger.warning(f'Temperature data - Left: {len(temp_lefts)}, Right: {len(temp_rights)}')
-            Log.logger.warning(f'Rake IDs available: {len(rake_ids)}')
-
-            inserted_count = 0
-            updated_count = 0
-            
             # Use transaction for atomic operations
             with self.psql_db.atomic():
-                for i in range(len(json_data["axle_ids"])):
-                    axle_id = json_data["axle_ids"][i]
-                    rake_id = rake_ids[i] if i < len(rake_ids) else None
-                    
-                    # Log rake_id for debugging (first 5 axles)
-                    if i < 5:
-                        Log.logger.warning(f'Axle {axle_id} rake_id: {rake_id}')
-
-                    # Handle temperature data properly
-                    if i < len(temp_lefts) and temp_lefts[i] is not None and temp_lefts[i] != -1:
-                        left_temp = float(temp_lefts[i])
-                    else:
-                        left_temp = None
-
-                    if i < len(temp_rights) and temp_rights[i] is not None and temp_rights[i] != -1:
-                        right_temp = float(temp_rights[i])
-                    else:
-                        right_temp = None
-
-                    # Calculate temperature difference
-                    if left_temp is not None and right_temp is not None:
-                        temp_difference = abs(left_temp - right_temp)
-                    else:
-                        temp_difference = None
+                inserted_count, updated_count = self.write_train_processed_arrays(axles)
+
+            # A fresh aggregate is only complete when none of the axles were already stored
+            if cached is not None or updated_count == 0:
+                self.aggregate_cache.put(msg.train_id, aggregate)
+            else:
+                self.aggregate_cache.discard(msg.train_id)
+
+            Log.logger.warning('Train processed info: %s - %d inserted, %d updated', msg.train_id, inserted_count,
+                               updated_count)
 
-                    try:
-                        # Use INSERT ON CONFLICT (UPSERT) with all required fields including rake_id
-                        query = '''
-                            INSERT INTO train_processed_info 
-                            (ts, train_id, dpu_id, axle_id, axle_speed, rake_id, 
-                             left_temp, right_temp, wheel_status_left, wheel_status_right, 
-                             temp_difference)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                            ON CONFLICT (train_id, axle_id) 
-                            DO UPDATE SET
-                                ts = EXCLUDED.ts,
-                                axle_speed = COALESCE(EXCLUDED.axle_speed, train_processed_info.axle_speed),
-                                rake_id = COALESCE(EXCLUDED.rake_id, train_processed_info.rake_id),
-                                left_temp = COALESCE(EXCLUDED.left_temp, train_processed_info.left_temp),
-                                right_temp = COALESCE(EXCLUDED.right_temp, train_processed_info.right_temp),
-                                temp_difference = COALESCE(EXCLUDED.temp_difference, train_processed_info.temp_difference)
-                        '''
-                        
-                        params = (
-                            json_data["ts"],
-                            json_data["train_id"],
-                            json_data["dpu_id"],
-                            axle_id,
-                            json_data["axle_speeds"][i] if i < len(json_data.get("axle_speeds", [])) else None,
-                            rake_id,
-                            left_temp,
-                            right_temp,
-                            wheel_status_left,
-                            wheel_status_right,
-                            temp_difference
-                        )
-                        
-                        cursor = self.psql_db.execute_sql(query, params)
-                        
-                        if cursor.rowcount == 1:
-                            # For logging purposes
-                            if has_temp_data and (left_temp is not None or right_temp is not None):
-                                updated_count += 1
-                            else:
-                                inserted_count += 1
-                                
-                    except Exception as e:
-                        if 'duplicate' in str(e).lower() or 'unique' in str(e).lower():
-                            Log.logger.warning(f'Duplicate detected for train {json_data["train_id"]} axle {axle_id}, attempting update')
-                            # Try to update the existing record with ALL fields including rake_id
-                            try:
-                                update_query = '''
-                                    UPDATE train_processed_info 
-                                    SET ts = %s,
-                                        axle_speed = COALESCE(%s, axle_speed),
-                                        rake_id = COALESCE(%s, rake_id),
-                                        left_temp = COALESCE(%s, left_temp),
-                                        right_temp = COALESCE(%s, right_temp),
-                                        temp_difference = COALESCE(%s, temp_difference)
-                                    WHERE train_id = %s AND axle_id = %s
-                                '''
-                                update_params = (
-                                    json_data["ts"],
-                                    json_data["axle_speeds"][i] if i < len(json_data.get("axle_speeds", [])) else None,
-                                    rake_id,
-                                    left_temp,
-                                    right_temp,
-                                    temp_difference,
-                                    json_data["train_id"],
-                                    axle_id
-                                )
-                                cursor = self.psql_db.execute_sql(update_query, update_params)
-                                if cursor.rowcount > 0:
-                                    updated_count += 1
-                                    Log.logger.debug(f'Updated existing record for axle {axle_id} with rake_id: {rake_id}')
-                            except Exception as update_error:
-                                Log.logger.error(f'Failed to update duplicate record for axle {axle_id}: {update_error}')
-                        else:
-                            Log.logger.error(f'Failed to process record for axle {axle_id}: {e}')
-
-            Log.logger.warning(f'Train processed info: {json_data["train_id"]} - {inserted_count} inserted, {updated_count} updated')
-                
         except Exception as e:
+            if pending is not None:
+                # Keep the early temperatures for a retransmitted train_processed_info
+                self.pending_temps.put(msg.train_id, pending)
+            fail_current_delivery()
             Log.logger.critical(f'insert_train_processed_info: Exception raised: {e}', exc_info=True)
-            self.dlm_pub.publish_error_info("dlm", "DLM-ERROR-014", EventErrorPub.CRITICAL,
-                                            "habd_api: insert_train_processed_info: Exception raised: " + str(e))
-
-    def insert_habd_temp_info(self, data):
-        '''Insert temperature data from HABD info message'''
+            self.publish_db_error("DLM-ERROR-014", e,
+                                  "habd_api: insert_train_processed_info: Exception raised: " + str(e))
+
+    def build_train_processed_arrays(self, msg):
+        '''
+        Per axle arrays of a TrainProcessedMsg, sentinels and implausible readings masked. A repeated axle_id
+        keeps its last reading, one statement cannot upsert the same key twice
+        '''
+        axles = processed_axle_arrays(msg, self.axle_limits)
+
+        # Log rake_id for debugging (first 5 axles)
+        if Log.logger.isEnabledFor(logging.DEBUG):
+            Log.logger.debug('Axle rake_ids: %s', list(zip(axles.axle_ids[:5].tolist(), axles.rake_ids[:5].tolist())))
+        if axles.out_of_range:
+            Log.logger.warning('Train processed info: %s - %d out of range readings stored as NULL', msg.train_id,
+                               axles.out_of_range)
+        return axles
+
+    @staticmethod
+    def apply_pending_temperatures(axles, pending):
+        '''Overwrite axle temperatures with buffered habd_info readings, as the habd_info UPDATE would have'''
+        Log.logger.warning('Train processed info: %s - %d early habd_info temperatures merged', axles.train_id,
+                           len(pending))
+        return axles.with_temperatures(pending)
+
+    def write_train_processed_arrays(self, axles):
+        '''Write train_processed_info axles using the configured ingest mode'''
+        if self.processed_info_mode == "copy" or \
+                (self.processed_info_mode == "auto" and axles.axle_count() >= self.copy_min_axles):
+            return self.copy_train_processed_rows(axles.rows())
+        return self.upsert_train_processed_arrays(axles)
+
+    def upsert_train_processed_arrays(self, axles):
+        '''
+        Upsert train_processed_info axles with one INSERT ... SELECT FROM unnest ... ON CONFLICT statement.
+        Must be called inside a transaction. Returns (inserted_count, updated_count).
+        '''
+        cursor = self.psql_db.execute_sql(HabdAPI.PROCESSED_INFO_UPSERT_SQL,
+                                          (axles.ts, axles.train_id, axles.dpu_id) + axles.columns())
+        # xmax is 0 only for freshly inserted tuples, non-zero for rows taken by DO UPDATE
+        inserted_count = 0
+        updated_count = 0
+        for (inserted,) in cursor.fetchall():
+            if inserted:
+                inserted_count += 1
+            else:
+                updated_count += 1
+        return inserted_count, updated_count
+
+    def copy_train_processed_rows(self, rows):
+        '''
+        Stream train_processed_info rows with COPY FROM STDIN into a temporary staging table and merge
+        them with one INSERT ... SELECT ... ON CONFLICT. Must be called inside a transaction.
+        Returns (inserted_count, updated_count).
+        '''
+        columns = HabdAPI.PROCESSED_INFO_COLUMNS
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write('\t'.join([self.copy_text_value(value) for value in row]))
+            buffer.write('\n')
+        buffer.seek(0)
+
+        cursor = self.psql_db.cursor()
+        cursor.execute(HabdAPI.PROCESSED_INFO_STAGE_SQL.format(columns=columns))
+        cursor.copy_expert(HabdAPI.PROCESSED_INFO_COPY_SQL.format(columns=columns), buffer)
+        cursor.execute(HabdAPI.PROCESSED_INFO_MERGE_SQL.format(columns=columns))
+
+        inserted_count = 0
+        updated_count = 0
+        for (inserted,) in cursor.fetchall():
+            if inserted:
+                inserted_count += 1
+            else:
+                updated_count += 1
+        return inserted_count, updated_count
+
+    @staticmethod
+    def copy_text_value(value):
+        '''Format one value for the COPY text format'''
+        if value is None:
+            return '\\N'
+        if isinstance(value, str):
+            return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+        return str(value)
+
+    def insert_habd_temp_info(self, msg):
+        '''Insert temperature data from HABD info message (HabdInfoMsg)'''
         try:
-            json_data = json.loads(data)
-            train_id = json_data["train_id"]
-            
-            Log.logger.warning(f'=== HABD TEMPERATURE INFO ===')
-            Log.logger.warning(f'Train ID: {train_id}')
-            Log.logger.warning(f'Number of axle_ids: {len(json_data["axle_ids"])}')
-
-            updated_count = 0
-            
-            # Use transaction for atomic operations
-            with self.psql_db.atomic():
-                for i in range(len(json_data["axle_ids"])):
-                    axle_id = json_data["axle_ids"][i]
-                    
-                    # Get temperature values
-                    left_temp = float(json_data["temp_lefts"][i]) if i < len(json_data["temp_lefts"]) else None
-                    right_temp = float(json_data["temp_rights"][i]) if i < len(json_data["temp_rights"]) else None
-                    
-                    # Calculate temperature difference
-                    if left_temp is not None and right_temp is not None:
-                        temp_difference = abs(left_temp - right_temp)
-                    else:
-                        temp_difference = None
+            train_id = msg.train_id
 
-                    try:
-                        # First, try to UPDATE existing record - DON'T create new ones
-                        update_query = '''
-                            UPDATE train_processed_info 
-                            SET left_temp = %s, right_temp = %s, temp_difference = %s
-                            WHERE train_id = %s AND axle_id = %s
-                        '''
-                        
-                        params = (left_temp, right_temp, temp_difference, train_id, axle_id)
-                        cursor = self.psql_db.execute_sql(update_query, params)
-                        
-                        if cursor.rowcount > 0:
-                            updated_count += 1
-                            Log.logger.debug(f'Updated temperature for axle {axle_id}: L={left_temp}, R={right_temp}')
-                        else:
-                            # If no record was updated, log warning but don't create new record
-                            Log.logger.warning(f'No existing record found for train {train_id} axle {axle_id} to update temperatures')
-                            # The record should be created by train_processed_info message
-                            
-                    except Exception as e:
-                        Log.logger.error(f'Failed to update temperature data for axle {axle_id}: {e}')
+            Log.logger.warning('=== HABD TEMPERATURE INFO === Train ID: %s, axle_ids: %d', train_id, len(msg.axle_ids))
+
+            axle_ids, left_temps, right_temps, temp_differences = self.build_habd_temp_arrays(msg)
+
+            aggregate = self.aggregate_cache.get(train_id)
+            if aggregate is not None:
+                aggregate.merge_temperatures(axle_ids, left_temps, right_temps, temp_differences)
+
+            # Use transaction for atomic operations: one set-based axle update plus one aggregate update
+            with self.psql_db.atomic():
+                # Only UPDATE existing records - the rows are created by the train_processed_info message
+                cursor = self.psql_db.execute_sql(HabdAPI.HABD_TEMP_MERGE_SQL,
+                                                  (axle_ids, left_temps, right_temps, temp_differences, train_id))
+                matched_axles = set(row[0] for row in cursor.fetchall())
+                updated_count = len(matched_axles)
+                self.update_consolidated_temperatures(train_id, aggregate)
+            if aggregate is not None:
+                self.aggregate_cache.put(train_id, aggregate)
+
+            if updated_count < len(axle_ids):
+                # habd_info came before train_processed_info, hold the rest until the rows exist
+                unmatched = {axle_ids[i]: (left_temps[i], right_temps[i], temp_differences[i])
+                             for i in range(len(axle_ids)) if axle_ids[i] not in matched_axles}
+                # With manual ack this habd_info is acknowledged while held here, waiting for a train that may
+                # arrive after the ack window is full would stall the in-order acknowledgements
+                self.pending_temps.put(train_id, unmatched)
+                Log.logger.warning('No existing record found for train %s: %d axles held until train_processed_info '
+                                   'arrives', train_id, len(unmatched))
+            Log.logger.warning('HABD temp info: %s - %d records updated', train_id, updated_count)
 
-            Log.logger.warning(f'HABD temp info: {train_id} - {updated_count} records updated')
-            
-            # Update consolidated info with max temperatures
-            self.update_consolidated_temperatures(train_id)
-            
         except Exception as e:
+            fail_current_delivery()
             Log.logger.critical(f'insert_habd_temp_info: Exception raised: {e}', exc_info=True)
-            self.dlm_pub.publish_error_info("dlm", "DLM-ERROR-027", EventErrorPub.CRITICAL,
-                                            "habd_api: insert_habd_temp_info: Exception raised: " + str(e))
-
-    def update_consolidated_temperatures(self, train_id):
-        '''Update max temperatures in consolidated info'''
+            self.publish_db_error("DLM-ERROR-027", e,
+                                  "habd_api: insert_habd_temp_info: Exception raised: " + str(e))
+
+    def build_habd_temp_arrays(self, msg):
+        '''Build the axle_id, left, right and difference lists of a HabdInfoMsg, implausible readings as None'''
+        axle_ids, left_temps, right_temps, temp_differences, out_of_range = habd_temp_arrays(msg, self.axle_limits)
+        if out_of_range:
+            Log.logger.warning('HABD temp info: %s - %d out of range readings stored as NULL', msg.train_id,
+                               out_of_range)
+        return axle_ids.tolist(), db_list(left_temps), db_list(right_temps), db_list(temp_differences)
+
+    def update_consolidated_temperatures(self, train_id, aggregate=None):
+        '''
+        Update max temperatures in consolidated info, from the cached aggregate when there is one,
+        otherwise aggregated in the database. Runs inside the caller's transaction, so errors are left
+        to the caller.
+        '''
+        if aggregate is not None:
+            cursor = self.psql_db.execute_sql(HabdAPI.CONSOLIDATED_TEMP_UPDATE_CACHED_SQL,
+                                              aggregate.max_temps() + (train_id,))
+        else:
+            cursor = self.psql_db.execute_sql(HabdAPI.CONSOLIDATED_TEMP_UPDATE_SQL, (train_id, train_id))
+
+        if cursor.rowcount == 0:
+            # No record exists, we'll skip creating one here
+            Log.logger.warning('No consolidated record found for %s to update temperatures', train_id)
+        else:
+            Log.logger.warning('Updated max temps for %s', train_id)
+
+    def insert_train_consolidated_info(self, msg):
+        '''insert train consolidated info (TrainConsolidatedMsg) in train_consolidated_info table'''
         try:
-            # Calculate max temperatures from processed data
-            processed_records = self.select_train_processed_info(train_id)
-            max_left_temp = None
-            max_right_temp = None
-            max_temp_difference = None
-
-            if processed_records:
-                left_temps = [r.left_temp for r in processed_records if r.left_temp is not None]
-                right_temps = [r.right_temp for r in processed_records if r.right_temp is not None]
-                temp_diffs = [r.temp_difference for r in processed_records if r.temp_difference is not None]
-                
-                if left_temps:
-                    max_left_temp = max(left_temps)
-                if right_temps:
-                    max_right_temp = max(right_temps)
-                if temp_diffs:
-                    max_temp_difference = max(temp_diffs)
-
-            # Update consolidated record using direct SQL
             try:
-                # First try to update existing record
-                update_query = '''
-                    UPDATE train_consolidated_info 
-                    SET max_left_temp = %s, max_right_temp = %s, max_temp_difference = %s
-                    WHERE train_id = %s
-                '''
-                params = (max_left_temp, max_right_temp, max_temp_difference, train_id)
-                cursor = self.psql_db.execute_sql(update_query, params)
-                
-                if cursor.rowcount == 0:
-                    # No record exists, we'll skip creating one here
-                    Log.logger.warning(f'No consolidated record found for {train_id} to update temperatures')
+                inserted = self.upsert_train_consolidated(msg, self.aggregate_cache.get(msg.train_id))
+                if inserted:
+                    Log.logger.warning('Inserted consolidated info: %s', msg.train_id)
                 else:
-                    Log.logger.warning(f'Updated max temps for {train_id}: L={max_left_temp}, R={max_right_temp}, Diff={max_temp_difference}')
-                    
+                    Log.logger.warning('Updated consolidated info: %s', msg.train_id)
+
+                ''' perform memory management '''
+                self.train_consolidated_info_mem_mgmt(inserted)
+
             except Exception as e:
-                Log.logger.error(f'Error updating consolidated temperatures for {train_id}: {e}')
-                
-        except Exception as e:
-            Log.logger.error(f'Error updating consolidated temperatures for {train_id}: {e}')
+                fail_current_delivery()
+                Log.logger.error(f'Error in consolidated info for {msg.train_id}: {e}')
 
-    def insert_train_consolidated_info(self, data):
-        '''insert train consolidated info in train_consolidated_info table'''
+        except Exception as e:
+            fail_current_delivery()
+            Log.logger.critical(f'habd_api: insert_train_consolidated_info: {msg.train_id} exception: {e}', exc_info=True)
+            self.publish_db_error("DLM-ERROR-018", e,
+                                  "habd_api: insert_train_consolidated_info : exception : " + str(e))
+
+    def upsert_train_consolidated(self, msg, aggregate=None):
+        '''
+        Single upsert of a consolidated row, max temperatures come from the cached aggregate or are aggregated
+        from train_processed_info in the same statement. Returns True when the row was inserted.
+        '''
+        params = (
+            msg.train_id,
+            self.dpu_id,
+            msg.train_entry_time,
+            msg.train_exit_time,
+            msg.total_axles,
+            msg.total_wheels,
+            msg.direction,
+            msg.train_speed,
+            msg.train_type,
+            msg.train_processed,
+            msg.remark
+        )
+        if aggregate is not None:
+            cursor = self.psql_db.execute_sql(HabdAPI.CONSOLIDATED_UPSERT_CACHED_SQL, params + aggregate.max_temps())
+        else:
+            cursor = self.psql_db.execute_sql(HabdAPI.CONSOLIDATED_UPSERT_SQL, (msg.train_id,) + params)
+        return cursor.fetchone()[0]
+
+    def commit_train_assembly(self, train_id, parts):
+        '''
+        Write the assembled messages of one train ({part name: typed message}, see TrainAssembler) in a single
+        transaction. habd_info temperatures are overlaid on the processed rows, so the axle rows are written once.
+        Returns False when the transaction failed
+        '''
+        processed = parts.get("train_processed_info")
+        habd = parts.get("habd_info")
+        consolidated = parts.get("train_consolidated_info")
+        pending = None
         try:
-            json_data = json.loads(data)
-
-            # Calculate max temperatures from processed data
-            processed_records = self.select_train_processed_info(json_data["train_id"])
-            max_left_temp = None
-            max_right_temp = None
-            max_temp_difference = None
-
-            if processed_records:
-                left_temps = [r.left_temp for r in processed_records if r.left_temp is not None]
-                right_temps = [r.right_temp for r in processed_records if r.right_temp is not None]
-                temp_diffs = [r.temp_difference for r in processed_records if r.temp_difference is not None]
-                
-                if left_temps:
-                    max_left_temp = max(left_temps)
-                if right_temps:
-                    max_right_temp = max(right_temps)
-                if temp_diffs:
-                    max_temp_difference = max(temp_diffs)
+            habd_arrays = None
+            temps = None
+            if habd is not None:
+                habd_arrays = self.build_habd_temp_arrays(habd)
+                axle_ids, left_temps, right_temps, temp_differences = habd_arrays
+                temps = {axle_ids[i]: (left_temps[i], right_temps[i], temp_differences[i])
+                         for i in range(len(axle_ids))}
+
+            cached = self.aggregate_cache.get(train_id)
+            aggregate = cached
+            unmatched = None
+            inserted = None
+            with self.psql_db.atomic():
+                if processed is not None:
+                    axles = self.build_train_processed_arrays(processed)
+                    pending = self.pending_temps.pop(train_id)
+                    early_temps = dict(pending) if pending is not None else {}
+                    if temps is not None:
+                        early_temps.update(temps)
+                    if early_temps:
+                        axles = self.apply_pending_temperatures(axles, early_temps)
+                    if aggregate is None:
+                        aggregate = TrainAggregate()
+                    aggregate.merge_processed_rows(axles.rows())
+                    inserted_count, updated_count = self.write_train_processed_arrays(axles)
+                    # A fresh aggregate is only complete when none of the axles were already stored
+                    if cached is None and updated_count > 0:
+                        aggregate = None
+                    Log.logger.warning('Train assembly: %s - %d axles inserted, %d updated', train_id, inserted_count,
+                                       updated_count)
+                elif temps is not None:
+                    # No processed info before the deadline, update the stored axles as habd_info alone does
+                    if aggregate is not None:
+                        aggregate.merge_temperatures(*habd_arrays)
+                    cursor = self.psql_db.execute_sql(HabdAPI.HABD_TEMP_MERGE_SQL, habd_arrays + (train_id,))
+                    matched_axles = set(row[0] for row in cursor.fetchall())
+                    unmatched = {axle_id: temp for axle_id, temp in temps.items() if axle_id not in matched_axles}
+                    if consolidated is None:
+                        self.update_consolidated_temperatures(train_id, aggregate)
+
+                if consolidated is not None:
+                    inserted = self.upsert_train_consolidated(consolidated, aggregate)
+
+            if aggregate is not None:
+                self.aggregate_cache.put(train_id, aggregate)
+            else:
+                self.aggregate_cache.discard(train_id)
+            if unmatched:
+                self.pending_temps.put(train_id, unmatched)
+            if inserted is not None:
+                self.train_consolidated_info_mem_mgmt(inserted)
+            Log.logger.warning('Train assembly: %s committed with %s', train_id, sorted(parts))
+            return True
 
-            try:
-                # Use direct SQL to avoid ON CONFLICT issues
-                # First check if record exists
-                check_query = "SELECT 1 FROM train_consolidated_info WHERE train_id = %s"
-                cursor = self.psql_db.execute_sql(check_query, (json_data["train_id"],))
-                exists = cursor.fetchone() is not None
-                
-                if exists:
-                    # Update existing record
-                    update_query = '''
-                        UPDATE train_consolidated_info 
-                        SET dpu_id = %s, entry_time = %s, exit_time = %s, total_axles = %s,
-                            total_wheels = %s, direction = %s, train_speed = %s, train_type = %s,
-                            train_processed = %s, remark = %s, max_left_temp = %s,
-                            max_right_temp = %s, max_temp_difference = %s
-                        WHERE train_id = %s
-                    '''
-                    params = (
-                        self.dpu_id,
-                        json_data["train_entry_time"],
-                        json_data["train_exit_time"],
-                        json_data["total_axles"],
-                        json_data["total_wheels"],
-                        json_data["direction"],
-                        json_data["train_speed"],
-                        json_data["train_type"],
-                        json_data["train_processed"],
-                        json_data["remark"],
-                        max_left_temp,
-                        max_right_temp,
-                        max_temp_difference,
-                        json_data["train_id"]
-                    )
-                    self.psql_db.execute_sql(update_query, params)
-                    Log.logger.warning(f'Updated consolidated info: {json_data["train_id"]}')
-                else:
-                    # Insert new record
-                    insert_query = '''
-                        INSERT INTO train_consolidated_info 
-                        (train_id, dpu_id, entry_time, exit_time, total_axles, total_wheels,
-                         direction, train_speed, train_type, train_processed, remark,
-                         max_left_temp, max_right_temp, max_temp_difference)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    '''
-                    params = (
-                        json_data["train_id"],
-                        self.dpu_id,
-                        json_data["train_entry_time"],
-                        json_data["train_exit_time"],
-                        json_data["total_axles"],
-                        json_data["total_wheels"],
-                        json_data["direction"],
-                        json_data["train_speed"],
-                        json_data["train_type"],
-                        json_data["train_processed"],
-                        json_data["remark"],
-                        max_left_temp,
-                        max_right_temp,
-                        max_temp_difference
-                    )
-                    self.psql_db.execute_sql(insert_query, params)
-                    Log.logger.warning(f'Inserted consolidated info: {json_data["train_id"]}')
-                
-                ''' perform memory management '''
-                self.train_consolidated_info_mem_mgmt()
-                
-            except Exception as e:
-                Log.logger.error(f'Error in consolidated info for {json_data["train_id"]}: {e}')
-                
         except Exception as e:
-            Log.logger.critical(f'habd_api: insert_train_consolidated_info: {json_data["train_id"]} exception: {e}', exc_info=True)
-            self.dlm_pub.publish_error_info("dlm", "DLM-ERROR-018", EventErrorPub.CRITICAL,
-                                            "habd_api: insert_train_consolidated_info : exception : " + str(e))
+            if pending is not None:
+                self.pending_temps.put(train_id, pending)
+            Log.logger.critical(f'habd_api: commit_train_assembly: {train_id} exception: {e}', exc_info=True)
+            self.publish_db_error("DLM-ERROR-028", e,
+                                  "habd_api: commit_train_assembly: exception: " + str(e))
+            return False
 
     def train_processed_info_mem_mgmt(self, train_id):
         '''Perform memory management of train_processed_info table'''
@@ -425,8 +558,8 @@ class HabdAPI:
 
         except Exception as e:
             Log.logger.critical(f'habd_api: train_processed_info_mem_mgmt: exception: {e}', exc_info=True)
-            self.dlm_pub.publish_error_info("dlm", "DLM-ERROR-015", EventErrorPub.CRITICAL,
-                                            "habd_api: train_processed_info_mem_mgmt: exception: " + str(e))
+            self.publish_db_error("DLM-ERROR-015", e,
+                                  "habd_api: train_processed_info_mem_mgmt: exception: " + str(e))
 
     def select_train_processed_info(self, train_id):
         '''Get store records from train_processed_info'''
@@ -435,33 +568,41 @@ class HabdAPI:
             return list(records)
         except Exception as e:
             Log.logger.critical(f"habd_api: select_train_processed_info : exception : {e}", exc_info=True)
-            self.dlm_pub.publish_error_info("dlm", "DLM-ERROR-017", EventErrorPub.CRITICAL,
-                                            "habd_api: select_train_processed_info : exception : " + str(e))
+            self.publish_db_error("DLM-ERROR-017", e,
+                                  "habd_api: select_train_processed_info : exception : " + str(e))
             return []
 
-    def train_consolidated_info_mem_mgmt(self):
-        '''Perform memory management of train_consolidated_info table'''
+    def train_consolidated_info_mem_mgmt(self, inserted=True):
+        '''
+        Perform memory management of train_consolidated_info table.
+        The row count is read once and then tracked incrementally; once it exceeds MAX_TRAINS the oldest
+        trains are evicted together with their train_processed_info rows in one statement. With several
+        table_writers the table is counted again before evicting.
+        '''
         try:
-            records = (
-                TrainConsolidatedInfo.select(TrainConsolidatedInfo.train_id).order_by(TrainConsolidatedInfo.train_id))
-            total_records = len(records)
-            Log.logger.info(f'No.of records in train_consolidated_info table: {total_records}')
-
-            if total_records > 5000:
-                oldest_train_id = records[0].train_id
-                Log.logger.info(f'Deleting oldest record: {oldest_train_id}')
-                query = TrainConsolidatedInfo.delete().where(
-                    TrainConsolidatedInfo.train_id == oldest_train_id)
-                query.execute()
-                Log.logger.info(f'Deleted first record in train_consolidated_info table')
-
-                '''train_processed_info memory management'''
-                self.train_processed_info_mem_mgmt(oldest_train_id)
+            with self.consolidated_count_lock:
+                if self.consolidated_count is None:
+                    self.consolidated_count = TrainConsolidatedInfo.select().count()
+                elif inserted:
+                    self.consolidated_count += self.table_writers
+                if self.consolidated_count > self.max_trains and self.table_writers > 1:
+                    self.consolidated_count = TrainConsolidatedInfo.select().count()
+                Log.logger.info(f'No.of records in train_consolidated_info table: {self.consolidated_count}')
+
+                if self.consolidated_count > self.max_trains:
+                    # Trim below the limit so eviction runs once every TRAIN_EVICT_BATCH trains, not on every insert
+                    evict_count = self.consolidated_count - self.max_trains + self.train_evict_batch
+                    cursor = self.psql_db.execute_sql(HabdAPI.TRAIN_EVICT_SQL, (evict_count,))
+                    evicted_trains, evicted_axles = cursor.fetchone()
+                    self.consolidated_count -= evicted_trains
+                    Log.logger.info(f'Evicted {evicted_trains} oldest trains and {evicted_axles} axle records')
 
         except Exception as e:
+            # Recount on the next call
+            self.consolidated_count = None
             Log.logger.critical(f'habd_api: train_consolidated_info_mem_mgmt : exception: {e}', exc_info=True)
-            self.dlm_pub.publish_error_info("dlm", "DLM-ERROR-019", EventErrorPub.CRITICAL,
-                                            "habd_api: train_consolidated_info_mem_mgmt : exception : " + str(e))
+            self.publish_db_error("DLM-ERROR-019", e,
+                                  "habd_api: train_consolidated_info_mem_mgmt : exception : " + str(e))
 
     def select_train_consolidated_info(self, train_id):
         '''Get train_consolidated_info records'''
@@ -472,124 +613,175 @@ class HabdAPI:
             return list(records)
         except Exception as e:
             Log.logger.critical(f"habd_api: select_train_consolidated_info: exception : {e}", exc_info=True)
-            self.dlm_pub.publish_error_info("dlm", "DLM-ERROR-020", EventErrorPub.CRITICAL,
-                                            "habd_api: select_train_consolidated_info : exception : " + str(e))
+            self.publish_db_error("DLM-ERROR-020", e,
+                                  "habd_api: select_train_consolidated_info : exception : " + str(e))
             return []
 
-    def insert_habd_error_info(self, data):
-        ''' Insert error info in table '''
+    def insert_habd_error_info(self, msg):
+        ''' Insert error info (ErrorMsg) in table '''
         try:
-            json_data = json.loads(data)
-
-            error_info = ErrorInfo()
-            error_info.ts = json_data["ts"]
-            error_info.dpu_id = self.dpu_id
-            error_info.msg_id = json_data["msg_id"]
-            error_info.error_id = json_data["error_id"]
-            error_info.error_severity = json_data["error_severity"]
-            error_info.error_desc = json_data["error_desc"]
-            error_info.save()
-
-            '''perform memory management'''
-            self.error_info_mem_mgmt()
-            Log.logger.warning(f'Insert_habd_error_info: record inserted')
+            self.error_buffer.add({
+                "ts": msg.ts,
+                "dpu_id": self.dpu_id,
+                "msg_id": msg.msg_id,
+                "error_id": msg.error_id,
+                "error_severity": msg.error_severity,
+                "error_desc": msg.error_desc
+            })
+
+            Log.logger.warning('Insert_habd_error_info: record queued')
         except Exception as e:
+            fail_current_delivery()
             Log.logger.critical(f'habd_api: insert_habd_error_info: exception: {e}', exc_info=True)
-            input_json_data = json.loads(data)
-            Log.logger.warning(f'error_info: Message: {json.dumps(input_json_data, indent = 3)}')
+            Log.logger.warning(f'error_info: Message: {json.dumps(msg._asdict(), indent = 3)}')
 
-    def insert_habd_event_info(self, data):
-        ''' Insert event info in table '''
+    def insert_habd_event_info(self, msg):
+        ''' Insert event info (EventMsg) in table '''
         try:
-            json_data = json.loads(data)
-
-            event_info = EventInfo()
-            event_info.ts = json_data["ts"]
-            event_info.msg_id = json_data["msg_id"]
-            event_info.dpu_id = self.dpu_id
-            event_info.event_id = json_data["event_id"]
-            event_info.event_desc = json_data["event_desc"]
-            event_info.save()
-
-            '''perform memory management'''
-            self.event_info_mem_mgmt()
-            Log.logger.warning(f'Insert_habd_event_info: record inserted')
+            self.event_buffer.add({
+                "ts": msg.ts,
+                "msg_id": msg.msg_id,
+                "dpu_id": self.dpu_id,
+                "event_id": msg.event_id,
+                "event_desc": msg.event_desc
+            })
+
+            Log.logger.warning('Insert_habd_event_info: record queued')
         except Exception as e:
+            fail_current_delivery()
             Log.logger.critical(f'habd_api: insert_habd_event_info: exception : {e}', exc_info=True)
-            self.dlm_pub.publish_error_info("dlm", "DLM-ERROR-022", EventErrorPub.CRITICAL,
-                                            "habd_api: insert_habd_event_info : exception : " + str(e))
+            self.publish_db_error("DLM-ERROR-022", e,
+                                  "habd_api: insert_habd_event_info : exception : " + str(e))
+
+    def publish_write_error(self, error_id, fn_name, e):
+        '''Publish a failed write-behind flush'''
+        self.publish_db_error(error_id, e, "habd_api: " + fn_name + " : exception : " + str(e))
+
+    def publish_db_error(self, error_id, e, error_desc):
+        '''
+        Publish a failed database call. Failures of an unreachable database are not published one by one,
+        db_breaker publishes one error when the database is lost and one event when it is back
+        '''
+        if isinstance(e, DatabaseUnavailable):
+            return
+        self.dlm_pub.publish_error_info("dlm", error_id, EventErrorPub.CRITICAL, error_desc)
+
+    def on_db_transition(self, is_open, desc):
+        '''db_breaker state change'''
+        if is_open:
+            self.dlm_pub.publish_error_info("dlm", "DLM-ERROR-029", EventErrorPub.CRITICAL, "habd_api: " + desc)
+        else:
+            self.dlm_pub.publish_event_info("dlm", "DLM-EVENT-002", "habd_api: " + desc)
+
+    def stop_write_buffers(self):
+        '''Flush the pending event, error and health rows, called on shutdown'''
+        for write_buffer in (self.event_buffer, self.error_buffer, self.health_buffer):
+            write_buffer.stop()
+
+    def purge_expired_records(self, model, retention_days):
+        '''
+        Delete records older than retention_days from a ts indexed log table, RETENTION.PURGE_CHUNK_SIZE
+        rows per statement so that each delete stays a short index range scan and a short transaction
+        '''
+        cutoff_ts = time.time() - retention_days * 24 * 60 * 60
+        deleted_count = 0
+        while True:
+            expired_ids = model.select(model.id).where(model.ts < cutoff_ts).limit(self.purge_chunk_size)
+            chunk_count = model.delete().where(model.id.in_(expired_ids)).execute()
+            deleted_count += chunk_count
+            if chunk_count < self.purge_chunk_size:
+                return deleted_count
 
     def event_info_mem_mgmt(self):
-        '''keep 6 months events data'''
+        '''keep events data for RETENTION.EVENT_INFO_DAYS, returns the number of deleted records'''
         try:
-            event_query = (EventInfo.delete().where(
-                fn.to_timestamp(EventInfo.ts) < datetime.now() + timedelta(days=-180, hours=0)))
-            deleted_count = event_query.execute()
+            deleted_count = self.purge_expired_records(EventInfo, self.event_info_days)
             Log.logger.info(f'Deleted {deleted_count} old event records')
+            return deleted_count
         except Exception as e:
-            Log.logger.critical(f'habd_api: event_info_mem_mgmt : exception : {e}', exc_info=True)
-            self.dlm_pub.publish_error_info("dlm", "DLM-ERROR-023", EventErrorPub.CRITICAL,
-                                            "habd_api: event_info_mem_mgmt : exception : " + str(e))
+            Log.logger.critical(f'habd_api: event_info_mem_mgmt: exception : {e}', exc_info=True)
+            self.publish_db_error("DLM-ERROR-023", e,
+                                  "habd_api: event_info_mem_mgmt : exception : " + str(e))
+            return 0
 
     def error_info_mem_mgmt(self):
-        '''keep 6 months data'''
+        '''keep error data for RETENTION.ERROR_INFO_DAYS, returns the number of deleted records'''
         try:
-            error_query = (ErrorInfo.delete().where(
-                fn.to_timestamp(ErrorInfo.ts) < datetime.now() + timedelta(days=-180, hours=0)))
-            deleted_count = error_query.execute()
+            deleted_count = self.purge_expired_records(ErrorInfo, self.error_info_days)
             Log.logger.info(f'Deleted {deleted_count} old error records')
+            return deleted_count
         except Exception as e:
             Log.logger.critical(f'habd_api: error_info_mem_mgmt: exception : {e}', exc_info=True)
-            self.dlm_pub.publish_error_info("dlm", "DLM-ERROR-024", EventErrorPub.CRITICAL,
-                                            "habd_api: error_info_mem_mgmt : exception : " + str(e))
+            self.publish_db_error("DLM-ERROR-024", e,
+                                  "habd_api: error_info_mem_mgmt : exception : " + str(e))
+            return 0
 
-    def insert_habd_health_info(self, data):
-        ''' Insert health info in table '''
+    def insert_habd_health_info(self, msg):
+        ''' Insert health info (HealthMsg) in table '''
         try:
-            json_data = json.loads(data)
-
-            health_info = HealthInfo()
-            health_info.ts = json_data["ts"]
-            health_info.dpu_id = self.dpu_id
-            health_info.comm_link = json_data["comm_link"]
-            health_info.interrogator_link = json_data["interrogator_link"]
-            health_info.s1_link = json_data["S1"]
-            health_info.s2_link = json_data["S2"]
-            health_info.s3_link = json_data["S3"]
-            health_info.s4_link = json_data["S4"]
-            health_info.s5_link = json_data["S5"]
-            health_info.s6_link = json_data["S6"]
-            health_info.s7_link = json_data["S7"]
-            health_info.s8_link = json_data["S8"]
-            health_info.s9_link = json_data["S9"]
-            health_info.s10_link = json_data["S10"]
-            health_info.s11_link = json_data["S11"]
-            health_info.s12_link = json_data["S12"]
-            health_info.t1_link = json_data["T1"]
-            health_info.t2_link = json_data["T2"]
-            health_info.t3_link = json_data["T3"]
-            health_info.t4_link = json_data["T4"]
-            health_info.save()
-
-            '''perform memory management'''
-            self.health_info_mem_mgmt()
-            Log.logger.info(f'habd_api: insert_habd_health_info: record inserted')
+            self.health_buffer.add({
+                "ts": msg.ts,
+                "dpu_id": self.dpu_id,
+                "comm_link": msg.comm_link,
+                "interrogator_link": msg.interrogator_link,
+                "s1_link": msg.S1,
+                "s2_link": msg.S2,
+                "s3_link": msg.S3,
+                "s4_link": msg.S4,
+                "s5_link": msg.S5,
+                "s6_link": msg.S6,
+                "s7_link": msg.S7,
+                "s8_link": msg.S8,
+                "s9_link": msg.S9,
+                "s10_link": msg.S10,
+                "s11_link": msg.S11,
+                "s12_link": msg.S12,
+                "t1_link": msg.T1,
+                "t2_link": msg.T2,
+                "t3_link": msg.T3,
+                "t4_link": msg.T4
+            })
+
+            Log.logger.info(f'habd_api: insert_habd_health_info: record queued')
         except Exception as e:
+            fail_current_delivery()
             Log.logger.critical(f'habd_api: insert_habd_health_info: exception : {e}', exc_info=True)
-            self.dlm_pub.publish_error_info("dlm", "DLM-ERROR-025", EventErrorPub.CRITICAL,
-                                            "habd_api: insert_habd_health_info : exception : " + str(e))
+            self.publish_db_error("DLM-ERROR-025", e,
+                                  "habd_api: insert_habd_health_info : exception : " + str(e))
 
     def health_info_mem_mgmt(self):
-        '''keep 6 months data'''
+        '''keep health data for RETENTION.HEALTH_INFO_DAYS, returns the number of deleted records'''
         try:
-            health_query = (HealthInfo.delete().where(
-                fn.to_timestamp(HealthInfo.ts) < datetime.now() + timedelta(days=-180, hours=0)))
-            deleted_count = health_query.execute()
+            deleted_count = self.purge_expired_records(HealthInfo, self.health_info_days)
             Log.logger.info(f'Deleted {deleted_count} old health records')
+            return deleted_count
         except Exception as e:
             Log.logger.critical(f'habd_api: health_info_mem_mgmt: exception : {e}', exc_info=True)
-            self.dlm_pub.publish_error_info("dlm", "DLM-ERROR-026", EventErrorPub.CRITICAL,
-                                            "habd_api: health_info_mem_mgmt : exception : " + str(e))
+            self.publish_db_error("DLM-ERROR-026", e,
+                                  "habd_api: health_info_mem_mgmt : exception : " + str(e))
+            return 0
+
+    def orphan_axle_mem_mgmt(self):
+        '''
+        Delete train_processed_info rows older than RETENTION.ORPHAN_AXLE_HOURS whose train never got a
+        train_consolidated_info row, eviction removes only the axles of evicted trains. Returns the number
+        of deleted records
+        '''
+        try:
+            cutoff_ts = time.time() - self.orphan_axle_hours * 60 * 60
+            deleted_count = 0
+            while True:
+                cursor = self.psql_db.execute_sql(HabdAPI.ORPHAN_AXLE_SQL, (cutoff_ts, self.purge_chunk_size))
+                deleted_count += cursor.rowcount
+                if cursor.rowcount < self.purge_chunk_size:
+                    break
+            Log.logger.info(f'Deleted {deleted_count} orphan axle records')
+            return deleted_count
+        except Exception as e:
+            Log.logger.critical(f'habd_api: orphan_axle_mem_mgmt: exception : {e}', exc_info=True)
+            self.publish_db_error("DLM-ERROR-030", e,
+                                  "habd_api: orphan_axle_mem_mgmt : exception : " + str(e))
+            return 0
 
 
 if __name__ == '__main__':
@@ -610,5 +802,6 @@ if __name__ == '__main__':
         habd_api.train_consolidated_info_mem_mgmt()
         habd_api.event_info_mem_mgmt()
         habd_api.error_info_mem_mgmt()
+        habd_api.health_info_mem_mgmt()
     else:
         Log.logger.error("Failed to connect to database")
\ No newline at end of file
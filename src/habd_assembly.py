@@ -0,0 +1,155 @@
+'''
+*****************************************************************************
+*File : habd_assembly.py
+*Module : habd_dlm
+*Purpose : habd data logging module (DLM) per train message assembly
+*Author : HABD Team
+*Copyright : Copyright 2025, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+# '''Import python packages'''
+import time
+import threading
+from collections import OrderedDict
+
+# '''Import HABD packages '''
+from habd_log import Log
+from habd_model import psql_db
+from habd_common.habd_ack import current_delivery, bound_delivery
+
+
+class TrainAssembly:
+    '''Messages of one in-flight train, by part name'''
+
+    def __init__(self, train_id):
+        self.train_id = train_id
+        self.first_seen = time.monotonic()
+        self.parts = {}
+        # Manual ack deliveries of the parts, released when the train is committed
+        self.deliveries = []
+        self.deadline_queued = False
+
+
+class TrainAssembler:
+    '''
+    Collect train_processed_info, habd_info and train_consolidated_info of a train in memory and commit them
+    with HabdAPI.commit_train_assembly in one transaction, as soon as all expected parts arrived or
+    deadline_sec after the first part. Deadline commits are queued to the writer of the train, so they stay
+    ordered with the other messages of that train. Parts arriving after their train was committed are
+    returned to the caller for the regular per message write.
+    '''
+
+    PROCESSED = "train_processed_info"
+    HABD_INFO = "habd_info"
+    CONSOLIDATED = "train_consolidated_info"
+
+    # Train ids remembered after commit to recognise late parts
+    COMMITTED_HISTORY = 1024
+
+    def __init__(self, db_api_obj, ingest_dispatcher, expected_parts, deadline_sec):
+        self.habd_api = db_api_obj
+        self.ingest = ingest_dispatcher
+        self.expected_parts = frozenset(expected_parts)
+        self.deadline_sec = deadline_sec
+        self.in_flight = {}
+        self.committed = OrderedDict()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.th = None
+        self.stats = {"complete": 0, "deadline": 0, "late_parts": 0}
+
+    def start(self):
+        self.stop_event.clear()
+        self.th = threading.Thread(target=self.sweep_loop, name="habd_assembly", args=())
+        self.th.daemon = True
+        self.th.start()
+        Log.logger.info(f'TrainAssembler: started, parts: {sorted(self.expected_parts)}, '
+                        f'deadline: {self.deadline_sec} sec')
+
+    def stop(self):
+        '''Stop the deadline sweeper and commit the trains still in flight, call after the writers stopped'''
+        self.stop_event.set()
+        if self.th is not None:
+            self.th.join()
+            self.th = None
+        with self.lock:
+            assemblies = list(self.in_flight.values())
+            self.in_flight = {}
+        for assembly in assemblies:
+            with psql_db.connection_context():
+                self.commit(assembly, "deadline")
+        Log.logger.warning(f'TrainAssembler: stopped, {self.stats}')
+
+    def add(self, part, msg):
+        '''
+        Add one typed message of a train, commits the train when it is complete. Returns False when the train
+        was already committed and the caller has to write the message itself
+        '''
+        train_id = msg.train_id
+        with self.lock:
+            if train_id in self.committed:
+                self.stats["late_parts"] += 1
+                return False
+            assembly = self.in_flight.get(train_id)
+            if assembly is None:
+                assembly = TrainAssembly(train_id)
+                self.in_flight[train_id] = assembly
+            # A retransmitted part replaces the earlier copy
+            assembly.parts[part] = msg
+            delivery = current_delivery()
+            if delivery is not None:
+                # Held until the other parts arrive, up to deadline_sec: outside of the ack window, so open
+                # trains do not pause the receive of the parts they wait for
+                delivery.hold(outside_window=True)
+                assembly.deliveries.append(delivery)
+            if not self.expected_parts.issubset(assembly.parts):
+                return True
+            self.remove(train_id)
+        self.commit(assembly, "complete")
+        return True
+
+    def remove(self, train_id):
+        '''Move a train from in flight to committed, called with the lock held'''
+        del self.in_flight[train_id]
+        self.committed[train_id] = True
+        while len(self.committed) > TrainAssembler.COMMITTED_HISTORY:
+            self.committed.popitem(last=False)
+
+    def commit(self, assembly, reason):
+        with self.lock:
+            self.stats[reason] += 1
+        if reason == "deadline":
+            Log.logger.warning(f'TrainAssembler: {assembly.train_id} deadline passed, committing '
+                               f'{sorted(assembly.parts)} of {sorted(self.expected_parts)}')
+        # The deadline commit runs outside of a message, a held delivery stands in for the train
+        with bound_delivery(current_delivery() or next(iter(assembly.deliveries), None)):
+            committed = self.habd_api.commit_train_assembly(assembly.train_id, assembly.parts)
+        for delivery in assembly.deliveries:
+            delivery.release(failed=not committed, outside_window=True)
+
+    def sweep_loop(self):
+        while not self.stop_event.wait(1.0):
+            now = time.monotonic()
+            with self.lock:
+                expired = [assembly.train_id for assembly in self.in_flight.values()
+                           if not assembly.deadline_queued and now - assembly.first_seen >= self.deadline_sec]
+                for train_id in expired:
+                    self.in_flight[train_id].deadline_queued = True
+            for train_id in expired:
+                if not self.ingest.submit("assembly/deadline", train_id, self.commit_expired,
+                                          key=train_id.encode('utf-8')):
+                    # Writer queue full, retry on the next sweep
+                    with self.lock:
+                        if train_id in self.in_flight:
+                            self.in_flight[train_id].deadline_queued = False
+        Log.logger.info(f'TrainAssembler: exiting the deadline sweeper thread')
+
+    def commit_expired(self, train_id):
+        '''Deadline commit, runs on the writer thread of the train'''
+        with self.lock:
+            assembly = self.in_flight.get(train_id)
+            if assembly is None:
+                return
+            self.remove(train_id)
+        self.commit(assembly, "deadline")
@@ -0,0 +1,146 @@
+'''
+*****************************************************************************
+*File : habd_axles.py
+*Module : habd_dlm
+*Purpose : habd data logging module (DLM) vectorised per axle arrays
+*Author : HABD Team
+*Copyright : Copyright 2025, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+# '''Import python packages'''
+from typing import NamedTuple
+import numpy as np
+
+
+class AxleLimits(NamedTuple):
+    '''Plausible value ranges, readings outside are stored as NULL'''
+    temp_min: float
+    temp_max: float
+    speed_max: float
+
+
+class AxleArrays(NamedTuple):
+    '''
+    Per axle columns of one train as NumPy arrays, one entry per unique axle_id (the last reading wins).
+    Missing, sentinel and out of range values are NaN in the float arrays and None in rake_ids.
+    '''
+    ts: float
+    train_id: str
+    dpu_id: str
+    axle_ids: np.ndarray
+    axle_speeds: np.ndarray
+    rake_ids: np.ndarray
+    left_temps: np.ndarray
+    right_temps: np.ndarray
+    temp_differences: np.ndarray
+    out_of_range: int
+
+    def axle_count(self):
+        return len(self.axle_ids)
+
+    def columns(self):
+        '''axle_id, axle_speed, rake_id, left, right, difference as lists for array bind parameters'''
+        return (self.axle_ids.tolist(), db_list(self.axle_speeds), self.rake_ids.tolist(),
+                db_list(self.left_temps), db_list(self.right_temps), db_list(self.temp_differences))
+
+    def rows(self):
+        '''train_processed_info row tuples in PROCESSED_INFO_COLUMNS order'''
+        axle_ids, axle_speeds, rake_ids, left_temps, right_temps, temp_differences = self.columns()
+        return [(self.ts, self.train_id, self.dpu_id, axle_ids[i], axle_speeds[i], rake_ids[i],
+                 left_temps[i], right_temps[i], 1, 1, temp_differences[i]) for i in range(len(axle_ids))]
+
+    def with_temperatures(self, temps):
+        '''
+        Copy with the temperatures of {axle_id: (left, right, difference)} written over the axles they belong
+        to, as the habd_info UPDATE would have done. Axles of other trains are ignored
+        '''
+        position = {axle_id: idx for idx, axle_id in enumerate(self.axle_ids.tolist())}
+        matched = [(position[axle_id], temp) for axle_id, temp in temps.items() if axle_id in position]
+        if not matched:
+            return self
+        idx = np.fromiter((pos for pos, _ in matched), dtype=np.intp, count=len(matched))
+        values = float_array([temp for _, temp in matched], len(matched) * 3).reshape(-1, 3)
+        left_temps = self.left_temps.copy()
+        right_temps = self.right_temps.copy()
+        temp_differences = self.temp_differences.copy()
+        left_temps[idx] = values[:, 0]
+        right_temps[idx] = values[:, 1]
+        temp_differences[idx] = values[:, 2]
+        return self._replace(left_temps=left_temps, right_temps=right_temps, temp_differences=temp_differences)
+
+
+def float_array(values, n):
+    '''Float64 array of length n, None and missing trailing entries become NaN'''
+    arr = np.full(n, np.nan)
+    if n and len(values):
+        # Lists of tuples flatten, None converts to NaN with a float dtype
+        data = np.asarray(values, dtype=np.float64).ravel()[:n]
+        arr[:len(data)] = data
+    return arr
+
+
+def db_list(arr):
+    '''List of a float array with NaN turned into None, for NULL in the database'''
+    values = arr.astype(object)
+    values[np.isnan(arr)] = None
+    return values.tolist()
+
+
+def mask_out_of_range(arr, low, high):
+    '''Set values outside [low, high] to NaN in place, returns the number of values masked'''
+    with np.errstate(invalid='ignore'):
+        bad = (arr < low) | (arr > high)
+    count = int(np.count_nonzero(bad))
+    if count:
+        arr[bad] = np.nan
+    return count
+
+
+def last_unique(axle_ids):
+    '''Positions of the last occurrence of every axle_id, in arrival order'''
+    n = len(axle_ids)
+    _, reversed_idx = np.unique(axle_ids[::-1], return_index=True)
+    return np.sort(n - 1 - reversed_idx)
+
+
+def processed_axle_arrays(msg, limits):
+    '''AxleArrays of a TrainProcessedMsg, -1 temperatures are sentinels for no reading'''
+    axle_ids = np.asarray(msg.axle_ids, dtype=np.int64)
+    n = len(axle_ids)
+    axle_speeds = float_array(msg.axle_speeds, n)
+    left_temps = float_array(msg.temp_lefts, n)
+    right_temps = float_array(msg.temp_rights, n)
+    left_temps[left_temps == -1] = np.nan
+    right_temps[right_temps == -1] = np.nan
+
+    out_of_range = mask_out_of_range(left_temps, limits.temp_min, limits.temp_max) + \
+        mask_out_of_range(right_temps, limits.temp_min, limits.temp_max) + \
+        mask_out_of_range(axle_speeds, 0.0, limits.speed_max)
+
+    rake_ids = np.full(n, None, dtype=object)
+    rake_count = min(len(msg.rake_ids), n)
+    rake_ids[:rake_count] = msg.rake_ids[:rake_count]
+
+    keep = last_unique(axle_ids)
+    if len(keep) < n:
+        axle_ids, axle_speeds, rake_ids = axle_ids[keep], axle_speeds[keep], rake_ids[keep]
+        left_temps, right_temps = left_temps[keep], right_temps[keep]
+
+    # NaN propagates, the difference is missing when either side is
+    return AxleArrays(msg.ts, msg.train_id, msg.dpu_id, axle_ids, axle_speeds, rake_ids, left_temps, right_temps,
+                      np.abs(left_temps - right_temps), out_of_range)
+
+
+def habd_temp_arrays(msg, limits):
+    '''axle_ids, left, right and difference arrays of a HabdInfoMsg, unique by axle_id (last reading wins)'''
+    axle_ids = np.asarray(msg.axle_ids, dtype=np.int64)
+    n = len(axle_ids)
+    left_temps = float_array(msg.temp_lefts, n)
+    right_temps = float_array(msg.temp_rights, n)
+    out_of_range = mask_out_of_range(left_temps, limits.temp_min, limits.temp_max) + \
+        mask_out_of_range(right_temps, limits.temp_min, limits.temp_max)
+    keep = last_unique(axle_ids)
+    if len(keep) < n:
+        axle_ids, left_temps, right_temps = axle_ids[keep], left_temps[keep], right_temps[keep]
+    return axle_ids, left_temps, right_temps, np.abs(left_temps - right_temps), out_of_range
@@ -0,0 +1,178 @@
+'''
+*****************************************************************************
+*File : habd_cache.py
+*Module : habd_dlm
+*Purpose : habd data logging module (DLM) in-memory per train caches
+*Author : HABD Team
+*Copyright : Copyright 2025, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+# '''Import python packages'''
+import time
+import threading
+from collections import OrderedDict
+
+
+class TrainAggregate:
+    '''
+    Axle values of one train as stored in train_processed_info, with the consolidation aggregates
+    (max left, max right, max difference, axle count, speed sum) kept up to date on every merge.
+    The axle values are kept because habd_info overwrites temperatures, which a plain running
+    maximum could not take back.
+    '''
+
+    def __init__(self, axles=None):
+        # axle_id -> [axle_speed, left_temp, right_temp, temp_difference]
+        self.axles = axles if axles is not None else {}
+        self.max_left_temp = None
+        self.max_right_temp = None
+        self.max_temp_difference = None
+        self.axle_count = 0
+        self.speed_sum = 0.0
+        self.refresh()
+
+    def copy(self):
+        return TrainAggregate({axle_id: list(values) for axle_id, values in self.axles.items()})
+
+    def merge_processed_rows(self, rows):
+        '''Apply train_processed_info row tuples with the upsert COALESCE rules'''
+        for row in rows:
+            new_values = [row[4], row[6], row[7], row[10]]
+            values = self.axles.get(row[3])
+            if values is None:
+                self.axles[row[3]] = new_values
+            else:
+                for idx, value in enumerate(new_values):
+                    if value is not None:
+                        values[idx] = value
+        self.refresh()
+
+    def merge_temperatures(self, axle_ids, left_temps, right_temps, temp_differences):
+        '''Apply habd_info temperatures, like the UPDATE only axles that already exist are changed'''
+        for axle_id, left_temp, right_temp, temp_difference in zip(axle_ids, left_temps, right_temps,
+                                                                  temp_differences):
+            values = self.axles.get(axle_id)
+            if values is not None:
+                values[1] = left_temp
+                values[2] = right_temp
+                values[3] = temp_difference
+        self.refresh()
+
+    def refresh(self):
+        left_temps = [values[1] for values in self.axles.values() if values[1] is not None]
+        right_temps = [values[2] for values in self.axles.values() if values[2] is not None]
+        temp_diffs = [values[3] for values in self.axles.values() if values[3] is not None]
+        self.max_left_temp = max(left_temps) if left_temps else None
+        self.max_right_temp = max(right_temps) if right_temps else None
+        self.max_temp_difference = max(temp_diffs) if temp_diffs else None
+        self.axle_count = len(self.axles)
+        self.speed_sum = sum([values[0] for values in self.axles.values() if values[0] is not None])
+
+    def max_temps(self):
+        return self.max_left_temp, self.max_right_temp, self.max_temp_difference
+
+
+class TrainAggregateCache:
+    '''
+    Bounded LRU / TTL cache of TrainAggregate by train_id. Entries are only created from a complete
+    train_processed_info payload, a miss means the caller has to aggregate in the database.
+    '''
+
+    def __init__(self, max_trains, ttl_sec):
+        self.max_trains = max_trains
+        self.ttl_sec = ttl_sec
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, train_id):
+        '''Copy of the cached aggregate, None on a miss. Callers put() the copy back after their commit'''
+        with self.lock:
+            entry = self.entries.get(train_id)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl_sec:
+                del self.entries[train_id]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(train_id)
+            return entry[1].copy()
+
+    def put(self, train_id, aggregate):
+        with self.lock:
+            self.entries[train_id] = (time.monotonic(), aggregate)
+            self.entries.move_to_end(train_id)
+            while len(self.entries) > self.max_trains:
+                self.entries.popitem(last=False)
+
+    def discard(self, train_id):
+        with self.lock:
+            self.entries.pop(train_id, None)
+
+
+class PendingTemperatureBuffer:
+    '''
+    habd_info temperatures of axles that have no train_processed_info row yet, kept by train_id until the
+    processed info of the train arrives and merges them into its upsert. Entries expire after ttl_sec and
+    the oldest trains are dropped once more than max_axles axles are held.
+    '''
+
+    def __init__(self, max_axles, ttl_sec):
+        self.max_axles = max_axles
+        self.ttl_sec = ttl_sec
+        # train_id -> (arrival time, {axle_id: (left_temp, right_temp, temp_difference)})
+        self.entries = OrderedDict()
+        self.axle_count = 0
+        self.lock = threading.Lock()
+        self.buffered = 0
+        self.merged = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def put(self, train_id, temps):
+        '''Hold {axle_id: (left, right, difference)} of a train, later readings of an axle replace earlier ones'''
+        with self.lock:
+            self.expire()
+            entry = self.entries.get(train_id)
+            if entry is None:
+                entry = (time.monotonic(), {})
+                self.entries[train_id] = entry
+            # A train keeps its first arrival time and position, so the head is always the oldest entry
+            self.axle_count -= len(entry[1])
+            entry[1].update(temps)
+            self.axle_count += len(entry[1])
+            self.buffered += len(temps)
+            while self.axle_count > self.max_axles and self.entries:
+                _, (_, dropped) = self.entries.popitem(last=False)
+                self.axle_count -= len(dropped)
+                self.evicted += len(dropped)
+
+    def pop(self, train_id):
+        '''Remove and return the held temperatures of a train, None when there are none'''
+        with self.lock:
+            self.expire()
+            entry = self.entries.pop(train_id, None)
+            if entry is None:
+                return None
+            self.axle_count -= len(entry[1])
+            self.merged += len(entry[1])
+            return entry[1]
+
+    def expire(self):
+        '''Drop expired trains, entries are in arrival order so only the head has to be checked'''
+        now = time.monotonic()
+        while self.entries:
+            train_id, (arrival_time, axles) = next(iter(self.entries.items()))
+            if now - arrival_time <= self.ttl_sec:
+                break
+            del self.entries[train_id]
+            self.axle_count -= len(axles)
+            self.expired += len(axles)
+
+    def stats(self):
+        with self.lock:
+            return {"trains": len(self.entries), "axles": self.axle_count, "buffered": self.buffered,
+                    "merged": self.merged, "expired": self.expired, "evicted": self.evicted}
@@ -0,0 +1,277 @@
+'''
+*****************************************************************************
+*File : habd_decode.py
+*Module : habd_dlm
+*Purpose : habd data logging module (DLM) typed decoding of the MQTT payloads
+*Author : HABD Team
+*Copyright : Copyright 2025, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+# '''Import python packages'''
+import json
+import threading
+from typing import NamedTuple
+
+try:
+    import orjson
+    json_loads = orjson.loads
+    JSON_BACKEND = "orjson"
+except ImportError:
+    # json.loads takes bytes as well, only slower
+    json_loads = json.loads
+    JSON_BACKEND = "json"
+
+# '''Import HABD packages '''
+from habd_wire import is_binary, decode_train_processed, WireFormatError
+
+
+class TrainProcessedMsg(NamedTuple):
+    ts: float
+    train_id: str
+    dpu_id: str
+    axle_ids: list
+    axle_speeds: list
+    rake_ids: list
+    temp_lefts: list
+    temp_rights: list
+
+
+class HabdInfoMsg(NamedTuple):
+    train_id: str
+    axle_ids: list
+    temp_lefts: list
+    temp_rights: list
+
+
+class TrainConsolidatedMsg(NamedTuple):
+    train_id: str
+    train_entry_time: float
+    train_exit_time: float
+    total_axles: int
+    total_wheels: int
+    direction: str
+    train_speed: float
+    train_type: str
+    train_processed: bool
+    remark: str
+
+
+class EventMsg(NamedTuple):
+    ts: float
+    msg_id: int
+    event_id: str
+    event_desc: str
+
+
+class ErrorMsg(NamedTuple):
+    ts: float
+    msg_id: int
+    error_id: str
+    error_severity: int
+    error_desc: str
+
+
+class HealthMsg(NamedTuple):
+    ts: float
+    comm_link: str
+    interrogator_link: str
+    S1: str
+    S2: str
+    S3: str
+    S4: str
+    S5: str
+    S6: str
+    S7: str
+    S8: str
+    S9: str
+    S10: str
+    S11: str
+    S12: str
+    T1: str
+    T2: str
+    T3: str
+    T4: str
+
+
+class MessageRejected(ValueError):
+    '''Payload that is not valid JSON or does not match the message schema'''
+
+
+REQUIRED = object()
+NUMBER = (int, float)
+TEXT = (str,)
+ARRAY = (list,)
+
+# Field name -> (accepted types, default or REQUIRED, payload keys in lookup order). None accepts any value,
+# null values are accepted where a field is optional
+SCHEMAS = {
+    TrainProcessedMsg: {
+        "ts": (NUMBER, REQUIRED, ("ts",)),
+        "train_id": (TEXT, REQUIRED, ("train_id",)),
+        "dpu_id": (TEXT, REQUIRED, ("dpu_id",)),
+        "axle_ids": (ARRAY, REQUIRED, ("axle_ids",)),
+        "axle_speeds": (ARRAY, (), ("axle_speeds",)),
+        "rake_ids": (ARRAY, (), ("rake_id", "rake_ids")),
+        "temp_lefts": (ARRAY, (), ("temp_lefts",)),
+        "temp_rights": (ARRAY, (), ("temp_rights",))
+    },
+    HabdInfoMsg: {
+        "train_id": (TEXT, REQUIRED, ("train_id",)),
+        "axle_ids": (ARRAY, REQUIRED, ("axle_ids",)),
+        "temp_lefts": (ARRAY, REQUIRED, ("temp_lefts",)),
+        "temp_rights": (ARRAY, REQUIRED, ("temp_rights",))
+    },
+    TrainConsolidatedMsg: {
+        "train_id": (TEXT, REQUIRED, ("train_id",)),
+        "train_entry_time": (NUMBER, REQUIRED, ("train_entry_time",)),
+        "train_exit_time": (NUMBER, REQUIRED, ("train_exit_time",)),
+        "total_axles": (NUMBER, REQUIRED, ("total_axles",)),
+        "total_wheels": (NUMBER, REQUIRED, ("total_wheels",)),
+        "direction": (TEXT, REQUIRED, ("direction",)),
+        "train_speed": (NUMBER, REQUIRED, ("train_speed",)),
+        "train_type": (None, REQUIRED, ("train_type",)),
+        "train_processed": (None, REQUIRED, ("train_processed",)),
+        "remark": (None, REQUIRED, ("remark",))
+    },
+    EventMsg: {
+        "ts": (NUMBER, REQUIRED, ("ts",)),
+        "msg_id": (NUMBER, REQUIRED, ("msg_id",)),
+        "event_id": (TEXT, REQUIRED, ("event_id",)),
+        "event_desc": (TEXT, REQUIRED, ("event_desc",))
+    },
+    ErrorMsg: {
+        "ts": (NUMBER, REQUIRED, ("ts",)),
+        "msg_id": (NUMBER, REQUIRED, ("msg_id",)),
+        "error_id": (TEXT, REQUIRED, ("error_id",)),
+        "error_severity": (NUMBER, REQUIRED, ("error_severity",)),
+        "error_desc": (TEXT, REQUIRED, ("error_desc",))
+    },
+    HealthMsg: dict(
+        [("ts", (NUMBER, REQUIRED, ("ts",)))] +
+        [(link, (TEXT, REQUIRED, (link,))) for link in HealthMsg._fields[1:]]
+    )
+}
+
+# Array field name -> accepted element classes (exact, so true / false are no numbers). An array that is not
+# empty has one entry per axle_id, a per axle reading may be null
+INT_ELEMENTS = frozenset((int,))
+NUMBER_ELEMENTS = frozenset((int, float, type(None)))
+TEXT_ELEMENTS = frozenset((str, type(None)))
+ARRAY_ELEMENTS = {
+    TrainProcessedMsg: {
+        "axle_ids": INT_ELEMENTS,
+        "axle_speeds": NUMBER_ELEMENTS,
+        "rake_ids": TEXT_ELEMENTS,
+        "temp_lefts": NUMBER_ELEMENTS,
+        "temp_rights": NUMBER_ELEMENTS
+    },
+    HabdInfoMsg: {
+        "axle_ids": INT_ELEMENTS,
+        "temp_lefts": NUMBER_ELEMENTS,
+        "temp_rights": NUMBER_ELEMENTS
+    }
+}
+# axle_id column range (INTEGER)
+AXLE_ID_MIN = -2 ** 31
+AXLE_ID_MAX = 2 ** 31 - 1
+
+
+def compile_schema(msg_cls, schema, elements=None):
+    '''Build the decode function of one message type, fields are checked in the NamedTuple field order'''
+    fields = tuple((name,) + schema[name] for name in msg_cls._fields)
+    # (position, name, element classes) of the array fields with checked elements
+    arrays = tuple((idx, name, elements[name]) for idx, name in enumerate(msg_cls._fields)
+                   if elements and name in elements)
+    axle_ids_idx = msg_cls._fields.index("axle_ids") if arrays else None
+
+    def check_arrays(values):
+        axle_count = len(values[axle_ids_idx])
+        for idx, name, classes in arrays:
+            array = values[idx]
+            if not array:
+                continue
+            if len(array) != axle_count:
+                raise MessageRejected(f'{msg_cls.__name__}: {name}: {len(array)} entries for {axle_count} axles')
+            for value in array:
+                if value.__class__ not in classes:
+                    raise MessageRejected(f'{msg_cls.__name__}: {name}: unexpected {type(value).__name__} entry')
+        axle_ids = values[axle_ids_idx]
+        if axle_ids and (min(axle_ids) < AXLE_ID_MIN or max(axle_ids) > AXLE_ID_MAX):
+            raise MessageRejected(f'{msg_cls.__name__}: axle_ids: out of range')
+
+    def decode_fields(data):
+        if not isinstance(data, dict):
+            raise MessageRejected(f'{msg_cls.__name__}: payload is not a JSON object')
+        values = []
+        for name, types, default, keys in fields:
+            for key in keys:
+                if key in data:
+                    value = data[key]
+                    break
+            else:
+                if default is REQUIRED:
+                    raise MessageRejected(f'{msg_cls.__name__}: missing {name}')
+                values.append(default)
+                continue
+            if types is not None and not isinstance(value, types) and \
+                    not (value is None and default is not REQUIRED):
+                raise MessageRejected(f'{msg_cls.__name__}: {name}: unexpected {type(value).__name__}')
+            values.append(value)
+        if arrays:
+            check_arrays(values)
+        return msg_cls._make(values)
+
+    return decode_fields
+
+
+class MessageDecoder:
+    '''
+    Decode a payload once into its typed message, which is then shared by every consumer of the message.
+    Works on the bytes payload, rejected payloads raise MessageRejected and are counted per message type.
+    '''
+
+    def __init__(self):
+        self.decoders = {msg_cls: compile_schema(msg_cls, schema, ARRAY_ELEMENTS.get(msg_cls))
+                         for msg_cls, schema in SCHEMAS.items()}
+        self.lock = threading.Lock()
+        self.decoded = dict.fromkeys(SCHEMAS, 0)
+        self.rejected = dict.fromkeys(SCHEMAS, 0)
+
+    def decode(self, msg_cls, payload):
+        try:
+            if msg_cls is TrainProcessedMsg and is_binary(payload):
+                msg = self.decode_binary_processed(payload)
+            else:
+                try:
+                    data = json_loads(payload)
+                except ValueError as e:
+                    raise MessageRejected(f'{msg_cls.__name__}: invalid JSON: {e}')
+                msg = self.decoders[msg_cls](data)
+        except MessageRejected:
+            with self.lock:
+                self.rejected[msg_cls] += 1
+            raise
+        with self.lock:
+            self.decoded[msg_cls] += 1
+        return msg
+
+    @staticmethod
+    def decode_binary_processed(payload):
+        '''TrainProcessedMsg of a habd_wire payload, the arrays are NumPy views on the payload'''
+        try:
+            ts, train_id, dpu_id, axle_ids, axle_speeds, temp_lefts, temp_rights, rake_ids = \
+                decode_train_processed(payload)
+        except (WireFormatError, UnicodeDecodeError) as e:
+            raise MessageRejected(f'TrainProcessedMsg: invalid binary payload: {e}')
+        return TrainProcessedMsg(ts, train_id, dpu_id, axle_ids, axle_speeds, rake_ids, temp_lefts, temp_rights)
+
+    def stats(self):
+        with self.lock:
+            return {"backend": JSON_BACKEND,
+                    "decoded": {msg_cls.__name__: count for msg_cls, count in self.decoded.items()},
+                    "rejected": {msg_cls.__name__: count for msg_cls, count in self.rejected.items()}}
+
+
+# One decoder per process, shared by the subscriber callbacks like psql_db in habd_model
+message_decoder = MessageDecoder()
@@ -15,7 +15,7 @@ from os import path
 from typing import NamedTuple
 
 import json_checker
-from json_checker import Checker
+from json_checker import Checker, OptionalKey
 from json_checker.core.exceptions import CheckerError
 
 from habd_common.habd_log import Log
@@ -32,14 +32,117 @@ class HabdDlmConfRead:
             "USER": str,
             "PASSWORD": str,
             "HOST": str,
-            "DB_NAME": str
+            "DB_NAME": str,
+            OptionalKey("PORT"): int,
+            OptionalKey("SOCKET_DIR"): str,
+            OptionalKey("MAX_CONNECTIONS"): int,
+            OptionalKey("POOL_TIMEOUT_SEC"): int,
+            OptionalKey("STALE_TIMEOUT_SEC"): int,
+            OptionalKey("IDLE_TIMEOUT_SEC"): int,
+            OptionalKey("BREAKER_FAILURES"): int,
+            OptionalKey("RECONNECT_BACKOFF_BASE_SEC"): float,
+            OptionalKey("RECONNECT_BACKOFF_MAX_SEC"): float
         },
 
         "LOCAL_MQTT_BROKER": {
             "BROKER_IP_ADDRESS": str,
             "USERNAME": str,
             "PASSWORD": str,
-            "PORT": int
+            "PORT": int,
+            OptionalKey("RECONNECT_BACKOFF_BASE_SEC"): float,
+            OptionalKey("RECONNECT_BACKOFF_MAX_SEC"): float,
+            OptionalKey("SUB_QOS"): int,
+            OptionalKey("MANUAL_ACK"): bool,
+            OptionalKey("ACK_WINDOW"): int,
+            OptionalKey("REDELIVERY_DELAY_SEC"): int,
+            OptionalKey("MAX_DELIVERY_ATTEMPTS"): int,
+            OptionalKey("DEAD_LETTER_TOPIC"): str,
+            OptionalKey("EVENT_TOPICS"): list,
+            OptionalKey("ERROR_TOPICS"): list,
+            OptionalKey("HEALTH_TOPICS"): list
+        },
+
+        OptionalKey("INGEST"): {
+            OptionalKey("PROCESSED_INFO_MODE"): str,
+            OptionalKey("COPY_MIN_AXLES"): int,
+            OptionalKey("WRITER_THREADS"): int,
+            OptionalKey("QUEUE_SIZE"): int,
+            OptionalKey("ENQUEUE_TIMEOUT_SEC"): int,
+            OptionalKey("EVENT_SHED_DEPTH"): int,
+            OptionalKey("HEALTH_SHED_DEPTH"): int,
+            OptionalKey("SHED_AGE_SEC"): float,
+            OptionalKey("STATS_INTERVAL_SEC"): int,
+            OptionalKey("LOG_BATCH_ROWS"): int,
+            OptionalKey("LOG_BATCH_DELAY_MS"): int,
+            OptionalKey("AGGREGATE_CACHE_TRAINS"): int,
+            OptionalKey("AGGREGATE_CACHE_TTL_SEC"): int,
+            OptionalKey("PENDING_TEMP_MAX_AXLES"): int,
+            OptionalKey("PENDING_TEMP_TTL_SEC"): int,
+            OptionalKey("ASSEMBLY_ENABLED"): bool,
+            OptionalKey("ASSEMBLY_DEADLINE_SEC"): int,
+            OptionalKey("AXLE_TEMP_MIN"): float,
+            OptionalKey("AXLE_TEMP_MAX"): float,
+            OptionalKey("AXLE_SPEED_MAX"): float
+        },
+
+        OptionalKey("JOURNAL"): {
+            OptionalKey("ENABLED"): bool,
+            OptionalKey("DIR"): str,
+            OptionalKey("SEGMENT_BYTES"): int,
+            OptionalKey("MAX_BYTES"): int,
+            OptionalKey("SYNC_INTERVAL_MS"): int,
+            OptionalKey("REPLAY_BATCH"): int,
+            OptionalKey("PROBE_INTERVAL_SEC"): int,
+            OptionalKey("MAX_ATTEMPTS"): int
+        },
+
+        OptionalKey("RETENTION"): {
+            OptionalKey("MAX_TRAINS"): int,
+            OptionalKey("TRAIN_EVICT_BATCH"): int,
+            OptionalKey("EVENT_INFO_DAYS"): int,
+            OptionalKey("ERROR_INFO_DAYS"): int,
+            OptionalKey("HEALTH_INFO_DAYS"): int,
+            OptionalKey("PURGE_INTERVAL_SEC"): int,
+            OptionalKey("PURGE_CHUNK_SIZE"): int,
+            OptionalKey("ORPHAN_AXLE_HOURS"): int
+        },
+
+        OptionalKey("PARTITIONING"): {
+            OptionalKey("ENABLED"): bool,
+            OptionalKey("INTERVAL"): str,
+            OptionalKey("PRECREATE"): int
+        },
+
+        OptionalKey("LOGGING"): {
+            OptionalKey("ASYNC"): bool,
+            OptionalKey("FILE"): str,
+            OptionalKey("MAX_BYTES"): int,
+            OptionalKey("BACKUP_COUNT"): int,
+            OptionalKey("COMPRESS"): bool,
+            OptionalKey("RATE_LIMIT_PER_SEC"): float,
+            OptionalKey("RATE_LIMIT_BURST"): int
+        },
+
+        OptionalKey("EVENT_ERROR_PUB"): {
+            OptionalKey("RATE_PER_SEC"): float,
+            OptionalKey("BURST"): int,
+            OptionalKey("COALESCE_WINDOW_SEC"): float
+        },
+
+        OptionalKey("SUPERVISOR"): {
+            OptionalKey("WORKERS"): int,
+            OptionalKey("SHARE_GROUP"): str,
+            OptionalKey("RESTART_DELAY_SEC"): int
+        },
+
+        OptionalKey("PUBLISH_SPOOL"): {
+            OptionalKey("DIR"): str,
+            OptionalKey("RAM_MAX_BYTES"): int,
+            OptionalKey("DISK_MAX_BYTES"): int,
+            OptionalKey("SEGMENT_BYTES"): int,
+            OptionalKey("DROP_POLICY"): str,
+            OptionalKey("TOPIC_PRIORITY"): dict,
+            OptionalKey("REPLAY_RATE_PER_SEC"): int
         }
     }
 
@@ -49,6 +152,14 @@ class HabdDlmConfRead:
         self.dpu_id = None
         self.database = None
         self.local_mqtt_broker = None
+        self.ingest = None
+        self.journal = None
+        self.retention = None
+        self.partitioning = None
+        self.logging = None
+        self.publish_spool = None
+        self.supervisor = None
+        self.event_error_pub = None
         self.json_data = None
 
     def read_cfg(self, file_name):
@@ -78,6 +189,14 @@ class HabdDlmConfRead:
 
             self.database = DatabaseStruct(**self.json_data['DATABASE'])
             self.local_mqtt_broker = LocalMQTTStruct(**self.json_data['LOCAL_MQTT_BROKER'])
+            self.ingest = IngestStruct(**self.json_data.get('INGEST', {}))
+            self.journal = JournalStruct(**self.json_data.get('JOURNAL', {}))
+            self.retention = RetentionStruct(**self.json_data.get('RETENTION', {}))
+            self.partitioning = PartitioningStruct(**self.json_data.get('PARTITIONING', {}))
+            self.logging = LoggingStruct(**self.json_data.get('LOGGING', {}))
+            self.publish_spool = PublishSpoolStruct(**self.json_data.get('PUBLISH_SPOOL', {}))
+            self.supervisor = SupervisorStruct(**self.json_data.get('SUPERVISOR', {}))
+            self.event_error_pub = EventErrorPubStruct(**self.json_data.get('EVENT_ERROR_PUB', {}))
             Log.logger.warning(f'Configuration File: {file_name} Read successfully')
             # Log.logger.warning(
             #     f'\n ------------------------------------------------------------'
@@ -106,6 +225,16 @@ class DatabaseStruct(NamedTuple):
     PASSWORD: str
     HOST: str
     DB_NAME: str
+    PORT: int = 5432
+    SOCKET_DIR: str = "/var/run/postgresql"  # used when HOST is "localhost"
+    MAX_CONNECTIONS: int = 8
+    POOL_TIMEOUT_SEC: int = 10
+    STALE_TIMEOUT_SEC: int = 3600
+    IDLE_TIMEOUT_SEC: int = 300
+    # Dead connections in a row that open the circuit breaker, reconnect probes back off exponentially
+    BREAKER_FAILURES: int = 2
+    RECONNECT_BACKOFF_BASE_SEC: float = 1.0
+    RECONNECT_BACKOFF_MAX_SEC: float = 30.0
 
 
 class LocalMQTTStruct(NamedTuple):
@@ -113,6 +242,129 @@ class LocalMQTTStruct(NamedTuple):
     USERNAME: str
     PASSWORD: str
     PORT: int
+    # Reconnect delay doubles from the base up to the max, the upper half is jittered
+    RECONNECT_BACKOFF_BASE_SEC: float = 1.0
+    RECONNECT_BACKOFF_MAX_SEC: float = 60.0
+    # QoS of the train topic subscriptions. MANUAL_ACK with QoS 1 sends the PUBACK only after the message is
+    # committed, with at most ACK_WINDOW messages not yet committed, on a persistent session. Off by default,
+    # opt in with "SUB_QOS": 1 and "MANUAL_ACK": true
+    SUB_QOS: int = 0
+    MANUAL_ACK: bool = False
+    ACK_WINDOW: int = 200
+    REDELIVERY_DELAY_SEC: int = 30
+    # A message failing MAX_DELIVERY_ATTEMPTS times (0: no limit) is acknowledged and republished to
+    # <DEAD_LETTER_TOPIC>/<topic>, an empty DEAD_LETTER_TOPIC only logs it
+    MAX_DELIVERY_ATTEMPTS: int = 5
+    DEAD_LETTER_TOPIC: str = "habd_dlm/dead_letter"
+    # Event, error and health topics (e.g. "dpu_dam/events") written to event_info, error_info and health_info
+    # on the event and health ingest lanes. None by default; a wildcard matches the DLM's own dpu_dlm topics too
+    EVENT_TOPICS: list = []
+    ERROR_TOPICS: list = []
+    HEALTH_TOPICS: list = []
+
+
+class IngestStruct(NamedTuple):
+    # "values" = one INSERT from unnest(arrays), "copy" = COPY through a staging table, "auto" = copy from COPY_MIN_AXLES
+    PROCESSED_INFO_MODE: str = "values"
+    COPY_MIN_AXLES: int = 200
+    WRITER_THREADS: int = 2
+    QUEUE_SIZE: int = 1000
+    ENQUEUE_TIMEOUT_SEC: int = 1  # how long a full writer queue may block the MQTT thread before dropping
+    # Writer queue depth / oldest message age (0 = off) from which events, errors and health are coalesced or shed
+    EVENT_SHED_DEPTH: int = 500
+    HEALTH_SHED_DEPTH: int = 250
+    SHED_AGE_SEC: float = 5.0
+    STATS_INTERVAL_SEC: int = 60
+    # event_info, error_info and health_info rows are written every LOG_BATCH_ROWS rows or LOG_BATCH_DELAY_MS
+    LOG_BATCH_ROWS: int = 100
+    LOG_BATCH_DELAY_MS: int = 500
+    # Per train axle aggregates kept in memory so consolidation does not re-read train_processed_info
+    AGGREGATE_CACHE_TRAINS: int = 64
+    AGGREGATE_CACHE_TTL_SEC: int = 1800
+    # habd_info temperatures held until the train_processed_info of their train arrives
+    PENDING_TEMP_MAX_AXLES: int = 20000
+    PENDING_TEMP_TTL_SEC: int = 600
+    # Commit the messages of a train together once all arrived, or ASSEMBLY_DEADLINE_SEC after the first one
+    ASSEMBLY_ENABLED: bool = False
+    ASSEMBLY_DEADLINE_SEC: int = 30
+    # Plausible axle readings (deg C, km/h), values outside are stored as NULL
+    AXLE_TEMP_MIN: float = -40.0
+    AXLE_TEMP_MAX: float = 250.0
+    AXLE_SPEED_MAX: float = 250.0
+
+
+class JournalStruct(NamedTuple):
+    # Accepted messages are journaled to DIR first and replayed into the database after an outage. Off by
+    # default, opt in with "ENABLED": true and a DIR on persistent storage
+    ENABLED: bool = False
+    DIR: str = "/home/l2m/habd-v1/journal/dlm"
+    SEGMENT_BYTES: int = 16 * 1024 * 1024
+    MAX_BYTES: int = 1024 * 1024 * 1024
+    SYNC_INTERVAL_MS: int = 200  # msync of the segments, broker acks of journal only messages wait for it
+    REPLAY_BATCH: int = 500
+    PROBE_INTERVAL_SEC: int = 5
+    MAX_ATTEMPTS: int = 3  # replays of a record failing while the database is reachable before it is discarded
+
+
+class RetentionStruct(NamedTuple):
+    MAX_TRAINS: int = 5000
+    TRAIN_EVICT_BATCH: int = 100
+    EVENT_INFO_DAYS: int = 180
+    ERROR_INFO_DAYS: int = 180
+    HEALTH_INFO_DAYS: int = 180
+    PURGE_INTERVAL_SEC: int = 3600
+    PURGE_CHUNK_SIZE: int = 5000
+    # train_processed_info rows of trains without train_consolidated_info are deleted after this age
+    ORPHAN_AXLE_HOURS: int = 24
+
+
+class PartitioningStruct(NamedTuple):
+    # Range partition event_info, error_info and health_info by "day" or "month" on new installations
+    ENABLED: bool = False
+    INTERVAL: str = "month"
+    PRECREATE: int = 2
+
+
+class LoggingStruct(NamedTuple):
+    # Format and write log records on a listener thread instead of the MQTT and writer threads. Off by default,
+    # opt in with "ASYNC": true; FILE and the rotation and rate limit settings apply only then
+    ASYNC: bool = False
+    FILE: str = ""  # size rotated log file, empty for console only
+    MAX_BYTES: int = 5 * 1024 * 1024
+    BACKUP_COUNT: int = 5
+    COMPRESS: bool = True
+    # WARNING and lower records per second and call site, 0 disables the limit
+    RATE_LIMIT_PER_SEC: float = 0.0
+    RATE_LIMIT_BURST: int = 10
+
+
+class PublishSpoolStruct(NamedTuple):
+    # Messages published during a broker outage: RAM first, then memory mapped segments in DIR
+    DIR: str = ""  # empty for RAM only
+    RAM_MAX_BYTES: int = 8 * 1024 * 1024
+    DISK_MAX_BYTES: int = 256 * 1024 * 1024
+    SEGMENT_BYTES: int = 4 * 1024 * 1024
+    # "oldest" or "priority" (TOPIC_PRIORITY: topic prefix -> 0..255, higher is kept longer)
+    DROP_POLICY: str = "oldest"
+    TOPIC_PRIORITY: dict = {}
+    REPLAY_RATE_PER_SEC: int = 100
+
+
+class EventErrorPubStruct(NamedTuple):
+    # Published events / errors per (module, id): BURST at once, then RATE_PER_SEC (0 = no limit), the rest
+    # is published as one message with a repeat count every COALESCE_WINDOW_SEC
+    RATE_PER_SEC: float = 1.0
+    BURST: int = 5
+    COALESCE_WINDOW_SEC: float = 10.0
+
+
+class SupervisorStruct(NamedTuple):
+    # More than 1 runs that many worker processes on $share/<SHARE_GROUP>/ subscriptions, trains are
+    # forwarded between the workers so each train is written by one worker. Forwards use the SUB_QOS of the
+    # local broker, a QoS 1 message is acknowledged after the broker acknowledged its forward
+    WORKERS: int = 1
+    SHARE_GROUP: str = "habd_dlm"
+    RESTART_DELAY_SEC: int = 5
 
 
 if __name__ == "__main__":
@@ -17,16 +17,27 @@
 *****************************************************************************
 '''
 
+import os
 import time
 import json
+import signal
 import sys
 sys.path.append("..")  # parent folder where habd_common lives
 
 # '''Import HABD packages '''
 from habd_log import Log
-from habd_model import TrainProcessedInfo, TrainConsolidatedInfo, EventInfo, ErrorInfo, HealthInfo
+from habd_model import TrainProcessedInfo, TrainConsolidatedInfo, EventInfo, ErrorInfo, HealthInfo, db_breaker
 from habd_api import HabdAPI
 from habd_dlm_conf import HabdDlmConfRead
+from habd_retention import RetentionScheduler
+from habd_partition import PartitionManager
+from habd_ingest import IngestDispatcher
+from habd_journal import IngestJournal
+from habd_assembly import TrainAssembler
+from habd_spool import PublishSpool
+from habd_supervisor import Supervisor, TrainForwarder, worker_name
+from habd_decode import message_decoder, MessageRejected, TrainProcessedMsg, HabdInfoMsg, TrainConsolidatedMsg, \
+    EventMsg, ErrorMsg, HealthMsg
 from mqtt_client import *
 from datetime import datetime
 
@@ -37,51 +48,108 @@ sys.path.insert(1, "/home/l2m/habd-v1/src/habd_common")
 
 class DLMSub:
     # ''' DLM MQTT Subscribe class / methods '''
-    def __init__(self, db_api_obj, habd_health_cls_obj):
+    # The *_sub_fn callbacks run on the MQTT network thread and only queue the payload,
+    # the process_* methods run on the IngestDispatcher writer threads
+    def __init__(self, db_api_obj, habd_health_cls_obj, ingest_dispatcher, train_assembler=None):
         self.habd_api = db_api_obj
         self.habd_health = habd_health_cls_obj
+        self.ingest = ingest_dispatcher
+        # Optional, collects the messages of a train and commits them together
+        self.train_assembler = train_assembler
 
     def dpu_pm_tpd_sub_fn(self, in_client, user_data, message):
-        Log.logger.info(f'dpu_pm_tpd_sub_fn : {message.payload}')
+        self.ingest.submit(message.topic, message.payload, self.process_train_processed_info)
+
+    def dpu_pm_tcd_sub_fn(self, in_client, user_data, message):
+        self.ingest.submit(message.topic, message.payload, self.process_train_consolidated_info)
+
+    def dpu_pm_habd_info_sub_fn(self, in_client, user_data, message):
+        self.ingest.submit(message.topic, message.payload, self.process_habd_info)
+
+    def dpu_event_sub_fn(self, in_client, user_data, message):
+        self.ingest.submit(message.topic, message.payload, self.process_event, lane=IngestDispatcher.LANE_EVENT)
+
+    def dpu_error_sub_fn(self, in_client, user_data, message):
+        self.ingest.submit(message.topic, message.payload, self.process_error, lane=IngestDispatcher.LANE_EVENT)
+
+    def dpu_health_sub_fn(self, in_client, user_data, message):
+        self.ingest.submit(message.topic, message.payload, self.process_health_info,
+                           lane=IngestDispatcher.LANE_HEALTH)
+
+    @staticmethod
+    def decode(msg_cls, payload):
+        '''Typed message of a payload, None when it is rejected (counted by the decoder)'''
+        try:
+            return message_decoder.decode(msg_cls, payload)
+        except MessageRejected as e:
+            Log.logger.error(f'DLMSub: rejected message: {e}')
+            return None
+
+    def process_train_processed_info(self, payload):
+        Log.logger.info('dpu_pm_tpd_sub_fn : %s', payload)
+        msg = self.decode(TrainProcessedMsg, payload)
+        if msg is None:
+            return
         try:
-            self.habd_api.insert_train_processed_info(message.payload)
+            if self.train_assembler is not None and self.train_assembler.add(TrainAssembler.PROCESSED, msg):
+                return
+            self.habd_api.insert_train_processed_info(msg)
         except Exception as e:
             Log.logger.error(f'Error processing train processed info: {e}')
 
-    def dpu_pm_tcd_sub_fn(self, in_client, user_data, message):
-        Log.logger.info(f'dpu_pm_tcd_sub_fn : {message.payload}')
+    def process_train_consolidated_info(self, payload):
+        Log.logger.info('dpu_pm_tcd_sub_fn : %s', payload)
+        msg = self.decode(TrainConsolidatedMsg, payload)
+        if msg is None:
+            return
         try:
-            self.habd_api.insert_train_consolidated_info(message.payload)
+            if self.train_assembler is not None and self.train_assembler.add(TrainAssembler.CONSOLIDATED, msg):
+                return
+            self.habd_api.insert_train_consolidated_info(msg)
         except Exception as e:
             Log.logger.error(f'Error processing train consolidated info: {e}')
 
-    def dpu_pm_habd_info_sub_fn(self, in_client, user_data, message):
-        Log.logger.info(f'dpu_pm_habd_info_sub_fn : {message.payload}')
+    def process_habd_info(self, payload):
+        Log.logger.info('dpu_pm_habd_info_sub_fn : %s', payload)
+        msg = self.decode(HabdInfoMsg, payload)
+        if msg is None:
+            return
         try:
-            self.habd_api.insert_habd_temp_info(message.payload)
+            if self.train_assembler is not None and self.train_assembler.add(TrainAssembler.HABD_INFO, msg):
+                return
+            self.habd_api.insert_habd_temp_info(msg)
         except Exception as e:
             Log.logger.error(f'Error processing HABD info: {e}')
 
-    def dpu_event_sub_fn(self, in_client, user_data, message):
-        Log.logger.info(f'dpu_event_sub_fn : topic: {message.topic}, {message.payload}')
+    def process_event(self, payload):
+        Log.logger.info('dpu_event_sub_fn : %s', payload)
+        msg = self.decode(EventMsg, payload)
+        if msg is None:
+            return
         try:
-            self.habd_api.insert_habd_event_info(message.payload)
-            self.habd_health.process_health_events(message.payload)
+            self.habd_api.insert_habd_event_info(msg)
+            self.habd_health.process_health_events(msg)
         except Exception as e:
             Log.logger.error(f'Error processing event: {e}')
-    
-    def dpu_error_sub_fn(self, in_client, user_data, message):
-        Log.logger.info(f'dpu_error_sub_fn : topic: {message.topic}, {message.payload}')
+
+    def process_error(self, payload):
+        Log.logger.info('dpu_error_sub_fn : %s', payload)
+        msg = self.decode(ErrorMsg, payload)
+        if msg is None:
+            return
         try:
-            self.habd_api.insert_habd_error_info(message.payload)
-            self.habd_health.process_health_errors(message.payload)
+            self.habd_api.insert_habd_error_info(msg)
+            self.habd_health.process_health_errors(msg)
         except Exception as e:
             Log.logger.error(f'Error processing error: {e}')
 
-    def dpu_health_sub_fn(self, in_client, user_data, message):
-        Log.logger.warning(f'dpu_health_sub_fn : {message.payload}')
+    def process_health_info(self, payload):
+        Log.logger.warning('dpu_health_sub_fn : %s', payload)
+        msg = self.decode(HealthMsg, payload)
+        if msg is None:
+            return
         try:
-            self.habd_api.insert_habd_health_info(message.payload)
+            self.habd_api.insert_habd_health_info(msg)
         except Exception as e:
             Log.logger.error(f'Error processing health info: {e}')
 
@@ -96,51 +164,170 @@ if __name__ == '__main__':
     cfg = HabdDlmConfRead()
     cfg.read_cfg('/home/l2m/habd-v1/config/habd_dlm.conf')
 
+    '''Supervisor mode: only run and restart the worker processes'''
+    worker_idx = None
+    num_workers = 1
+    if '--worker' in sys.argv:
+        arg_idx = sys.argv.index('--worker')
+        worker_idx = int(sys.argv[arg_idx + 1])
+        num_workers = int(sys.argv[arg_idx + 2])
+        Log.logger.warning(f'DLM worker {worker_idx} of {num_workers}')
+    elif cfg.supervisor.WORKERS > 1:
+        Supervisor(os.path.abspath(__file__), cfg.supervisor.WORKERS, cfg.supervisor.RESTART_DELAY_SEC).run()
+        sys.exit(0)
+    # Database maintenance, health and reboot information are done by one process only
+    main_worker = worker_idx in (None, 0)
+
+    '''Shut down cleanly when stopped by the supervisor or systemd'''
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    '''Log formatting and file I/O on a listener thread'''
+    if cfg.logging.ASYNC:
+        Log.start_async(worker_name(cfg.logging.FILE, worker_idx) or None, cfg.logging.MAX_BYTES,
+                        cfg.logging.BACKUP_COUNT, cfg.logging.COMPRESS, cfg.logging.RATE_LIMIT_PER_SEC,
+                        cfg.logging.RATE_LIMIT_BURST)
+
+    '''Publish spool for broker outages, messages left by the previous run are replayed'''
+    pub_spool = PublishSpool(worker_name(cfg.publish_spool.DIR, worker_idx) or None, cfg.publish_spool.RAM_MAX_BYTES,
+                             cfg.publish_spool.DISK_MAX_BYTES, cfg.publish_spool.SEGMENT_BYTES,
+                             cfg.publish_spool.DROP_POLICY, cfg.publish_spool.TOPIC_PRIORITY)
+
     '''Create MQTT Client object and connect '''
-    mqtt_client = MqttClient(cfg.local_mqtt_broker.BROKER_IP_ADDRESS, cfg.local_mqtt_broker.PORT, "habd_dlm",
-                             cfg.local_mqtt_broker.USERNAME, cfg.local_mqtt_broker.PASSWORD, 'habd_dlm')
+    client_id = worker_name("habd_dlm", worker_idx)
+    mqtt_client = MqttClient(cfg.local_mqtt_broker.BROKER_IP_ADDRESS, cfg.local_mqtt_broker.PORT, client_id,
+                             cfg.local_mqtt_broker.USERNAME, cfg.local_mqtt_broker.PASSWORD, client_id,
+                             pub_spool, cfg.publish_spool.REPLAY_RATE_PER_SEC,
+                             cfg.local_mqtt_broker.RECONNECT_BACKOFF_BASE_SEC,
+                             cfg.local_mqtt_broker.RECONNECT_BACKOFF_MAX_SEC, cfg.local_mqtt_broker.MANUAL_ACK,
+                             cfg.local_mqtt_broker.ACK_WINDOW, cfg.local_mqtt_broker.REDELIVERY_DELAY_SEC,
+                             cfg.local_mqtt_broker.MAX_DELIVERY_ATTEMPTS, cfg.local_mqtt_broker.DEAD_LETTER_TOPIC)
     mqtt_client.connect()
 
     '''initialise habd_api and connect database'''
     db_api = HabdAPI(cfg, mqtt_client)
+    db_api.table_writers = num_workers
     psql_db = db_api.connect_database(cfg)
 
     '''Create database model'''
-    if psql_db:
+    partition_mgr = None
+    if psql_db and main_worker:
+        if cfg.partitioning.ENABLED:
+            partition_mgr = PartitionManager(psql_db, cfg.partitioning.INTERVAL, cfg.partitioning.PRECREATE)
+            partition_mgr.create_partitioned_tables([EventInfo, ErrorInfo, HealthInfo])
         try:
             psql_db.create_tables([TrainProcessedInfo, TrainConsolidatedInfo, EventInfo, ErrorInfo, HealthInfo])
             Log.logger.info("Database tables created/verified successfully")
         except Exception as e:
             Log.logger.error(f"Error creating tables: {e}")
 
-    eve_err_pub = EventErrorPub(mqtt_client, cfg.dpu_id)
+    '''Purge expired event, error and health records off the ingest path'''
+    retention_scheduler = None
+    if main_worker:
+        retention_scheduler = RetentionScheduler(db_api, cfg.retention.PURGE_INTERVAL_SEC, partition_mgr)
+        retention_scheduler.start()
+
+    eve_err_pub = EventErrorPub(mqtt_client, cfg.dpu_id, cfg.event_error_pub.RATE_PER_SEC, cfg.event_error_pub.BURST,
+                                cfg.event_error_pub.COALESCE_WINDOW_SEC)
 
     '''Health information'''
     habd_health = Health(mqtt_client, cfg.dpu_id, eve_err_pub)
 
+    '''Writer threads doing the database work off the MQTT network thread'''
+    ingest_dispatcher = IngestDispatcher(cfg.ingest.WRITER_THREADS, cfg.ingest.QUEUE_SIZE,
+                                         cfg.ingest.ENQUEUE_TIMEOUT_SEC, cfg.ingest.EVENT_SHED_DEPTH,
+                                         cfg.ingest.HEALTH_SHED_DEPTH, cfg.ingest.SHED_AGE_SEC)
+    ingest_dispatcher.start()
+
+    '''Write-ahead journal in front of the writers, replays into the database after an outage'''
+    ingest_journal = None
+    if cfg.journal.ENABLED:
+        ingest_journal = IngestJournal(worker_name(cfg.journal.DIR, worker_idx), ingest_dispatcher,
+                                       cfg.journal.SEGMENT_BYTES, cfg.journal.MAX_BYTES, cfg.journal.SYNC_INTERVAL_MS,
+                                       cfg.journal.REPLAY_BATCH, cfg.journal.PROBE_INTERVAL_SEC,
+                                       cfg.journal.MAX_ATTEMPTS)
+
     '''Create DLMSub class object'''
-    dlm_sub = DLMSub(db_api, habd_health)
+    dlm_sub = DLMSub(db_api, habd_health, ingest_journal or ingest_dispatcher)
+    if ingest_journal is not None:
+        ingest_journal.handler_owner = dlm_sub
+        ingest_journal.start()
 
-    '''Subscribe all required MQTT topics '''
-    mqtt_client.sub("habd_pm/train_consolidated_info", dlm_sub.dpu_pm_tcd_sub_fn)
-    mqtt_client.sub("habd_pm/train_processed_info", dlm_sub.dpu_pm_tpd_sub_fn)
-    mqtt_client.sub("dpu_pm/habd_info", dlm_sub.dpu_pm_habd_info_sub_fn)  # Add this for temperature data
+    '''Per train topics, with the assembly part each one delivers'''
+    train_topics = [
+        ("habd_pm/train_consolidated_info", TrainAssembler.CONSOLIDATED, dlm_sub.dpu_pm_tcd_sub_fn),
+        ("habd_pm/train_processed_info", TrainAssembler.PROCESSED, dlm_sub.dpu_pm_tpd_sub_fn),
+        ("dpu_pm/habd_info", TrainAssembler.HABD_INFO, dlm_sub.dpu_pm_habd_info_sub_fn)  # temperature data
+    ]
 
-    '''System reboot information'''
-    habd_health.system_reboot_info()
+    '''Optionally commit each train once, when all subscribed parts arrived'''
+    train_assembler = None
+    if cfg.ingest.ASSEMBLY_ENABLED:
+        train_assembler = TrainAssembler(db_api, ingest_dispatcher, [part for _, part, _ in train_topics],
+                                         cfg.ingest.ASSEMBLY_DEADLINE_SEC)
+        train_assembler.start()
+        dlm_sub.train_assembler = train_assembler
 
-    '''insert health status when program start or restart'''
-    try:
-        json_health_info = json.dumps(habd_health.health_info)
-        db_api.insert_habd_health_info(json_health_info)
-        Log.logger.info("Initial health info inserted successfully")
-    except Exception as e:
-        Log.logger.error(f"Error inserting initial health info: {e}")
+    '''Subscribe all required MQTT topics, workers share them and forward each train to its worker'''
+    train_forwarder = None
+    if worker_idx is not None:
+        train_forwarder = TrainForwarder(mqtt_client, worker_idx, num_workers, cfg.supervisor.SHARE_GROUP)
+    for topic, _, sub_fn in train_topics:
+        if train_forwarder is not None:
+            train_forwarder.subscribe(topic, sub_fn, cfg.local_mqtt_broker.SUB_QOS)
+        else:
+            mqtt_client.sub(topic, sub_fn, cfg.local_mqtt_broker.SUB_QOS)
+
+    '''Event, error and health topics, shared by the workers without train routing'''
+    log_topics = [(topic, dlm_sub.dpu_event_sub_fn) for topic in cfg.local_mqtt_broker.EVENT_TOPICS] + \
+        [(topic, dlm_sub.dpu_error_sub_fn) for topic in cfg.local_mqtt_broker.ERROR_TOPICS] + \
+        [(topic, dlm_sub.dpu_health_sub_fn) for topic in cfg.local_mqtt_broker.HEALTH_TOPICS]
+    for topic, sub_fn in log_topics:
+        if worker_idx is not None:
+            topic = f'$share/{cfg.supervisor.SHARE_GROUP}/{topic}'
+        mqtt_client.sub(topic, sub_fn, cfg.local_mqtt_broker.SUB_QOS)
+
+    if main_worker:
+        '''System reboot information'''
+        habd_health.system_reboot_info()
+
+        '''insert health status when program start or restart'''
+        try:
+            json_health_info = json.dumps(habd_health.health_info)
+            db_api.insert_habd_health_info(message_decoder.decode(HealthMsg, json_health_info))
+            Log.logger.info("Initial health info inserted successfully")
+        except Exception as e:
+            Log.logger.error(f"Error inserting initial health info: {e}")
     
     try:
+        last_stats_time = time.monotonic()
         while True:
             time.sleep(10)
+            if time.monotonic() - last_stats_time >= cfg.ingest.STATS_INTERVAL_SEC:
+                last_stats_time = time.monotonic()
+                Log.logger.warning(f'Ingest stats: {ingest_dispatcher.stats()}, '
+                                   f'journal: {ingest_journal.stats() if ingest_journal else None}, '
+                                   f'database: {db_breaker.stats()}, '
+                                   f'events/errors suppressed: {db_api.dlm_pub.suppressed + eve_err_pub.suppressed}, '
+                                   f'pending habd_info: {db_api.pending_temps.stats()}, '
+                                   f'publish spool: {mqtt_client.spool_stats()}, '
+                                   f'mqtt: {mqtt_client.connection_stats()}, '
+                                   f'acks: {mqtt_client.ack_stats()}, '
+                                   f'forwarder: {train_forwarder.stats() if train_forwarder else None}, '
+                                   f'decoder: {message_decoder.stats()}')
     except KeyboardInterrupt:
         Log.logger.critical(f'Keyboard Interrupt occurred. Exiting the program')
     except Exception as e:
-        Log.logger.critical(f'Unexpected error occurred: {e}')
\ No newline at end of file
+        Log.logger.critical(f'Unexpected error occurred: {e}')
+    finally:
+        mqtt_client.disconnect()
+        if ingest_journal is not None:
+            ingest_journal.stop()
+        ingest_dispatcher.stop()
+        if train_assembler is not None:
+            train_assembler.stop()
+        db_api.stop_write_buffers()
+        if ingest_journal is not None:
+            ingest_journal.close()
+        if retention_scheduler is not None:
+            retention_scheduler.stop()
+        Log.stop_async()
\ No newline at end of file
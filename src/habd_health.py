@@ -52,12 +52,10 @@ class Health:
         '''set flag as per interrogator link status'''
         self.interrogator_link_flag = False
 
-    def process_health_errors(self, msg):
-        '''process health info related errors'''
+    def process_health_errors(self, error_msg):
+        '''process health info related errors (ErrorMsg)'''
         try: 
-            error_msg = json.loads(msg)
-            
-            if error_msg["error_id"] == "DAM-ERROR-001":
+            if error_msg.error_id == "DAM-ERROR-001":
                 if self.interrogator_link_flag == False:
                     self.health_info["interrogator_link"] = "down"
                     self.health_info["ts"] = time.time()
@@ -78,8 +76,8 @@ class Health:
                 else:
                     pass
             
-            elif error_msg["error_id"] == "DAM-ERROR-002":
-                error_desc = error_msg["error_desc"]
+            elif error_msg.error_id == "DAM-ERROR-002":
+                error_desc = error_msg.error_desc
                 splited_error_desc_list = error_desc.split(":")
                 faulty_sensor_list = str(splited_error_desc_list[1]).split(" ")
                 
@@ -100,7 +98,7 @@ class Health:
                 self.publish_health_info(self.health_info)
                 Log.logger.info(f'{self.health_info}')
             
-            elif error_msg['error_id'] in ["CM-ERROR-001", "CM-ERROR-002"]:
+            elif error_msg.error_id in ["CM-ERROR-001", "CM-ERROR-002"]:
                 self.health_info["comm_link"] = "down"
                 self.health_info["ts"] = time.time()
                 self.publish_health_info(self.health_info)
@@ -109,11 +107,10 @@ class Health:
         except Exception as ex:
             Log.logger.critical(f'process_health_errors: exception : {ex}', exc_info=True)
 
-    def process_health_events(self, msg):
-        '''process health info related events'''
+    def process_health_events(self, event_msg):
+        '''process health info related events (EventMsg)'''
         try:
-            event_msg = json.loads(msg) 
-            if event_msg["event_id"] == "DAM-EVENT-001":
+            if event_msg.event_id == "DAM-EVENT-001":
                 if self.interrogator_link_flag == True:
                     self.health_info["interrogator_link"] = "up"
                     self.health_info["ts"] = time.time()
@@ -128,7 +125,7 @@ class Health:
                     self.interrogator_link_flag = False
                 else:
                     pass
-            elif event_msg['event_id'] == "DAM-EVENT-002":
+            elif event_msg.event_id == "DAM-EVENT-002":
                 self.health_info["interrogator_link"] = "up"
                 self.health_info["ts"] = time.time()
                 for health_idx in self.health_info:
@@ -137,7 +134,7 @@ class Health:
                     else:
                         pass
                 self.publish_health_info(self.health_info)
-            elif event_msg['event_id'] == "CM-EVENT-001":
+            elif event_msg.event_id == "CM-EVENT-001":
                 self.health_info["comm_link"] = "up"
                 self.health_info["ts"] = time.time()
                 self.publish_health_info(self.health_info)
@@ -0,0 +1,320 @@
+'''
+*****************************************************************************
+*File : habd_ingest.py
+*Module : habd_dlm
+*Purpose : habd data logging module (DLM) bounded ingest queue and writer threads
+*Author : HABD Team
+*Copyright : Copyright 2025, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+# '''Import python packages'''
+import re
+import time
+import zlib
+import threading
+from collections import deque
+
+# '''Import HABD packages '''
+from habd_log import Log
+from habd_model import psql_db
+from habd_wire import read_train_id
+from habd_common.habd_ack import current_delivery, bound_delivery
+
+
+class IngestItem:
+    '''One queued message, coalesce_key is set for the messages of the lower lanes'''
+
+    __slots__ = ('enqueue_ts', 'topic', 'payload', 'handler_fn', 'delivery', 'lane', 'coalesce_key')
+
+    def __init__(self, enqueue_ts, topic, payload, handler_fn, delivery, lane, coalesce_key):
+        self.enqueue_ts = enqueue_ts
+        self.topic = topic
+        self.payload = payload
+        self.handler_fn = handler_fn
+        self.delivery = delivery
+        self.lane = lane
+        self.coalesce_key = coalesce_key
+
+
+class LaneQueue:
+    '''
+    Queue of one writer with a FIFO per priority lane, pop() serves the highest priority (lowest index)
+    non empty lane. maxsize bounds all lanes together. Not thread safe by itself, used under cond.
+    '''
+
+    def __init__(self, maxsize, num_lanes):
+        self.maxsize = max(1, maxsize)
+        self.lanes = [deque() for _ in range(num_lanes)]
+        self.cond = threading.Condition()
+        self.size = 0
+        self.closed = False
+        # coalesce_key -> queued IngestItem of the lower lanes
+        self.coalesce = {}
+        self.shedding = [False] * num_lanes
+
+    def qsize(self):
+        return self.size
+
+    def oldest_ts(self):
+        return min((lane[0].enqueue_ts for lane in self.lanes if lane), default=None)
+
+    def append(self, item):
+        self.lanes[item.lane].append(item)
+        self.size += 1
+        if item.coalesce_key is not None:
+            self.coalesce[item.coalesce_key] = item
+
+    def pop(self):
+        for lane in self.lanes:
+            if lane:
+                return self.forget(lane.popleft())
+        return None
+
+    def evict_below(self, lane):
+        '''Oldest item of the lowest priority non empty lane below lane, None when there is none'''
+        for lower in reversed(self.lanes[lane + 1:]):
+            if lower:
+                return self.forget(lower.popleft())
+        return None
+
+    def forget(self, item):
+        self.size -= 1
+        if item.coalesce_key is not None and self.coalesce.get(item.coalesce_key) is item:
+            del self.coalesce[item.coalesce_key]
+        return item
+
+
+class IngestDispatcher:
+    '''
+    Decouple MQTT receive from database writes. MQTT callbacks only submit the raw payload, a pool of
+    writer threads runs the handlers. Messages of one train_id always go to the same writer, so
+    train_processed_info, habd_info and train_consolidated_info of a train keep their arrival order.
+    Messages without a train_id (events, errors, health) share one writer to keep their order too.
+    With manual ack the Delivery of the submitting thread is held until the handler returned, and is
+    current_delivery() while the handler runs.
+
+    Each writer serves its messages by priority lane: train data first, then events and errors, then
+    health. While a writer queue is deeper than the shed depth of a lower lane, or its oldest message is
+    older than shed_age_sec, a new message of that lane replaces a queued one with the same coalesce key
+    (topic and event_id / error_id) or is shed. A train message finding the queue full evicts the oldest
+    message of the lowest lane. Coalesced and shed messages are acknowledged, they are not redelivered.
+    '''
+
+    TRAIN_ID_RE = re.compile(rb'"train_id"\s*:\s*"([^"]*)"')
+    COALESCE_ID_RE = re.compile(rb'"(?:event_id|error_id)"\s*:\s*"?([^",}\s]*)')
+    NO_TRAIN_KEY = b'dpu'
+
+    LANE_TRAIN = 0
+    LANE_EVENT = 1  # events and errors
+    LANE_HEALTH = 2
+    LANE_NAMES = ("train", "event", "health")
+
+    def __init__(self, num_workers, queue_size, enqueue_timeout_sec, event_shed_depth=None, health_shed_depth=None,
+                 shed_age_sec=0):
+        self.num_workers = max(1, num_workers)
+        self.enqueue_timeout_sec = enqueue_timeout_sec
+        self.queues = [LaneQueue(queue_size, len(self.LANE_NAMES)) for _ in range(self.num_workers)]
+        # Queue depth from which a lane is shed, by lane index, the train lane is never shed
+        self.shed_depth = (None,
+                           queue_size // 2 if event_shed_depth is None else event_shed_depth,
+                           queue_size // 4 if health_shed_depth is None else health_shed_depth)
+        self.shed_age_sec = shed_age_sec
+        self.workers = []
+        self.stats_lock = threading.Lock()
+        self.enqueued = 0
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.shed = [0] * len(self.LANE_NAMES)
+        self.coalesced = [0] * len(self.LANE_NAMES)
+        self.max_depth = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def start(self):
+        for idx in range(self.num_workers):
+            th = threading.Thread(target=self.worker_loop, name=f'habd_writer_{idx}', args=(idx,))
+            th.daemon = True
+            th.start()
+            self.workers.append(th)
+        Log.logger.info(f'IngestDispatcher: started {self.num_workers} writer threads')
+
+    def stop(self):
+        '''Let the writers drain what is already queued, then stop them'''
+        for q in self.queues:
+            with q.cond:
+                q.closed = True
+                q.cond.notify_all()
+        for th in self.workers:
+            th.join()
+        self.workers = []
+        Log.logger.warning(f'IngestDispatcher: stopped, {self.stats()}')
+
+    @staticmethod
+    def routing_key(payload):
+        '''train_id of the payload without decoding the whole JSON document'''
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        # Binary train_processed_info carries the train_id in its header
+        train_id = read_train_id(payload)
+        if train_id is not None:
+            return train_id
+        match = IngestDispatcher.TRAIN_ID_RE.search(payload)
+        return match.group(1) if match else IngestDispatcher.NO_TRAIN_KEY
+
+    def coalesce_key(self, topic, payload):
+        '''Messages with the same key can replace each other under overload: topic and event_id / error_id'''
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        match = IngestDispatcher.COALESCE_ID_RE.search(payload)
+        return (topic, match.group(1) if match else None)
+
+    def overloaded(self, q, lane, now):
+        '''True when lane has to be coalesced or shed on writer queue q, called with q.cond held'''
+        if q.size >= self.shed_depth[lane]:
+            return True
+        oldest_ts = q.oldest_ts()
+        return bool(self.shed_age_sec) and oldest_ts is not None and now - oldest_ts >= self.shed_age_sec
+
+    def submit(self, topic, payload, handler_fn, key=None, lane=LANE_TRAIN):
+        '''
+        Queue a payload for handler_fn on the given priority lane, called from the MQTT network thread.
+        key (bytes) overrides the train_id routing of the payload. Returns False when dropped or shed
+        '''
+        idx = zlib.crc32(self.routing_key(payload) if key is None else key) % self.num_workers
+        q = self.queues[idx]
+        delivery = current_delivery()
+        if delivery is not None:
+            delivery.hold()
+        now = time.monotonic()
+        item = IngestItem(now, topic, payload, handler_fn, delivery, lane,
+                          None if lane == self.LANE_TRAIN else self.coalesce_key(topic, payload))
+        # Messages leaving the queue without being handled, released outside of the queue lock
+        acked = []
+        result = None
+        with q.cond:
+            if lane != self.LANE_TRAIN:
+                overloaded = self.overloaded(q, lane, now)
+                if overloaded != q.shedding[lane]:
+                    q.shedding[lane] = overloaded
+                    Log.logger.warning(f'IngestDispatcher: writer {idx} {self.LANE_NAMES[lane]} lane '
+                                       f'{"shedding" if overloaded else "recovered"}, depth: {q.size}')
+                if overloaded:
+                    queued = q.coalesce.get(item.coalesce_key)
+                    if queued is not None:
+                        # The newer message takes the place of the queued one
+                        acked.append(queued.delivery)
+                        queued.payload, queued.handler_fn, queued.delivery = payload, handler_fn, delivery
+                        result = 'coalesced'
+                    else:
+                        acked.append(delivery)
+                        result = 'shed'
+            if result is None:
+                deadline = now + self.enqueue_timeout_sec
+                while q.size >= q.maxsize:
+                    evicted = q.evict_below(lane)
+                    if evicted is not None:
+                        acked.append(evicted.delivery)
+                        with self.stats_lock:
+                            self.shed[evicted.lane] += 1
+                        continue
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    q.cond.wait(remaining)
+                if q.size < q.maxsize:
+                    q.append(item)
+                    q.cond.notify_all()
+                    result = 'queued'
+                else:
+                    result = 'dropped'
+            depth = q.size
+        for acked_delivery in acked:
+            if acked_delivery is not None:
+                acked_delivery.release()
+        if result == 'dropped':
+            if delivery is not None:
+                delivery.release(failed=True)
+            with self.stats_lock:
+                self.dropped += 1
+            Log.logger.error(f'IngestDispatcher: writer {idx} queue full, dropped message topic: {topic}')
+            return False
+        with self.stats_lock:
+            if result == 'queued':
+                self.enqueued += 1
+                self.max_depth = max(self.max_depth, depth)
+            elif result == 'coalesced':
+                self.coalesced[lane] += 1
+            else:
+                self.shed[lane] += 1
+        return result != 'shed'
+
+    def depth(self):
+        '''Messages queued on all writers'''
+        return sum(q.qsize() for q in self.queues)
+
+    def worker_loop(self, idx):
+        q = self.queues[idx]
+        while True:
+            with q.cond:
+                item = q.pop()
+                while item is None and not q.closed:
+                    q.cond.wait()
+                    item = q.pop()
+                # Wake a submitter waiting for room
+                q.cond.notify_all()
+            if item is None:
+                break
+            enqueue_ts, topic, payload, handler_fn, delivery = (item.enqueue_ts, item.topic, item.payload,
+                                                                item.handler_fn, item.delivery)
+            wait_time = time.monotonic() - enqueue_ts
+            failed = False
+            try:
+                # A handler running SQL connects on its first statement, handlers that only buffer do not take
+                # a pooled connection (and do not fail while the database is unavailable)
+                with bound_delivery(delivery):
+                    handler_fn(payload)
+            except Exception as e:
+                failed = True
+                Log.logger.error(f'IngestDispatcher: writer {idx} topic: {topic} exception: {e}', exc_info=True)
+            finally:
+                self.release_connection(idx)
+            if delivery is not None:
+                delivery.release(failed)
+            with self.stats_lock:
+                self.processed += 1
+                self.failed += failed
+                self.wait_time_total += wait_time
+                self.wait_time_max = max(self.wait_time_max, wait_time)
+        Log.logger.info(f'IngestDispatcher: exiting writer thread {idx}')
+
+    @staticmethod
+    def release_connection(idx):
+        '''Return the pooled connection of this writer thread after every message, if the handler took one'''
+        try:
+            if not psql_db.is_closed():
+                psql_db.close()
+        except Exception as e:
+            Log.logger.error(f'IngestDispatcher: writer {idx} unable to release the database connection: {e}')
+
+    def stats(self):
+        '''Queue depth and wait time statistics, max values are reset on every call'''
+        with self.stats_lock:
+            stats = {
+                "depth": [q.qsize() for q in self.queues],
+                "max_depth": self.max_depth,
+                "enqueued": self.enqueued,
+                "processed": self.processed,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "lane_depth": {name: sum(len(q.lanes[lane]) for q in self.queues)
+                               for lane, name in enumerate(self.LANE_NAMES)},
+                "shed": dict(zip(self.LANE_NAMES[1:], self.shed[1:])),
+                "coalesced": dict(zip(self.LANE_NAMES[1:], self.coalesced[1:])),
+                "avg_wait_ms": round(self.wait_time_total / self.processed * 1000, 2) if self.processed else 0.0,
+                "max_wait_ms": round(self.wait_time_max * 1000, 2)
+            }
+            self.max_depth = 0
+            self.wait_time_max = 0.0
+        return stats
@@ -0,0 +1,479 @@
+'''
+*****************************************************************************
+*File : habd_journal.py
+*Module : habd_dlm
+*Purpose : habd data logging module (DLM) write-ahead ingest journal for database outages
+*Author : HABD Team
+*Copyright : Copyright 2025, Lab to Market Innovations Private Limited
+*****************************************************************************
+
+Every accepted message is appended to a memory mapped, append-only segment file before it is queued for
+the database. Each record gets a sequence number; the replay offset is the highest sequence number up to
+which every record was written to the database, it is persisted in replay.offset. While the database is
+unreachable messages are only journaled (and acknowledged to the broker once synced), the replay thread
+probes the database and, when it is back, submits the journaled records in batches to the IngestDispatcher
+until the journal is caught up. Segments below the replay offset are deleted.
+
+Segment file layout, little-endian:
+    header      magic b'HBJL', u32 write offset                                                 (8 bytes)
+    records     u32 crc32 of the rest of the record, u64 sequence number, u32 payload length,
+                u16 topic length, u8 handler name length, u8 lane, topic, handler name, payload
+Records after the last replay offset are replayed after a restart, so a record may be written twice.
+'''
+
+# '''Import python packages'''
+import os
+import mmap
+import time
+import zlib
+import struct
+import threading
+from collections import deque
+
+# '''Import HABD packages '''
+from habd_log import Log
+from habd_model import psql_db, db_breaker
+from habd_ingest import IngestDispatcher
+from habd_common.habd_ack import current_delivery, bound_delivery
+
+MAGIC = b'HBJL'
+HEADER = struct.Struct('<4sI')
+RECORD = struct.Struct('<IQIHBB')
+OFFSET = struct.Struct('<Q')
+OFFSET_FILE = 'replay.offset'
+
+
+class JournalSegment:
+    '''One memory mapped segment file, records are appended at the write offset'''
+
+    def __init__(self, file_name, number, size=None):
+        self.file_name = file_name
+        self.number = number
+        self.first_seq = None
+        self.last_seq = None
+        if size is not None:
+            with open(file_name, 'wb') as f:
+                f.truncate(size)
+        self.fd = os.open(file_name, os.O_RDWR)
+        self.size = os.fstat(self.fd).st_size
+        self.mm = mmap.mmap(self.fd, self.size)
+        if size is not None:
+            self.write_offset = HEADER.size
+            HEADER.pack_into(self.mm, 0, MAGIC, self.write_offset)
+        else:
+            self.recover()
+
+    def recover(self):
+        '''Find the records of an existing segment, stops at the first torn or corrupt record'''
+        magic, self.write_offset = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or not HEADER.size <= self.write_offset <= self.size:
+            Log.logger.error(f'JournalSegment: {self.file_name}: invalid header, segment skipped')
+            self.write_offset = HEADER.size
+            return
+        end = self.write_offset
+        self.write_offset = HEADER.size
+        for record in self.records(HEADER.size, end):
+            self.write_offset = record[0]
+        if self.write_offset < end:
+            Log.logger.error(f'JournalSegment: {self.file_name}: corrupt record at {self.write_offset}, rest dropped')
+
+    def records(self, offset, end=None):
+        '''(next offset, seq, topic, handler name, lane, payload) of the records from offset'''
+        end = self.write_offset if end is None else end
+        while offset + RECORD.size <= end:
+            crc, seq, payload_len, topic_len, handler_len, lane = RECORD.unpack_from(self.mm, offset)
+            start = offset + RECORD.size
+            next_offset = start + topic_len + handler_len + payload_len
+            if next_offset > end or zlib.crc32(self.mm[offset + 4:next_offset]) != crc:
+                return
+            if self.first_seq is None:
+                self.first_seq = seq
+            self.last_seq = max(seq, self.last_seq or 0)
+            topic = self.mm[start:start + topic_len].decode('utf-8')
+            handler = self.mm[start + topic_len:start + topic_len + handler_len].decode('utf-8')
+            yield next_offset, seq, topic, handler, lane, self.mm[start + topic_len + handler_len:next_offset]
+            offset = next_offset
+
+    def free_bytes(self):
+        return self.size - self.write_offset
+
+    def append(self, seq, topic_bytes, handler_bytes, lane, payload):
+        '''Write one record, the caller checks free_bytes() first'''
+        offset = self.write_offset
+        start = offset + RECORD.size
+        end = start + len(topic_bytes) + len(handler_bytes) + len(payload)
+        RECORD.pack_into(self.mm, offset, 0, seq, len(payload), len(topic_bytes), len(handler_bytes), lane)
+        self.mm[start:end] = topic_bytes + handler_bytes + payload
+        struct.pack_into('<I', self.mm, offset, zlib.crc32(self.mm[offset + 4:end]))
+        self.write_offset = end
+        HEADER.pack_into(self.mm, 0, MAGIC, self.write_offset)
+        if self.first_seq is None:
+            self.first_seq = seq
+        self.last_seq = seq
+
+    def flush(self):
+        self.mm.flush()
+
+    def close(self, remove=False):
+        self.mm.flush()
+        self.mm.close()
+        os.close(self.fd)
+        if remove:
+            os.remove(self.file_name)
+
+
+class JournalEntry:
+    '''
+    A journaled record on its way to the database. It is the current_delivery() of the handler, so the
+    write buffers and the train assembly hold() and release() it like an MQTT Delivery; the broker
+    delivery it wraps is acknowledged when the entry completes, the journal keeps a failed record.
+    '''
+
+    __slots__ = ('journal', 'seq', 'delivery', 'holds', 'failed')
+
+    def __init__(self, journal, seq, delivery=None):
+        self.journal = journal
+        self.seq = seq
+        self.delivery = delivery
+        self.holds = 1
+        self.failed = False
+        if delivery is not None:
+            delivery.hold()
+
+    def hold(self):
+        with self.journal.cond:
+            self.holds += 1
+
+    def fail(self):
+        with self.journal.cond:
+            self.failed = True
+
+    def release(self, failed=False):
+        with self.journal.cond:
+            self.failed = self.failed or failed
+            self.holds -= 1
+            if self.holds:
+                return
+            self.journal.complete(self)
+        if self.delivery is not None:
+            self.delivery.release()
+
+
+class IngestJournal:
+    '''
+    Write-ahead journal in front of the IngestDispatcher, submit() has the same signature. Handlers are
+    recorded by name and looked up on handler_owner (the DLMSub) when replayed, so records journaled
+    before a restart are replayed too. Records failing max_attempts replays while the database is
+    reachable are discarded.
+    '''
+
+    def __init__(self, journal_dir, dispatcher, segment_bytes=16 * 1024 * 1024, max_bytes=1024 * 1024 * 1024,
+                 sync_interval_ms=200, replay_batch=500, probe_interval_sec=5, max_attempts=3):
+        self.journal_dir = journal_dir
+        self.dispatcher = dispatcher
+        self.handler_owner = None
+        self.segment_bytes = max(segment_bytes, 64 * 1024)
+        self.max_bytes = max(max_bytes, 2 * self.segment_bytes)
+        self.sync_interval_sec = sync_interval_ms / 1000
+        self.replay_batch = max(1, replay_batch)
+        self.probe_interval_sec = probe_interval_sec
+        self.max_attempts = max(1, max_attempts)
+        self.cond = threading.Condition()
+        self.segments = deque()
+        self.disk_bytes = 0
+        self.next_seq = 1
+        # Every record up to offset is in the database
+        self.offset = 0
+        self.persisted_offset = None
+        # Records above offset that completed, and the ones queued for the database
+        self.done = set()
+        self.inflight = {}
+        self.attempts = {}
+        # Journal only mode, set while the database is unreachable and until the replay caught up
+        self.outage = False
+        self.replay_pending = False
+        # Broker deliveries of journal only records, acknowledged after the next sync
+        self.unsynced = []
+        self.dirty = set()
+        self.stop_event = threading.Event()
+        self.threads = []
+        self.journaled = 0
+        self.replayed = 0
+        self.failed = 0
+        self.discarded = 0
+        self.rejected = 0
+        os.makedirs(journal_dir, exist_ok=True)
+        self.recover()
+
+    def segment_name(self, number):
+        return os.path.join(self.journal_dir, f'seg-{number}.journal')
+
+    def recover(self):
+        '''Load the replay offset and the segments left by the previous run'''
+        offset_file = os.path.join(self.journal_dir, OFFSET_FILE)
+        offset = None
+        if os.path.exists(offset_file):
+            with open(offset_file, 'rb') as f:
+                data = f.read()
+            if len(data) == OFFSET.size:
+                offset = OFFSET.unpack(data)[0]
+        numbers = []
+        for name in os.listdir(self.journal_dir):
+            if name.startswith('seg-') and name.endswith('.journal'):
+                try:
+                    numbers.append(int(name[4:-8]))
+                except ValueError:
+                    continue
+        for number in sorted(numbers):
+            if os.path.getsize(self.segment_name(number)) < HEADER.size:
+                os.remove(self.segment_name(number))
+                continue
+            segment = JournalSegment(self.segment_name(number), number)
+            if segment.last_seq is None or (offset is not None and segment.last_seq <= offset):
+                segment.close(remove=True)
+                continue
+            # Recovered segments are sealed, appends start a new segment
+            segment.size = segment.write_offset
+            self.segments.append(segment)
+            self.disk_bytes += os.path.getsize(segment.file_name)
+        last_seq = max((segment.last_seq for segment in self.segments), default=offset or 0)
+        self.next_seq = max(last_seq, offset or 0) + 1
+        if offset is None:
+            offset = self.segments[0].first_seq - 1 if self.segments else 0
+        self.offset = self.persisted_offset = offset
+        if self.next_seq - 1 > self.offset:
+            self.outage = self.replay_pending = True
+            Log.logger.warning(f'IngestJournal: {self.next_seq - 1 - self.offset} records to replay from '
+                               f'{self.journal_dir}')
+
+    def start(self):
+        for target, name in ((self.sync_loop, 'habd_journal_sync'), (self.replay_loop, 'habd_journal_replay')):
+            th = threading.Thread(target=target, name=name)
+            th.daemon = True
+            th.start()
+            self.threads.append(th)
+
+    def stop(self):
+        '''Stop syncing and replaying, the records still queued complete before close()'''
+        self.stop_event.set()
+        with self.cond:
+            self.cond.notify_all()
+        for th in self.threads:
+            th.join()
+        self.threads = []
+
+    def close(self):
+        self.sync()
+        with self.cond:
+            for segment in self.segments:
+                segment.close()
+            self.segments.clear()
+        Log.logger.warning(f'IngestJournal: closed, {self.stats()}')
+
+    def append(self, topic, handler_name, lane, payload):
+        '''Journal one record with cond held, returns its seq or None when the journal is full'''
+        topic_bytes = topic.encode('utf-8')
+        handler_bytes = handler_name.encode('utf-8')
+        size = RECORD.size + len(topic_bytes) + len(handler_bytes) + len(payload)
+        segment = self.segments[-1] if self.segments else None
+        if segment is None or segment.free_bytes() < size:
+            segment_size = max(self.segment_bytes, HEADER.size + size)
+            if self.disk_bytes + segment_size > self.max_bytes:
+                return None
+            number = segment.number + 1 if segment is not None else 0
+            segment = JournalSegment(self.segment_name(number), number, segment_size)
+            self.segments.append(segment)
+            self.disk_bytes += segment_size
+        seq = self.next_seq
+        self.next_seq += 1
+        segment.append(seq, topic_bytes, handler_bytes, lane, payload)
+        self.dirty.add(segment)
+        return seq
+
+    def submit(self, topic, payload, handler_fn, key=None, lane=IngestDispatcher.LANE_TRAIN):
+        '''Journal a payload, then queue it on the dispatcher unless the database is unreachable'''
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        delivery = current_delivery()
+        with self.cond:
+            seq = self.append(topic, handler_fn.__name__, lane, payload)
+            if seq is None:
+                self.rejected += 1
+            elif self.outage:
+                self.journaled += 1
+                if delivery is not None:
+                    delivery.hold()
+                    self.unsynced.append(delivery)
+                return True
+            else:
+                entry = JournalEntry(self, seq, delivery)
+                self.inflight[seq] = entry
+        if seq is None:
+            Log.logger.error(f'IngestJournal: journal full ({self.disk_bytes} bytes), message topic: {topic} rejected')
+            if delivery is not None:
+                delivery.fail()
+            return False
+        with bound_delivery(entry):
+            result = self.dispatcher.submit(topic, payload, handler_fn, key, lane)
+        entry.release()
+        return result
+
+    def complete(self, entry):
+        '''Called with cond held when the last hold of an entry is released'''
+        if self.inflight.pop(entry.seq, None) is None:
+            return
+        if entry.failed:
+            self.failed += 1
+            self.attempts[entry.seq] = self.attempts.get(entry.seq, 0) + 1
+            self.replay_pending = True
+            self.cond.notify_all()
+            return
+        self.attempts.pop(entry.seq, None)
+        self.done.add(entry.seq)
+        while self.offset + 1 in self.done:
+            self.offset += 1
+            self.done.remove(self.offset)
+
+    def sync_loop(self):
+        while not self.stop_event.wait(self.sync_interval_sec):
+            try:
+                self.sync()
+            except Exception as e:
+                Log.logger.error(f'IngestJournal: sync failed: {e}', exc_info=True)
+        Log.logger.info(f'IngestJournal: exiting the sync thread')
+
+    def sync(self):
+        '''
+        msync the appended records, persist the replay offset and remove the replayed segments. Only this
+        thread closes segments, so they are flushed without holding cond
+        '''
+        with self.cond:
+            dirty, self.dirty = self.dirty, set()
+            unsynced, self.unsynced = self.unsynced, []
+            offset = self.offset
+        for segment in dirty:
+            segment.flush()
+        for delivery in unsynced:
+            delivery.release()
+        if offset == self.persisted_offset:
+            return
+        offset_file = os.path.join(self.journal_dir, OFFSET_FILE)
+        with open(offset_file + '.tmp', 'wb') as f:
+            f.write(OFFSET.pack(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(offset_file + '.tmp', offset_file)
+        self.persisted_offset = offset
+        with self.cond:
+            while len(self.segments) > 1 and self.segments[0].last_seq <= offset:
+                segment = self.segments.popleft()
+                self.disk_bytes -= os.path.getsize(segment.file_name)
+                segment.close(remove=True)
+
+    @staticmethod
+    def probe():
+        '''True when the database answers, db_breaker reconnects while its circuit is open'''
+        if db_breaker.is_open:
+            return False
+        try:
+            with psql_db.connection_context():
+                psql_db.execute_sql('SELECT 1')
+            return True
+        except Exception as e:
+            Log.logger.error(f'IngestJournal: database not reachable: {e}')
+            return False
+
+    def replay_loop(self):
+        while not self.stop_event.is_set():
+            with self.cond:
+                if not self.replay_pending and not self.outage:
+                    self.cond.wait(1.0)
+                    continue
+            if not self.probe():
+                with self.cond:
+                    if not self.outage:
+                        self.outage = True
+                        Log.logger.critical('IngestJournal: database unavailable, journaling only')
+                self.stop_event.wait(self.probe_interval_sec)
+                continue
+            try:
+                if not self.replay():
+                    # A replayed record failed, probe again before the next pass
+                    self.stop_event.wait(1.0)
+            except Exception as e:
+                Log.logger.error(f'IngestJournal: replay failed: {e}', exc_info=True)
+                self.stop_event.wait(self.probe_interval_sec)
+        Log.logger.info(f'IngestJournal: exiting the replay thread')
+
+    def replay(self):
+        '''
+        Submit the records above the replay offset that are neither done nor queued, in batches while the
+        dispatcher has room. Returns True when the journal caught up, False when a record failed
+        '''
+        with self.cond:
+            self.replay_pending = False
+            position = (self.segments[0].number if self.segments else 0, HEADER.size)
+        while not self.stop_event.is_set():
+            while self.dispatcher.depth() >= 2 * self.replay_batch and not self.stop_event.is_set():
+                time.sleep(0.05)
+            batch = []
+            with self.cond:
+                if self.replay_pending:
+                    return False
+                segment = next((segment for segment in self.segments if segment.number >= position[0]), None)
+                if segment is None:
+                    return self.caught_up()
+                offset = position[1] if segment.number == position[0] else HEADER.size
+                scanned = 0
+                for next_offset, seq, topic, handler, lane, payload in segment.records(offset):
+                    # Bound the time cond is held while skipping records that are done, the record at the
+                    # limit is left for the next pass
+                    if scanned >= 4 * self.replay_batch:
+                        break
+                    scanned += 1
+                    offset = next_offset
+                    if seq <= self.offset or seq in self.done or seq in self.inflight:
+                        continue
+                    if self.attempts.get(seq, 0) >= self.max_attempts:
+                        Log.logger.error(f'IngestJournal: record {seq} topic: {topic} failed '
+                                         f'{self.attempts[seq]} times, discarded')
+                        self.discarded += 1
+                        del self.attempts[seq]
+                        self.done.add(seq)
+                        continue
+                    entry = JournalEntry(self, seq)
+                    self.inflight[seq] = entry
+                    batch.append((entry, topic, handler, lane, bytes(payload)))
+                    if len(batch) >= self.replay_batch:
+                        break
+                if segment is self.segments[-1] and offset == segment.write_offset and not batch:
+                    return self.caught_up()
+                position = (segment.number, offset) if offset < segment.write_offset else (segment.number + 1,
+                                                                                             HEADER.size)
+            for entry, topic, handler, lane, payload in batch:
+                handler_fn = getattr(self.handler_owner, handler, None)
+                if handler_fn is None:
+                    Log.logger.error(f'IngestJournal: record {entry.seq} topic: {topic} unknown handler {handler}')
+                    with self.cond:
+                        self.discarded += 1
+                else:
+                    with bound_delivery(entry):
+                        self.dispatcher.submit(topic, payload, handler_fn, lane=lane)
+                    with self.cond:
+                        self.replayed += 1
+                entry.release()
+        return False
+
+    def caught_up(self):
+        '''Every journaled record was submitted, called with cond held: new messages go to the dispatcher again'''
+        if self.outage:
+            self.outage = False
+            Log.logger.warning(f'IngestJournal: replay caught up, {self.replayed} records replayed')
+        return True
+
+    def stats(self):
+        with self.cond:
+            return {"outage": self.outage, "backlog": self.next_seq - 1 - self.offset, "inflight": len(self.inflight),
+                    "segments": len(self.segments), "bytes": self.disk_bytes, "journaled": self.journaled,
+                    "replayed": self.replayed, "failed": self.failed, "discarded": self.discarded,
+                    "rejected": self.rejected}
@@ -17,7 +17,11 @@
 '''
 
 # '''Import python module'''
+import time
+import random
+import threading
 from peewee import *
+from playhouse.pool import PooledPostgresqlDatabase
 import sys
 sys.path.append("..")  # parent folder where habd_common lives
 # '''Import wild module'''
@@ -27,23 +31,187 @@ from habd_log import Log
 if Log.logger is None:
     Log('dlm')
 
-'''read configuration file'''
-cfg = HabdDlmConfRead()
-cfg.read_cfg('/home/l2m/habd-v1/config/habd_dlm.conf')
+# Single database object shared by the models and HabdAPI raw SQL, bound by init_database()
+psql_db = DatabaseProxy()
 
-db_name = cfg.database.DB_NAME
-user = cfg.database.USER
-password = cfg.database.PASSWORD
-host = cfg.database.HOST
-port = 5432
-psql_db = None
 
-try:
-    psql_db = PostgresqlDatabase(db_name, user=user, password=password, host=host, port=port)
-    if psql_db is not None:
-        psql_db.connect()
-except Exception as e:
-    Log.logger.critical(f'habd_dlm_model: Exception: {e}', exc_info=True)
+class DatabaseUnavailable(OperationalError):
+    '''The database connection is lost, raised without a round trip while the circuit is open'''
+
+
+class DatabaseBreaker:
+    '''
+    Circuit breaker of the database pool. failure_threshold consecutive dead connections (or one failed
+    connect) open the circuit: idle pooled connections are dropped and every connect or query raises
+    DatabaseUnavailable at once. A reconnect thread probes the database with jittered exponential backoff
+    and closes the circuit when a query succeeds. on_transition(is_open, desc) is called once per change.
+    '''
+
+    def __init__(self):
+        self.database = None
+        self.failure_threshold = 2
+        self.backoff_base_sec = 1.0
+        self.backoff_max_sec = 30.0
+        self.on_transition = None
+        self.lock = threading.Lock()
+        self.is_open = False
+        self.failures = 0
+        self.opened_time = None
+        self.probing = threading.local()
+        self.opened = 0
+        self.rejected = 0
+        self.reconnect_attempts = 0
+
+    def configure(self, database, failure_threshold, backoff_base_sec, backoff_max_sec):
+        self.database = database
+        self.failure_threshold = max(1, failure_threshold)
+        self.backoff_base_sec = backoff_base_sec
+        self.backoff_max_sec = backoff_max_sec
+
+    def check(self):
+        '''Raise DatabaseUnavailable while the circuit is open, except for the reconnect probe'''
+        if self.is_open and not getattr(self.probing, 'active', False):
+            self.rejected += 1
+            raise DatabaseUnavailable('database circuit open')
+
+    def record_success(self):
+        if self.failures:
+            self.failures = 0
+
+    def record_failure(self, e, connect_failed=False):
+        '''A dead connection (or a failed connect, which opens the circuit at once)'''
+        with self.lock:
+            if self.is_open or getattr(self.probing, 'active', False):
+                return
+            self.failures += 1
+            if self.failures < self.failure_threshold and not connect_failed:
+                return
+            self.is_open = True
+            self.opened += 1
+            self.opened_time = time.monotonic()
+        Log.logger.critical(f'habd_model: database connection lost, circuit open: {e}')
+        try:
+            # Pooled connections are dead as well after a server restart
+            self.database.close_idle()
+        except Exception as close_e:
+            Log.logger.error(f'habd_model: close_idle: {close_e}')
+        self.notify(True, f'database connection lost: {e}')
+        th = threading.Thread(target=self.reconnect_loop, name="habd_db_reconnect", args=())
+        th.daemon = True
+        th.start()
+
+    def notify(self, is_open, desc):
+        if self.on_transition is not None:
+            try:
+                self.on_transition(is_open, desc)
+            except Exception as e:
+                Log.logger.error(f'habd_model: circuit transition callback: {e}', exc_info=True)
+
+    def backoff_delay(self, attempt):
+        '''Exponential backoff with equal jitter, half of the delay is random'''
+        delay = min(self.backoff_max_sec, self.backoff_base_sec * (2 ** min(attempt, 16)))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def probe(self):
+        self.probing.active = True
+        try:
+            with self.database.connection_context():
+                self.database.execute_sql('SELECT 1')
+            return True
+        except Exception as e:
+            Log.logger.warning(f'habd_model: database reconnect failed: {e}')
+            return False
+        finally:
+            self.probing.active = False
+
+    def reconnect_loop(self):
+        attempt = 0
+        while True:
+            time.sleep(self.backoff_delay(attempt))
+            attempt += 1
+            self.reconnect_attempts += 1
+            if self.probe():
+                break
+        with self.lock:
+            self.is_open = False
+            self.failures = 0
+            downtime = time.monotonic() - self.opened_time
+        Log.logger.warning(f'habd_model: database reconnected after {downtime:.1f}s, circuit closed')
+        self.notify(False, f'database reconnected after {downtime:.1f}s, {attempt} attempts')
+
+    def stats(self):
+        return {"open": self.is_open, "opened": self.opened, "rejected": self.rejected,
+                "reconnect_attempts": self.reconnect_attempts}
+
+
+db_breaker = DatabaseBreaker()
+
+
+class BreakerPooledPostgresqlDatabase(PooledPostgresqlDatabase):
+    '''Pooled database that reports dead connections to db_breaker and fails fast while it is open'''
+
+    def connect(self, reuse_if_open=False):
+        db_breaker.check()
+        try:
+            return super().connect(reuse_if_open)
+        except (OperationalError, InterfaceError) as e:
+            if self.is_closed():
+                # No connection could be made
+                db_breaker.record_failure(e, connect_failed=True)
+                raise DatabaseUnavailable(str(e)) from e
+            raise
+
+    def execute_sql(self, sql, params=None):
+        db_breaker.check()
+        try:
+            cursor = super().execute_sql(sql, params)
+        except (OperationalError, InterfaceError) as e:
+            conn = self._state.conn
+            if conn is not None and self._is_closed(conn):
+                db_breaker.record_failure(e)
+                raise DatabaseUnavailable(str(e)) from e
+            raise
+        db_breaker.record_success()
+        return cursor
+
+
+def init_database(db_cfg):
+    '''
+    Create the pooled database once and bind it to psql_db. HOST "localhost" connects over the local
+    unix socket in SOCKET_DIR, connections older than STALE_TIMEOUT_SEC are recycled and connections
+    left idle in the pool are closed every IDLE_TIMEOUT_SEC.
+    '''
+    if psql_db.obj is not None:
+        return psql_db
+    host = db_cfg.SOCKET_DIR if db_cfg.HOST == 'localhost' else db_cfg.HOST
+    pooled_db = BreakerPooledPostgresqlDatabase(db_cfg.DB_NAME, user=db_cfg.USER, password=db_cfg.PASSWORD,
+                                         host=host, port=db_cfg.PORT,
+                                         max_connections=db_cfg.MAX_CONNECTIONS,
+                                         stale_timeout=db_cfg.STALE_TIMEOUT_SEC,
+                                         timeout=db_cfg.POOL_TIMEOUT_SEC)
+    psql_db.initialize(pooled_db)
+    db_breaker.configure(pooled_db, db_cfg.BREAKER_FAILURES, db_cfg.RECONNECT_BACKOFF_BASE_SEC,
+                         db_cfg.RECONNECT_BACKOFF_MAX_SEC)
+    if db_cfg.IDLE_TIMEOUT_SEC > 0:
+        start_idle_reaper(pooled_db, db_cfg.IDLE_TIMEOUT_SEC)
+    Log.logger.info(f'habd_model: database pool {db_cfg.DB_NAME}@{host}:{db_cfg.PORT} '
+                    f'max_connections: {db_cfg.MAX_CONNECTIONS}')
+    return psql_db
+
+
+def start_idle_reaper(pooled_db, idle_timeout_sec):
+    '''Close pooled connections that are not checked out, once every idle_timeout_sec'''
+    def reap():
+        while True:
+            time.sleep(idle_timeout_sec)
+            try:
+                pooled_db.close_idle()
+            except Exception as e:
+                Log.logger.error(f'habd_model: close_idle: {e}')
+
+    th = threading.Thread(target=reap, name="habd_db_idle_reaper", args=())
+    th.daemon = True
+    th.start()
 
 
 class WildModel(Model):
@@ -99,7 +267,7 @@ class TrainConsolidatedInfo(WildModel):
 
 class EventInfo(WildModel):
     # ''' Event information table '''
-    ts = FloatField()
+    ts = FloatField(index=True)  # index backs the retention purge
     dpu_id = CharField()
     msg_id = IntegerField(null=True)
     event_id = CharField(null=True)
@@ -111,7 +279,7 @@ class EventInfo(WildModel):
 
 class ErrorInfo(WildModel):
     # ''' Error information table '''
-    ts = FloatField()
+    ts = FloatField(index=True)  # index backs the retention purge
     dpu_id = CharField()
     msg_id = IntegerField(null=True)
     error_id = CharField(null=True)
@@ -124,7 +292,7 @@ class ErrorInfo(WildModel):
 
 class HealthInfo(WildModel):
     # ''' Health information table '''
-    ts = FloatField()
+    ts = FloatField(index=True)  # index backs the retention purge
     dpu_id = CharField()
     comm_link = CharField(null=True)
     interrogator_link = CharField(null=True)
@@ -154,6 +322,11 @@ if __name__ == '__main__':
         my_log = Log('dlm')
     Log.logger.info("habd_model: main program")
 
+    '''read configuration file'''
+    cfg = HabdDlmConfRead()
+    cfg.read_cfg('/home/l2m/habd-v1/config/habd_dlm.conf')
+    init_database(cfg.database)
+
     # First, manually drop and recreate the unique constraint
     try:
         with psql_db.atomic():
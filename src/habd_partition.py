@@ -0,0 +1,197 @@
+'''
+*****************************************************************************
+*File : habd_partition.py
+*Module : habd_dlm
+*Purpose : habd data logging module (DLM) time partitioned storage for the log tables
+*Author : HABD Team
+*Copyright : Copyright 2025, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+# '''Import python packages'''
+import time
+from datetime import datetime, timezone
+
+# '''Import HABD packages '''
+from habd_log import Log
+
+
+class PartitionManager:
+    '''
+    Declaratively range partition event_info, error_info and health_info on ts (epoch seconds, UTC periods).
+    Partitions are created PRECREATE periods ahead and retention drops whole expired partitions.
+    A default partition catches rows outside the created ranges (late backfills, bad clocks).
+    '''
+
+    DAY = "day"
+    MONTH = "month"
+
+    PARTITIONED_TABLES_SQL = '''
+        SELECT c.relname FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid
+        WHERE c.relname = %s AND pg_table_is_visible(c.oid)
+    '''
+    CHILD_PARTITIONS_SQL = '''
+        SELECT c.relname, c.reltuples::bigint FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+    '''
+    DEFAULT_ROWS_SQL = 'SELECT EXISTS (SELECT 1 FROM "{default}" WHERE ts >= %s AND ts < %s)'
+
+    def __init__(self, psql_db, interval, precreate):
+        if interval not in (PartitionManager.DAY, PartitionManager.MONTH):
+            raise ValueError(f'PartitionManager: unknown partition interval: {interval}')
+        self.psql_db = psql_db
+        self.interval = interval
+        self.precreate = precreate
+        self.partitioned_tables = set()
+
+    def is_partitioned(self, model):
+        return model._meta.table_name in self.partitioned_tables
+
+    def create_partitioned_tables(self, models):
+        '''Create the parent tables partitioned by range on ts, existing plain tables are left as they are'''
+        for model in models:
+            table_name = model._meta.table_name
+            try:
+                if self.psql_db.table_exists(table_name):
+                    cursor = self.psql_db.execute_sql(PartitionManager.PARTITIONED_TABLES_SQL, (table_name,))
+                    if cursor.fetchone() is None:
+                        Log.logger.warning(f'PartitionManager: {table_name} exists as a plain table, '
+                                           f'keeping row based retention for it')
+                        continue
+                else:
+                    self.psql_db.execute_sql(self.partitioned_table_ddl(model))
+                    self.psql_db.execute_sql(f'CREATE TABLE IF NOT EXISTS "{table_name}_default" '
+                                             f'PARTITION OF "{table_name}" DEFAULT')
+                    Log.logger.warning(f'PartitionManager: created {table_name} partitioned by {self.interval}')
+                self.partitioned_tables.add(table_name)
+                self.create_partitions(model)
+            except Exception as e:
+                Log.logger.critical(f'PartitionManager: create_partitioned_tables: {table_name}: {e}', exc_info=True)
+
+    @staticmethod
+    def partitioned_table_ddl(model):
+        '''
+        peewee CREATE TABLE statement turned into a partitioned parent, the primary key of a partitioned
+        table has to include the partition key
+        '''
+        sql, params = model._schema._create_table(safe=True).query()
+        pk_column = model._meta.primary_key.column_name
+        sql = sql.replace(' PRIMARY KEY', '', 1)
+        return sql[:-1] + f', PRIMARY KEY ("{pk_column}", "ts")) PARTITION BY RANGE ("ts")'
+
+    def create_partitions(self, model, now=None):
+        '''
+        Create the partition of the current period and PRECREATE periods ahead. A partition that cannot be
+        created is logged and skipped, returns the number of partitions verified
+        '''
+        table_name = model._meta.table_name
+        period_start = self.period_start(time.time() if now is None else now)
+        verified = 0
+        for _ in range(self.precreate + 1):
+            period_end = self.next_period(period_start)
+            try:
+                self.create_partition(table_name, period_start, period_end)
+                verified += 1
+            except Exception as e:
+                Log.logger.critical(f'PartitionManager: {table_name}: unable to create the partition of '
+                                    f'{period_start} - {period_end}: {e}', exc_info=True)
+            period_start = period_end
+        Log.logger.info(f'PartitionManager: {table_name}: {verified} partitions verified')
+        return verified
+
+    def create_partition(self, table_name, period_start, period_end):
+        '''
+        Create one partition. Rows of its range already in the default partition make PostgreSQL refuse
+        the new partition, they are moved into it: detach the default partition, create the partition,
+        move the rows and attach the default partition again, in one transaction
+        '''
+        partition_name = self.partition_name(table_name, period_start)
+        if self.psql_db.table_exists(partition_name):
+            return
+        default_name = f'{table_name}_default'
+        create_sql = (f'CREATE TABLE IF NOT EXISTS "{partition_name}" PARTITION OF "{table_name}" '
+                      f'FOR VALUES FROM ({period_start}) TO ({period_end})')
+        cursor = self.psql_db.execute_sql(PartitionManager.DEFAULT_ROWS_SQL.format(default=default_name),
+                                          (period_start, period_end))
+        if not cursor.fetchone()[0]:
+            self.psql_db.execute_sql(create_sql)
+            return
+        with self.psql_db.atomic():
+            self.psql_db.execute_sql(f'ALTER TABLE "{table_name}" DETACH PARTITION "{default_name}"')
+            self.psql_db.execute_sql(create_sql)
+            cursor = self.psql_db.execute_sql(
+                f'WITH moved AS (DELETE FROM "{default_name}" WHERE ts >= %s AND ts < %s RETURNING *) '
+                f'INSERT INTO "{partition_name}" SELECT * FROM moved', (period_start, period_end))
+            self.psql_db.execute_sql(f'ALTER TABLE "{table_name}" ATTACH PARTITION "{default_name}" DEFAULT')
+        Log.logger.warning(f'PartitionManager: created {partition_name}, {cursor.rowcount} rows moved from '
+                           f'{default_name}')
+
+    def drop_expired_partitions(self, model, retention_days, now=None):
+        '''Drop partitions that end before the retention cutoff, returns the estimated number of rows dropped'''
+        table_name = model._meta.table_name
+        cutoff_ts = (time.time() if now is None else now) - retention_days * 24 * 60 * 60
+        dropped_rows = 0
+        cursor = self.psql_db.execute_sql(PartitionManager.CHILD_PARTITIONS_SQL, (f'"{table_name}"',))
+        for partition_name, row_estimate in cursor.fetchall():
+            period_end = self.partition_period_end(table_name, partition_name)
+            if period_end is None or period_end > cutoff_ts:
+                continue
+            self.psql_db.execute_sql(f'DROP TABLE IF EXISTS "{partition_name}"')
+            dropped_rows += max(row_estimate, 0)
+            Log.logger.warning(f'PartitionManager: dropped expired partition {partition_name}')
+
+        # Rows that landed in the default partition are purged row by row, normally there are none
+        cursor = self.psql_db.execute_sql(f'DELETE FROM "{table_name}_default" WHERE ts < %s', (cutoff_ts,))
+        return dropped_rows + cursor.rowcount
+
+    def maintain(self, model, retention_days):
+        '''
+        Retention pass for a partitioned table: create partitions ahead and drop the expired ones, the drop
+        runs even when partitions could not be created
+        '''
+        try:
+            self.create_partitions(model)
+        except Exception as e:
+            Log.logger.critical(f'PartitionManager: create_partitions: {model._meta.table_name}: {e}', exc_info=True)
+        return self.drop_expired_partitions(model, retention_days)
+
+    def period_start(self, ts):
+        dt = datetime.fromtimestamp(ts, timezone.utc)
+        if self.interval == PartitionManager.DAY:
+            dt = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+        else:
+            dt = dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        return int(dt.timestamp())
+
+    def next_period(self, period_start):
+        if self.interval == PartitionManager.DAY:
+            return period_start + 24 * 60 * 60
+        dt = datetime.fromtimestamp(period_start, timezone.utc)
+        if dt.month == 12:
+            dt = dt.replace(year=dt.year + 1, month=1)
+        else:
+            dt = dt.replace(month=dt.month + 1)
+        return int(dt.timestamp())
+
+    def partition_name(self, table_name, period_start):
+        dt = datetime.fromtimestamp(period_start, timezone.utc)
+        suffix = dt.strftime('%Y%m%d') if self.interval == PartitionManager.DAY else dt.strftime('%Y%m')
+        return f'{table_name}_p{suffix}'
+
+    def partition_period_end(self, table_name, partition_name):
+        '''Upper bound of the period encoded in a partition name, None for the default or foreign partitions'''
+        prefix = f'{table_name}_p'
+        if not partition_name.startswith(prefix):
+            return None
+        suffix = partition_name[len(prefix):]
+        try:
+            # The name format tells the period length, partitions may predate a change of INTERVAL
+            if len(suffix) == 8:
+                dt = datetime.strptime(suffix, '%Y%m%d').replace(tzinfo=timezone.utc)
+                return int(dt.timestamp()) + 24 * 60 * 60
+            if len(suffix) == 6:
+                dt = datetime.strptime(suffix, '%Y%m').replace(tzinfo=timezone.utc)
+                return int(dt.replace(year=dt.year + dt.month // 12, month=dt.month % 12 + 1).timestamp())
+        except ValueError:
+            pass
+        return None
@@ -0,0 +1,108 @@
+'''
+*****************************************************************************
+*File : habd_retention.py
+*Module : habd_dlm
+*Purpose : habd data logging module (DLM) background retention scheduler
+*Author : HABD Team
+*Copyright : Copyright 2025, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+# '''Import python packages'''
+import time
+import threading
+
+# '''Import HABD packages '''
+from habd_log import Log
+from habd_model import EventInfo, ErrorInfo, HealthInfo
+
+
+class RetentionScheduler:
+    '''
+    Periodically purge expired event_info, error_info and health_info records, and train_processed_info
+    records of trains that never got consolidated info, on its own thread.
+    Partitioned tables (see PartitionManager) drop whole expired partitions instead of deleting rows.
+    '''
+
+    def __init__(self, db_api_obj, interval_sec, partition_mgr=None):
+        self.habd_api = db_api_obj
+        self.partition_mgr = partition_mgr
+        self.interval_sec = interval_sec
+        self.stop_event = threading.Event()
+        self.th = None
+        # Tables whose ts index was verified
+        self.indexed = set()
+        self.stats = {"runs": 0, "last_purged": {}, "last_duration_sec": 0.0, "total_purged": 0}
+
+    def start(self):
+        self.stop_event.clear()
+        self.th = threading.Thread(target=self.run, name="habd_retention", args=())
+        self.th.daemon = True
+        self.th.start()
+        Log.logger.info(f'RetentionScheduler: started, interval: {self.interval_sec} sec')
+
+    def stop(self):
+        self.stop_event.set()
+        if self.th is not None:
+            self.th.join()
+            self.th = None
+
+    def run(self):
+        # First purge right after start so an outage backlog is cleared without waiting a full interval
+        while not self.stop_event.is_set():
+            self.create_ts_indexes()
+            self.purge()
+            self.stop_event.wait(self.interval_sec)
+        Log.logger.info(f'RetentionScheduler: exiting the retention thread')
+
+    def create_ts_indexes(self):
+        '''
+        Index ts of the unpartitioned log tables, the chunked purge deletes scan the table without it. peewee
+        creates model indexes together with a new table only, tables created before the index get it here
+        (CREATE INDEX IF NOT EXISTS with peewee's index name). A failed table is tried again on the next pass
+        '''
+        for model in (EventInfo, ErrorInfo, HealthInfo):
+            table_name = model._meta.table_name
+            if table_name in self.indexed or (self.partition_mgr is not None and
+                                              self.partition_mgr.is_partitioned(model)):
+                continue
+            try:
+                start_time = time.monotonic()
+                model._schema.create_indexes(safe=True)
+                self.indexed.add(table_name)
+                Log.logger.info(f'RetentionScheduler: index on {table_name}.ts verified in '
+                                f'{time.monotonic() - start_time:.3f} sec')
+            except Exception as e:
+                Log.logger.error(f'RetentionScheduler: unable to create the index on {table_name}.ts: {e}')
+
+    def purge(self):
+        '''Run one retention pass over all log tables and record rows purged and time spent'''
+        start_time = time.monotonic()
+        purged = {
+            "event_info": self.purge_table(EventInfo, self.habd_api.event_info_days,
+                                           self.habd_api.event_info_mem_mgmt),
+            "error_info": self.purge_table(ErrorInfo, self.habd_api.error_info_days,
+                                           self.habd_api.error_info_mem_mgmt),
+            "health_info": self.purge_table(HealthInfo, self.habd_api.health_info_days,
+                                            self.habd_api.health_info_mem_mgmt),
+            "orphan_axles": self.habd_api.orphan_axle_mem_mgmt()
+        }
+        duration = time.monotonic() - start_time
+
+        self.stats["runs"] += 1
+        self.stats["last_purged"] = purged
+        self.stats["last_duration_sec"] = round(duration, 3)
+        self.stats["total_purged"] += sum(purged.values())
+        Log.logger.warning(f'RetentionScheduler: purged {purged} in {duration:.3f} sec')
+        return purged
+
+    def purge_table(self, model, retention_days, mem_mgmt_fn):
+        '''Drop expired partitions of a partitioned table, otherwise delete expired rows'''
+        if self.partition_mgr is None or not self.partition_mgr.is_partitioned(model):
+            return mem_mgmt_fn()
+        try:
+            return self.partition_mgr.maintain(model, retention_days)
+        except Exception as e:
+            Log.logger.critical(f'RetentionScheduler: partition maintenance of {model._meta.table_name}: {e}',
+                                exc_info=True)
+            return 0
@@ -0,0 +1,137 @@
+'''
+*****************************************************************************
+*File : habd_supervisor.py
+*Module : habd_dlm
+*Purpose : habd data logging module (DLM) multi process supervisor and per train forwarding
+*Author : HABD Team
+*Copyright : Copyright 2025, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+# '''Import python packages'''
+import os
+import sys
+import time
+import zlib
+import bisect
+import signal
+import subprocess
+
+# '''Import HABD packages '''
+from habd_log import Log
+from habd_ingest import IngestDispatcher
+
+
+def worker_name(name, worker_idx):
+    '''Per worker variant of a client id, file or directory name: dlm.log -> dlm-w1.log'''
+    if worker_idx is None or not name:
+        return name
+    root, ext = os.path.splitext(name)
+    return f'{root}-w{worker_idx}{ext}'
+
+
+class HashRing:
+    '''Consistent hash of routing keys onto worker indexes, vnodes points per worker on a crc32 ring'''
+
+    def __init__(self, num_workers, vnodes=64):
+        points = sorted((zlib.crc32(f'habd_dlm-{worker}-{vnode}'.encode('utf-8')), worker)
+                        for worker in range(num_workers) for vnode in range(vnodes))
+        self.hashes = [point[0] for point in points]
+        self.workers = [point[1] for point in points]
+
+    def owner(self, key):
+        idx = bisect.bisect(self.hashes, zlib.crc32(key)) % len(self.hashes)
+        return self.workers[idx]
+
+
+class TrainForwarder:
+    '''
+    Subscriptions of one worker process. The train topics are consumed through the shared subscription
+    $share/<group>/<topic>, so the broker spreads them over the workers. A message whose train_id belongs to
+    another worker (see HashRing) is forwarded to habd_dlm/fwd/<worker>/<topic>, which only that worker
+    subscribes, so all messages of a train are written by the same process. The forward is published with
+    the QoS of the subscription and, with manual ack, the original message is acknowledged only after the
+    broker acknowledged the forward.
+    '''
+
+    FORWARD_PREFIX = "habd_dlm/fwd"
+
+    def __init__(self, mqtt_client, worker_idx, num_workers, share_group):
+        self.mqtt_client = mqtt_client
+        self.worker_idx = worker_idx
+        self.share_group = share_group
+        self.ring = HashRing(num_workers)
+        self.local = 0
+        self.forwarded = 0
+        self.qos = 0
+
+    def subscribe(self, topic, sub_fn, qos=0):
+        self.qos = qos
+        self.mqtt_client.sub(f'$share/{self.share_group}/{topic}', self.route(topic, sub_fn), qos)
+        self.mqtt_client.sub(f'{TrainForwarder.FORWARD_PREFIX}/{self.worker_idx}/{topic}', sub_fn, qos)
+
+    def route(self, topic, sub_fn):
+        def on_shared_message(client, user_data, message):
+            owner = self.ring.owner(IngestDispatcher.routing_key(message.payload))
+            if owner == self.worker_idx:
+                self.local += 1
+                sub_fn(client, user_data, message)
+            else:
+                self.forwarded += 1
+                self.mqtt_client.forward(f'{TrainForwarder.FORWARD_PREFIX}/{owner}/{topic}', message.payload,
+                                         self.qos)
+        return on_shared_message
+
+    def stats(self):
+        return {"worker": self.worker_idx, "local": self.local, "forwarded": self.forwarded}
+
+
+class Supervisor:
+    '''
+    Runs num_workers DLM worker processes (habd_dlm_main.py --worker <idx> <num_workers>) and restarts a
+    worker that exits, restart_delay_sec after its exit. SIGTERM / SIGINT stop the workers.
+    '''
+
+    def __init__(self, script, num_workers, restart_delay_sec):
+        self.script = script
+        self.num_workers = num_workers
+        self.restart_delay_sec = restart_delay_sec
+        self.workers = {}
+        self.restarts = 0
+        self.stopping = False
+
+    def start_worker(self, idx):
+        self.workers[idx] = subprocess.Popen([sys.executable, self.script, "--worker", str(idx),
+                                              str(self.num_workers)])
+        Log.logger.warning(f'Supervisor: started worker {idx} pid: {self.workers[idx].pid}')
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for idx in range(self.num_workers):
+            self.start_worker(idx)
+        exited = {}
+        while not self.stopping:
+            time.sleep(1)
+            for idx, proc in self.workers.items():
+                if idx not in exited and proc.poll() is not None:
+                    Log.logger.critical(f'Supervisor: worker {idx} pid: {proc.pid} exited with {proc.returncode}')
+                    exited[idx] = time.monotonic()
+            for idx, exit_time in list(exited.items()):
+                if time.monotonic() - exit_time >= self.restart_delay_sec and not self.stopping:
+                    del exited[idx]
+                    self.restarts += 1
+                    self.start_worker(idx)
+        Log.logger.warning('Supervisor: stopping the workers')
+        for proc in self.workers.values():
+            if proc.poll() is None:
+                proc.terminate()
+        for idx, proc in self.workers.items():
+            try:
+                proc.wait(timeout=60)
+            except subprocess.TimeoutExpired:
+                Log.logger.critical(f'Supervisor: worker {idx} pid: {proc.pid} did not stop, killed')
+                proc.kill()
@@ -0,0 +1,141 @@
+'''
+*****************************************************************************
+*File : habd_wire.py
+*Module : habd_dlm
+*Purpose : habd data logging module (DLM) compact binary train_processed_info encoding
+*Author : HABD Team
+*Copyright : Copyright 2025, Lab to Market Innovations Private Limited
+*****************************************************************************
+
+Layout, little-endian, version 1:
+    header      magic b'HBTP', u8 version, u8 flags, u16 rake count, u32 axle count,
+                u16 train_id length, u16 dpu_id length, f64 ts                          (24 bytes)
+    ids         train_id, dpu_id (UTF-8), zero padded to a multiple of 4 bytes
+    body        i32 axle_ids[n], f32 axle_speeds[n], f32 temp_lefts[n], f32 temp_rights[n],
+                u16 rake index[n] (0xFFFF for none), rake table (u8 length + UTF-8) * rake count
+The body is zlib compressed when flags bit 0 is set. Missing readings are NaN. train_id is kept
+outside the body so it can be read without decompressing, e.g. for routing.
+'''
+
+# '''Import python packages'''
+import struct
+import zlib
+import numpy as np
+
+MAGIC = b'HBTP'
+VERSION = 1
+FLAG_ZLIB = 0x01
+NO_RAKE = 0xFFFF
+
+HEADER = struct.Struct('<4sBBHIHHd')
+AXLE_ID_DTYPE = np.dtype('<i4')
+VALUE_DTYPE = np.dtype('<f4')
+RAKE_INDEX_DTYPE = np.dtype('<u2')
+
+
+class WireFormatError(ValueError):
+    '''Binary payload that cannot be decoded'''
+
+
+def is_binary(payload):
+    return payload[:4] == MAGIC
+
+
+def padded(length):
+    return (length + 3) & ~3
+
+
+def read_train_id(payload):
+    '''train_id of a binary payload without decoding the body, None when the header is invalid'''
+    if len(payload) < HEADER.size or not is_binary(payload):
+        return None
+    train_id_len = HEADER.unpack_from(payload)[5]
+    return bytes(payload[HEADER.size:HEADER.size + train_id_len])
+
+
+def encode_train_processed(train_id, dpu_id, ts, axle_ids, axle_speeds, temp_lefts, temp_rights, rake_ids,
+                           compress=False):
+    '''Binary train_processed_info payload, None values are sent as NaN'''
+    n = len(axle_ids)
+    rake_table = []
+    rake_position = {}
+    rake_index = np.full(n, NO_RAKE, dtype=RAKE_INDEX_DTYPE)
+    for idx, rake_id in enumerate(rake_ids[:n]):
+        if rake_id is None:
+            continue
+        if rake_id not in rake_position:
+            rake_position[rake_id] = len(rake_table)
+            rake_table.append(rake_id.encode('utf-8'))
+        rake_index[idx] = rake_position[rake_id]
+    if len(rake_table) >= NO_RAKE:
+        raise WireFormatError(f'too many distinct rake_ids: {len(rake_table)}')
+
+    def values(data):
+        arr = np.full(n, np.nan, dtype=VALUE_DTYPE)
+        data = np.asarray(data[:n], dtype=np.float64)
+        arr[:len(data)] = data
+        return arr
+
+    body = b''.join([np.asarray(axle_ids, dtype=AXLE_ID_DTYPE).tobytes(), values(axle_speeds).tobytes(),
+                     values(temp_lefts).tobytes(), values(temp_rights).tobytes(), rake_index.tobytes()] +
+                    [bytes([len(rake)]) + rake for rake in rake_table])
+    flags = 0
+    if compress:
+        body = zlib.compress(body)
+        flags |= FLAG_ZLIB
+
+    train_id_bytes = train_id.encode('utf-8')
+    dpu_id_bytes = dpu_id.encode('utf-8')
+    ids = train_id_bytes + dpu_id_bytes
+    header = HEADER.pack(MAGIC, VERSION, flags, len(rake_table), n, len(train_id_bytes), len(dpu_id_bytes), ts)
+    return header + ids + bytes(padded(len(ids)) - len(ids)) + body
+
+
+def decode_train_processed(payload):
+    '''
+    (ts, train_id, dpu_id, axle_ids, axle_speeds, temp_lefts, temp_rights, rake_ids) of a binary payload.
+    The arrays are views on the payload (or on the decompressed body), nothing is copied
+    '''
+    view = memoryview(payload)
+    if len(view) < HEADER.size:
+        raise WireFormatError('payload shorter than the header')
+    magic, version, flags, n_rakes, n, train_id_len, dpu_id_len, ts = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise WireFormatError('bad magic')
+    if version != VERSION:
+        raise WireFormatError(f'unsupported version: {version}')
+
+    offset = HEADER.size
+    train_id = bytes(view[offset:offset + train_id_len]).decode('utf-8')
+    dpu_id = bytes(view[offset + train_id_len:offset + train_id_len + dpu_id_len]).decode('utf-8')
+    body = view[offset + padded(train_id_len + dpu_id_len):]
+    if flags & FLAG_ZLIB:
+        try:
+            body = memoryview(zlib.decompress(body))
+        except zlib.error as e:
+            raise WireFormatError(f'bad compressed body: {e}')
+
+    arrays_size = n * (AXLE_ID_DTYPE.itemsize + 3 * VALUE_DTYPE.itemsize + RAKE_INDEX_DTYPE.itemsize)
+    if len(body) < arrays_size:
+        raise WireFormatError(f'body too short for {n} axles')
+    axle_ids = np.frombuffer(body, dtype=AXLE_ID_DTYPE, count=n, offset=0)
+    offset = n * AXLE_ID_DTYPE.itemsize
+    axle_speeds, temp_lefts, temp_rights = [
+        np.frombuffer(body, dtype=VALUE_DTYPE, count=n, offset=offset + idx * n * VALUE_DTYPE.itemsize)
+        for idx in range(3)]
+    offset += 3 * n * VALUE_DTYPE.itemsize
+    rake_index = np.frombuffer(body, dtype=RAKE_INDEX_DTYPE, count=n, offset=offset)
+    offset += n * RAKE_INDEX_DTYPE.itemsize
+
+    rake_table = []
+    for _ in range(n_rakes):
+        if offset >= len(body):
+            raise WireFormatError('truncated rake table')
+        length = body[offset]
+        rake_table.append(bytes(body[offset + 1:offset + 1 + length]).decode('utf-8'))
+        offset += 1 + length
+    if n and (rake_index != NO_RAKE).any() and int(rake_index[rake_index != NO_RAKE].max()) >= n_rakes:
+        raise WireFormatError('rake index outside the rake table')
+    # Object array lookup, NO_RAKE maps to the trailing None
+    rake_ids = np.array(rake_table + [None], dtype=object)[np.minimum(rake_index, n_rakes)]
+    return ts, train_id, dpu_id, axle_ids, axle_speeds, temp_lefts, temp_rights, rake_ids
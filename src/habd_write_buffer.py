@@ -0,0 +1,111 @@
+'''
+*****************************************************************************
+*File : habd_write_buffer.py
+*Module : habd_dlm
+*Purpose : habd data logging module (DLM) write-behind buffer for the log tables
+*Author : HABD Team
+*Copyright : Copyright 2025, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+# '''Import python packages'''
+import time
+import threading
+
+# '''Import HABD packages '''
+from habd_log import Log
+from habd_model import psql_db
+from habd_common.habd_ack import current_delivery
+
+
+class WriteBehindBuffer:
+    '''
+    Group commit for one table: rows are collected in memory and written by a flush thread with a single
+    insert_many in one transaction as soon as max_rows rows are pending or the oldest row is max_delay_ms old.
+    With manual ack the Delivery of a row is held until its batch committed.
+    '''
+
+    def __init__(self, model, max_rows, max_delay_ms, on_error=None):
+        self.model = model
+        self.max_rows = max(1, max_rows)
+        self.max_delay_sec = max_delay_ms / 1000.0
+        self.on_error = on_error
+        self.rows = []
+        self.deliveries = []
+        self.first_row_time = None
+        self.lock = threading.Lock()
+        self.row_available = threading.Condition(self.lock)
+        # Serialises flushes so batches reach the table in the order they were collected
+        self.flush_lock = threading.Lock()
+        self.thread_quit = False
+        self.flushed_rows = 0
+        self.flush_count = 0
+        self.th = threading.Thread(target=self.flush_loop, name=f'habd_wb_{model._meta.table_name}', args=())
+        self.th.daemon = True
+        self.th.start()
+
+    def add(self, row):
+        '''Queue one row (dict of field name to value), the flush thread writes it'''
+        delivery = current_delivery()
+        if delivery is not None:
+            delivery.hold()
+        with self.lock:
+            self.rows.append(row)
+            if delivery is not None:
+                self.deliveries.append(delivery)
+            if self.first_row_time is None:
+                self.first_row_time = time.monotonic()
+                self.row_available.notify()
+            elif len(self.rows) >= self.max_rows:
+                self.row_available.notify()
+
+    def flush_loop(self):
+        while True:
+            with self.lock:
+                while not self.thread_quit and self.first_row_time is None:
+                    self.row_available.wait()
+                if self.thread_quit:
+                    break
+                remaining = self.first_row_time + self.max_delay_sec - time.monotonic()
+                if remaining > 0 and len(self.rows) < self.max_rows:
+                    self.row_available.wait(remaining)
+                    continue
+            self.flush()
+
+    def flush(self):
+        '''Write all pending rows in one transaction, returns the number of rows written'''
+        with self.flush_lock:
+            with self.lock:
+                rows = self.rows
+                deliveries = self.deliveries
+                self.rows = []
+                self.deliveries = []
+                self.first_row_time = None
+            if not rows:
+                return 0
+            try:
+                with psql_db.connection_context():
+                    with psql_db.atomic():
+                        self.model.insert_many(rows).execute()
+                self.flushed_rows += len(rows)
+                self.flush_count += 1
+                Log.logger.info(f'WriteBehindBuffer: {self.model._meta.table_name}: {len(rows)} rows written')
+                for delivery in deliveries:
+                    delivery.release()
+                return len(rows)
+            except Exception as e:
+                Log.logger.critical(f'WriteBehindBuffer: {self.model._meta.table_name}: {len(rows)} rows lost: {e}',
+                                    exc_info=True)
+                for delivery in deliveries:
+                    delivery.release(failed=True)
+                if self.on_error is not None:
+                    self.on_error(e)
+                return 0
+
+    def stop(self):
+        '''Stop the flush thread and write what is still pending'''
+        with self.lock:
+            self.thread_quit = True
+            self.row_available.notify()
+        self.th.join()
+        self.flush()
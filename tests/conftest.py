@@ -0,0 +1,23 @@
+'''
+*****************************************************************************
+*File : conftest.py
+*Module : tests
+*Purpose : habd data logging module (DLM) test setup
+*Author : HABD Team
+*Copyright : Copyright 2025, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# src modules import each other and some habd_common modules flat
+for path in (os.path.join(ROOT, 'habd_common'), os.path.join(ROOT, 'src'), ROOT):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from habd_common.habd_log import Log
+
+if Log.logger is None:
+    Log('dlm')
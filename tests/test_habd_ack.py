@@ -0,0 +1,108 @@
+'''
+*****************************************************************************
+*File : test_habd_ack.py
+*Module : tests
+*Purpose : In order acknowledgement and dead letters of the AckTracker
+*Author : HABD Team
+*Copyright : Copyright 2025, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+import threading
+
+import paho.mqtt.client as mqtt
+
+from habd_common.habd_ack import AckTracker
+
+
+def new_message(mid, payload=b'{"train_id": "T1"}', topic='habd/train_data'):
+    message = mqtt.MQTTMessage(mid=mid, topic=topic.encode())
+    message.payload = payload
+    message.qos = 1
+    return message
+
+
+class Recorder:
+    def __init__(self, max_attempts=3):
+        self.acked = []
+        self.redeliveries = 0
+        self.dead = []
+        self.tracker = AckTracker(lambda mid, qos: self.acked.append(mid), 10, 0, self.on_failed, max_attempts,
+                                  self.dead.append)
+
+    def on_failed(self):
+        self.redeliveries += 1
+
+    def deliver(self, message, failed=False):
+        self.tracker.received(message.mid, message.qos, message).release(failed)
+
+
+def test_acks_in_receive_order():
+    recorder = Recorder()
+    first = recorder.tracker.received(1, 1, new_message(1))
+    recorder.deliver(new_message(2, b'2'))
+    assert recorder.acked == []
+    first.release()
+    assert recorder.acked == [1, 2]
+
+
+def test_failed_message_is_dead_lettered_after_max_attempts():
+    recorder = Recorder(max_attempts=3)
+    message = new_message(5)
+    for attempt in range(2):
+        recorder.deliver(message, failed=True)
+        recorder.tracker.reset()
+    assert recorder.acked == []
+    assert recorder.redeliveries == 2
+    recorder.deliver(message, failed=True)
+    assert recorder.acked == [5]
+    assert recorder.dead == [message]
+    assert recorder.tracker.stats()["dead_lettered"] == 1
+
+
+def test_success_clears_attempts():
+    recorder = Recorder(max_attempts=2)
+    message = new_message(5)
+    recorder.deliver(message, failed=True)
+    recorder.tracker.reset()
+    recorder.deliver(message)
+    recorder.deliver(message, failed=True)
+    assert recorder.dead == []
+    assert recorder.acked == [5]
+
+
+def test_no_limit_without_max_attempts():
+    recorder = Recorder(max_attempts=0)
+    message = new_message(5)
+    for attempt in range(10):
+        recorder.deliver(message, failed=True)
+        recorder.tracker.reset()
+    assert recorder.acked == []
+    assert recorder.redeliveries == 10
+
+
+def test_holds_outside_window_do_not_pause_the_receive():
+    recorder = Recorder()
+    recorder.tracker.window = 1
+    first = recorder.tracker.received(1, 1, new_message(1))
+    first.hold(outside_window=True)
+    first.release()
+    received = []
+    receiver = threading.Thread(target=lambda: received.append(recorder.tracker.received(2, 1, new_message(2))))
+    receiver.start()
+    receiver.join(2)
+    recorder.tracker.close()
+    assert len(received) == 1
+    assert recorder.tracker.stats()["window_waits"] == 0
+
+
+def test_outside_window_hold_is_forgotten_on_reset():
+    recorder = Recorder()
+    first = recorder.tracker.received(1, 1, new_message(1))
+    first.hold(outside_window=True)
+    assert recorder.tracker.stats()["outside_window"] == 1
+    recorder.tracker.reset()
+    first.release(outside_window=True)
+    first.release()
+    assert recorder.tracker.stats()["outside_window"] == 0
+    assert recorder.acked == []
@@ -0,0 +1,92 @@
+'''
+*****************************************************************************
+*File : test_habd_api_copy.py
+*Module : tests
+*Purpose : COPY ingest mode of train_processed_info, without a database
+*Author : HABD Team
+*Copyright : Copyright 2025, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+import pytest
+
+# habd_api imports the deployment mqtt_client module
+pytest.importorskip("mqtt_client")
+
+from habd_api import HabdAPI
+from habd_axles import AxleLimits, processed_axle_arrays
+from habd_decode import TrainProcessedMsg
+
+
+class FakeCursor:
+
+    def __init__(self, results):
+        self.results = results
+        self.statements = []
+        self.copied = None
+
+    def execute(self, sql, params=None):
+        self.statements.append(sql)
+
+    def copy_expert(self, sql, file):
+        self.statements.append(sql)
+        self.copied = file.read()
+
+    def fetchall(self):
+        return self.results
+
+
+class FakeDb:
+
+    def __init__(self, results):
+        self.copy_cursor = FakeCursor(results)
+        self.executed = []
+
+    def cursor(self):
+        return self.copy_cursor
+
+    def execute_sql(self, sql, params=None):
+        self.executed.append((sql, params))
+        return FakeCursor(self.copy_cursor.results)
+
+
+def api(mode, results, copy_min_axles=3):
+    # Only the ingest attributes, the constructor needs the MQTT client and configuration
+    habd_api = HabdAPI.__new__(HabdAPI)
+    habd_api.psql_db = FakeDb(results)
+    habd_api.processed_info_mode = mode
+    habd_api.copy_min_axles = copy_min_axles
+    return habd_api
+
+
+def axles(count):
+    msg = TrainProcessedMsg(1.5, "T1", "DPU_01", list(range(1, count + 1)), [60.0] * count,
+                            ["C\t1"] + [None] * (count - 1), [40.0] * count, [None] * count)
+    return processed_axle_arrays(msg, AxleLimits(-40.0, 200.0, 200.0))
+
+
+def test_copy_text_value():
+    assert HabdAPI.copy_text_value(None) == '\\N'
+    assert HabdAPI.copy_text_value(41.5) == '41.5'
+    assert HabdAPI.copy_text_value('a\\b\tc\nd\re') == 'a\\\\b\\tc\\nd\\re'
+
+
+def test_copy_mode_streams_rows_and_counts_the_merge():
+    habd_api = api("copy", [(True,), (False,)])
+    assert habd_api.write_train_processed_arrays(axles(2)) == (1, 1)
+    cursor = habd_api.psql_db.copy_cursor
+    assert len(cursor.statements) == 3
+    assert cursor.statements[1].startswith('COPY train_processed_info_stage')
+    assert cursor.copied.splitlines() == [
+        '1.5\tT1\tDPU_01\t1\t60.0\tC\\t1\t40.0\t\\N\t1\t1\t\\N',
+        '1.5\tT1\tDPU_01\t2\t60.0\t\\N\t40.0\t\\N\t1\t1\t\\N',
+    ]
+    assert habd_api.psql_db.executed == []
+
+
+@pytest.mark.parametrize("mode, count, copied", [("values", 5, False), ("auto", 2, False), ("auto", 3, True)])
+def test_mode_selection(mode, count, copied):
+    habd_api = api(mode, [(True,)] * count)
+    assert habd_api.write_train_processed_arrays(axles(count)) == (count, 0)
+    assert (habd_api.psql_db.copy_cursor.copied is not None) == copied
+    assert len(habd_api.psql_db.executed) == (0 if copied else 1)
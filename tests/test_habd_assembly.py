@@ -0,0 +1,129 @@
+'''
+*****************************************************************************
+*File : test_habd_assembly.py
+*Module : tests
+*Purpose : Per train message assembly and its manual ack deliveries
+*Author : HABD Team
+*Copyright : Copyright 2025, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+import contextlib
+import threading
+import types
+
+import habd_assembly
+from habd_assembly import TrainAssembler
+from habd_common.habd_ack import bound_delivery, current_delivery
+
+PARTS = (TrainAssembler.PROCESSED, TrainAssembler.HABD_INFO, TrainAssembler.CONSOLIDATED)
+
+
+class FakeApi:
+
+    def __init__(self, result=True):
+        self.result = result
+        self.commits = []
+
+    def commit_train_assembly(self, train_id, parts):
+        self.commits.append((train_id, sorted(parts), current_delivery()))
+        return self.result
+
+
+class FakeIngest:
+    '''Runs the queued handler at once'''
+
+    def __init__(self):
+        self.submitted = threading.Event()
+
+    def submit(self, topic, payload, handler_fn, key=None):
+        handler_fn(payload)
+        self.submitted.set()
+        return True
+
+
+class FakeDelivery:
+
+    def __init__(self):
+        self.holds = []
+        self.released = []
+
+    def hold(self, outside_window=False):
+        self.holds.append(outside_window)
+
+    def release(self, failed=False, outside_window=False):
+        self.released.append((failed, outside_window))
+
+
+def msg(train_id="T1"):
+    return types.SimpleNamespace(train_id=train_id)
+
+
+def add(assembler, part, train_id="T1"):
+    delivery = FakeDelivery()
+    with bound_delivery(delivery):
+        assert assembler.add(part, msg(train_id))
+    return delivery
+
+
+def test_complete_train_is_committed_once():
+    api = FakeApi()
+    assembler = TrainAssembler(api, FakeIngest(), PARTS, deadline_sec=30)
+    deliveries = [add(assembler, part) for part in PARTS[:2]]
+    assert api.commits == []
+    # Held outside of the ack window while the train is open
+    assert [delivery.holds for delivery in deliveries] == [[True], [True]]
+    assert [delivery.released for delivery in deliveries] == [[], []]
+
+    deliveries.append(add(assembler, TrainAssembler.CONSOLIDATED))
+    assert api.commits == [("T1", sorted(PARTS), deliveries[2])]
+    assert [delivery.released for delivery in deliveries] == [[(False, True)]] * 3
+    assert assembler.in_flight == {}
+    assert assembler.stats["complete"] == 1
+
+    # A part after the commit is written by the caller
+    assert not assembler.add(TrainAssembler.HABD_INFO, msg())
+    assert assembler.stats["late_parts"] == 1
+
+
+def test_failed_commit_releases_failed():
+    assembler = TrainAssembler(FakeApi(result=False), FakeIngest(), PARTS[:1], deadline_sec=30)
+    delivery = add(assembler, TrainAssembler.PROCESSED)
+    assert delivery.released == [(True, True)]
+
+
+def test_deadline_commits_the_parts_received():
+    api = FakeApi()
+    assembler = TrainAssembler(api, FakeIngest(), PARTS, deadline_sec=30)
+    delivery = add(assembler, TrainAssembler.PROCESSED)
+    assembler.commit_expired("T1")
+    # Outside of a message the held delivery stands in for the train
+    assert api.commits == [("T1", [TrainAssembler.PROCESSED], delivery)]
+    assert delivery.released == [(False, True)]
+    assembler.commit_expired("T1")
+    assert len(api.commits) == 1
+    assert assembler.stats["deadline"] == 1
+
+
+def test_sweeper_queues_expired_trains():
+    api = FakeApi()
+    ingest = FakeIngest()
+    assembler = TrainAssembler(api, ingest, PARTS, deadline_sec=0)
+    add(assembler, TrainAssembler.HABD_INFO, "T2")
+    assembler.start()
+    try:
+        assert ingest.submitted.wait(5)
+    finally:
+        assembler.stop()
+    assert [commit[:2] for commit in api.commits] == [("T2", [TrainAssembler.HABD_INFO])]
+
+
+def test_stop_commits_trains_in_flight(monkeypatch):
+    monkeypatch.setattr(habd_assembly, "psql_db", types.SimpleNamespace(connection_context=contextlib.nullcontext))
+    api = FakeApi()
+    assembler = TrainAssembler(api, FakeIngest(), PARTS, deadline_sec=30)
+    add(assembler, TrainAssembler.PROCESSED, "T1")
+    add(assembler, TrainAssembler.PROCESSED, "T2")
+    assembler.stop()
+    assert sorted(commit[0] for commit in api.commits) == ["T1", "T2"]
+    assert assembler.in_flight == {}
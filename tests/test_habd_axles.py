@@ -0,0 +1,80 @@
+'''
+*****************************************************************************
+*File : test_habd_axles.py
+*Module : tests
+*Purpose : Sentinel and range masking and duplicate axle_id resolution of the per axle arrays
+*Author : HABD Team
+*Copyright : Copyright 2025, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+import numpy as np
+
+from habd_axles import AxleLimits, processed_axle_arrays, habd_temp_arrays
+from habd_decode import TrainProcessedMsg, HabdInfoMsg
+
+LIMITS = AxleLimits(temp_min=-40.0, temp_max=200.0, speed_max=200.0)
+
+
+def processed(axle_ids, axle_speeds, rake_ids, temp_lefts, temp_rights):
+    return TrainProcessedMsg(1742040000.0, "T1", "DPU_01", axle_ids, axle_speeds, rake_ids, temp_lefts, temp_rights)
+
+
+def test_sentinel_temperatures_become_null():
+    arrays = processed_axle_arrays(processed([1, 2], [60.0, 60.0], ["A", "B"], [-1, 45.0], [44.0, -1]), LIMITS)
+    assert arrays.out_of_range == 0
+    left, right, difference = arrays.columns()[3:]
+    assert left == [None, 45.0]
+    assert right == [44.0, None]
+    assert difference == [None, None]
+
+
+def test_out_of_range_values_are_masked_and_counted():
+    msg = processed([1, 2, 3], [60.0, 250.0, -5.0], ["A", "B", "C"], [40.0, 500.0, 41.0], [39.0, 38.0, -90.0])
+    arrays = processed_axle_arrays(msg, LIMITS)
+    assert arrays.out_of_range == 4
+    axle_ids, axle_speeds, _, left, right, difference = arrays.columns()
+    assert axle_ids == [1, 2, 3]
+    assert axle_speeds == [60.0, None, None]
+    assert left == [40.0, None, 41.0]
+    assert right == [39.0, 38.0, None]
+    assert difference == [1.0, None, None]
+
+
+def test_duplicate_axle_ids_keep_the_last_reading():
+    msg = processed([1, 2, 1, 3], [60.0, 61.0, 62.0, 63.0], ["A", "B", "A2", "C"],
+                    [40.0, 41.0, 50.0, 43.0], [40.0, 41.0, 45.0, 43.0])
+    arrays = processed_axle_arrays(msg, LIMITS)
+    assert arrays.axle_count() == 3
+    axle_ids, axle_speeds, rake_ids, left, right, difference = arrays.columns()
+    assert axle_ids == [2, 1, 3]
+    assert axle_speeds == [61.0, 62.0, 63.0]
+    assert rake_ids == ["B", "A2", "C"]
+    assert left == [41.0, 50.0, 43.0]
+    assert difference == [0.0, 5.0, 0.0]
+    assert [row[3] for row in arrays.rows()] == [2, 1, 3]
+
+
+def test_short_arrays_are_padded_with_null():
+    arrays = processed_axle_arrays(processed([1, 2, 3], [60.0], ["A"], [40.0, 41.0], []), LIMITS)
+    axle_ids, axle_speeds, rake_ids, left, right, _ = arrays.columns()
+    assert axle_speeds == [60.0, None, None]
+    assert rake_ids == ["A", None, None]
+    assert left == [40.0, 41.0, None]
+    assert right == [None, None, None]
+
+
+def test_with_temperatures_updates_only_matching_axles():
+    arrays = processed_axle_arrays(processed([1, 2], [60.0, 60.0], ["A", "B"], [None, None], [None, None]), LIMITS)
+    updated = arrays.with_temperatures({2: (50.0, 48.0, 2.0), 9: (1.0, 1.0, 0.0)})
+    assert updated.columns()[3:] == ([None, 50.0], [None, 48.0], [None, 2.0])
+    assert np.isnan(arrays.left_temps).all()
+
+
+def test_habd_temp_arrays():
+    msg = HabdInfoMsg("T1", [5, 6, 5], [40.0, 300.0, 42.0], [41.0, 39.0, 40.0])
+    axle_ids, left, right, difference, out_of_range = habd_temp_arrays(msg, LIMITS)
+    assert out_of_range == 1
+    assert axle_ids.tolist() == [6, 5]
+    np.testing.assert_array_equal(left, [np.nan, 42.0])
+    np.testing.assert_array_equal(difference, [np.nan, 2.0])
@@ -0,0 +1,76 @@
+'''
+*****************************************************************************
+*File : test_habd_cache.py
+*Module : tests
+*Purpose : Per train axle aggregates and their LRU / TTL cache
+*Author : HABD Team
+*Copyright : Copyright 2025, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+import types
+
+import habd_cache
+from habd_cache import TrainAggregate, TrainAggregateCache
+
+
+def row(axle_id, speed, left, right, difference):
+    return (1.0, "T1", "DPU_01", axle_id, speed, "C1", left, right, 1, 1, difference)
+
+
+def test_merge_processed_rows_keeps_values_of_null_columns():
+    aggregate = TrainAggregate()
+    aggregate.merge_processed_rows([row(1, 60.0, 40.0, 42.0, 2.0), row(2, 62.0, None, 45.0, None)])
+    assert aggregate.max_temps() == (40.0, 45.0, 2.0)
+    assert (aggregate.axle_count, aggregate.speed_sum) == (2, 122.0)
+
+    # Retransmitted axle: NULL columns keep the stored value, like the upsert COALESCE
+    aggregate.merge_processed_rows([row(1, None, 48.0, None, None)])
+    assert aggregate.axles[1] == [60.0, 48.0, 42.0, 2.0]
+    assert aggregate.max_temps() == (48.0, 45.0, 2.0)
+    assert aggregate.axle_count == 2
+
+
+def test_merge_temperatures_overwrites_and_lowers_the_maximum():
+    aggregate = TrainAggregate()
+    aggregate.merge_processed_rows([row(1, 60.0, 90.0, 42.0, 48.0), row(2, 62.0, 41.0, 45.0, 4.0)])
+    # habd_info replaces the temperatures of axle 1 and ignores the unknown axle 3
+    aggregate.merge_temperatures([1, 3], [40.0, 99.0], [None, 99.0], [None, 0.0])
+    assert aggregate.axles[1] == [60.0, 40.0, None, None]
+    assert 3 not in aggregate.axles
+    assert aggregate.max_temps() == (41.0, 45.0, 4.0)
+
+
+def test_cache_returns_copies():
+    cache = TrainAggregateCache(max_trains=10, ttl_sec=60)
+    aggregate = TrainAggregate()
+    aggregate.merge_processed_rows([row(1, 60.0, 40.0, 42.0, 2.0)])
+    cache.put("T1", aggregate)
+    cached = cache.get("T1")
+    cached.merge_processed_rows([row(2, 60.0, 80.0, 42.0, 38.0)])
+    assert cache.get("T1").axle_count == 1
+    assert cache.get("T2") is None
+    assert (cache.hits, cache.misses) == (2, 1)
+    cache.discard("T1")
+    assert cache.get("T1") is None
+
+
+def test_cache_evicts_least_recently_used():
+    cache = TrainAggregateCache(max_trains=2, ttl_sec=60)
+    cache.put("T1", TrainAggregate())
+    cache.put("T2", TrainAggregate())
+    cache.get("T1")
+    cache.put("T3", TrainAggregate())
+    assert list(cache.entries) == ["T1", "T3"]
+
+
+def test_cache_entries_expire(monkeypatch):
+    clock = types.SimpleNamespace(now=0.0)
+    monkeypatch.setattr(habd_cache, "time", types.SimpleNamespace(monotonic=lambda: clock.now))
+    cache = TrainAggregateCache(max_trains=10, ttl_sec=60)
+    cache.put("T1", TrainAggregate())
+    clock.now = 60.0
+    assert cache.get("T1") is not None
+    clock.now = 60.5
+    assert cache.get("T1") is None
+    assert cache.entries == {}
@@ -0,0 +1,73 @@
+'''
+*****************************************************************************
+*File : test_habd_decode.py
+*Module : tests
+*Purpose : Typed decoding and rejection counting of the MQTT payloads
+*Author : HABD Team
+*Copyright : Copyright 2025, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+import json
+
+import pytest
+
+from habd_decode import MessageDecoder, MessageRejected, TrainProcessedMsg, HabdInfoMsg, EventMsg
+
+
+def processed(**fields):
+    msg = {"ts": 1742040000.0, "train_id": "T20250315120000", "dpu_id": "DPU_01", "axle_ids": [1, 2, 3],
+           "axle_speeds": [60.5, 61, None], "rake_ids": ["L1-1", "L1-2", "L1-3"],
+           "temp_lefts": [40.0, 41.5, -1], "temp_rights": [39.0, None, 42]}
+    msg.update(fields)
+    return json.dumps(msg).encode()
+
+
+def test_decode_train_processed():
+    decoder = MessageDecoder()
+    msg = decoder.decode(TrainProcessedMsg, processed())
+    assert msg.train_id == "T20250315120000"
+    assert msg.axle_ids == [1, 2, 3]
+    assert decoder.stats()["decoded"]["TrainProcessedMsg"] == 1
+
+
+def test_optional_arrays_may_be_missing():
+    decoder = MessageDecoder()
+    payload = json.dumps({"ts": 1.0, "train_id": "T1", "dpu_id": "DPU_01", "axle_ids": [1, 2]}).encode()
+    assert decoder.decode(TrainProcessedMsg, payload).temp_lefts == ()
+
+
+@pytest.mark.parametrize("fields", [
+    {"temp_lefts": ["x", None, {}]},
+    {"axle_speeds": [1, True, 2]},
+    {"axle_ids": [1, 2.5, 3]},
+    {"axle_ids": [1, 2, 2 ** 40]},
+    {"rake_ids": ["L1-1", 7, "L1-3"]},
+    {"temp_rights": [39.0, 40.0]},
+    {"axle_ids": "1,2,3"},
+    {"train_id": None},
+])
+def test_invalid_train_processed_is_rejected_and_counted(fields):
+    decoder = MessageDecoder()
+    with pytest.raises(MessageRejected):
+        decoder.decode(TrainProcessedMsg, processed(**fields))
+    assert decoder.stats()["rejected"]["TrainProcessedMsg"] == 1
+    assert decoder.stats()["decoded"]["TrainProcessedMsg"] == 0
+
+
+def test_habd_info_elements_are_checked():
+    decoder = MessageDecoder()
+    payload = json.dumps({"train_id": "T1", "axle_ids": [1, 2], "temp_lefts": [40, "hot"],
+                          "temp_rights": [40, 41]}).encode()
+    with pytest.raises(MessageRejected):
+        decoder.decode(HabdInfoMsg, payload)
+    assert decoder.stats()["rejected"]["HabdInfoMsg"] == 1
+
+
+def test_invalid_json_is_rejected_and_counted():
+    decoder = MessageDecoder()
+    with pytest.raises(MessageRejected):
+        decoder.decode(EventMsg, b'{"ts": ')
+    with pytest.raises(MessageRejected):
+        decoder.decode(EventMsg, b'[1, 2]')
+    assert decoder.stats()["rejected"]["EventMsg"] == 2
@@ -0,0 +1,109 @@
+'''
+*****************************************************************************
+*File : test_habd_event_error_pub.py
+*Module : tests
+*Purpose : Token bucket and storm coalescing of the Event/Error publisher
+*Author : HABD Team
+*Copyright : Copyright 2025, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+import json
+import time
+import types
+
+import pytest
+
+from habd_common import habd_event_error_pub
+from habd_common.habd_event_error_pub import EventErrorPub
+
+
+class FakeClock:
+    '''monotonic clock advanced by sleep, stands in for the time module'''
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, sec):
+        self.now += sec
+
+
+class FakeMqtt:
+
+    def __init__(self):
+        self.published = []
+
+    def pub(self, topic, msg):
+        self.published.append((topic, json.loads(msg)))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(habd_event_error_pub, "time",
+                        types.SimpleNamespace(monotonic=clock.monotonic, sleep=clock.sleep, time=time.time))
+    return clock
+
+
+def publisher(**kwargs):
+    mqtt = FakeMqtt()
+    pub = EventErrorPub(mqtt, "DPU_01", **kwargs)
+    # The flush loop is driven by the test instead of a thread
+    pub.flush_th = object()
+    return pub, mqtt
+
+
+def test_token_bucket_limits_and_refills(clock):
+    pub, mqtt = publisher(rate_per_sec=1.0, burst=2, coalesce_window_sec=10.0)
+    for _ in range(3):
+        pub.publish_error_info("dlm", "DLM-ERROR-001", 2, "db down")
+    assert len(mqtt.published) == 2
+    assert pub.suppressed == 1
+
+    # Tokens are refilled, but the message stays coalesced behind the pending ones
+    clock.now = 5.0
+    pub.publish_error_info("dlm", "DLM-ERROR-001", 3, "db still down")
+    assert len(mqtt.published) == 2
+
+    # Other ids have their own bucket
+    pub.publish_error_info("dlm", "DLM-ERROR-002", 2, "other")
+    pub.publish_event_info("dlm", "DLM-EVENT-001", "event")
+    assert [msg.get("error_id", msg.get("event_id")) for _, msg in mqtt.published[2:]] == \
+        ["DLM-ERROR-002", "DLM-EVENT-001"]
+
+
+def test_storm_is_coalesced_then_summarised(clock):
+    pub, mqtt = publisher(rate_per_sec=1.0, burst=2, coalesce_window_sec=10.0)
+    for _ in range(3):
+        pub.publish_error_info("dlm", "DLM-ERROR-001", 2, "db down")
+    clock.now = 0.5
+    pub.publish_error_info("dlm", "DLM-ERROR-001", 3, "db down again")
+
+    pub.flush_loop()
+
+    topics = {topic for topic, _ in mqtt.published}
+    assert topics == {"dpu_dlm/errors"}
+    coalesced, summary = [msg for _, msg in mqtt.published[2:]]
+    assert coalesced["repeat_count"] == 2
+    assert coalesced["error_severity"] == 3
+    assert coalesced["error_desc"].startswith("db down again [repeated 2 times")
+    assert "repeat_count" not in summary
+    assert summary["error_desc"].startswith("DLM-ERROR-001 storm ended: 2 messages suppressed")
+    assert [msg["msg_id"] for _, msg in mqtt.published] == [1, 2, 3, 4]
+    # Storm over and bucket full again, the key is forgotten
+    assert pub.storms == {}
+    assert pub.flush_th is None
+
+    pub.publish_error_info("dlm", "DLM-ERROR-001", 2, "db down")
+    assert len(mqtt.published) == 5
+
+
+def test_zero_rate_publishes_every_call(clock):
+    pub, mqtt = publisher(rate_per_sec=0)
+    for _ in range(20):
+        pub.publish_event_info("dlm", "DLM-EVENT-001", "event")
+    assert len(mqtt.published) == 20
+    assert pub.storms == {}
@@ -0,0 +1,141 @@
+'''
+*****************************************************************************
+*File : test_habd_ingest.py
+*Module : tests
+*Purpose : Train routing, writer threads and priority lanes of the IngestDispatcher
+*Author : HABD Team
+*Copyright : Copyright 2025, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+import threading
+
+import habd_ingest
+from habd_ingest import IngestDispatcher
+from habd_wire import encode_train_processed
+
+
+class UnavailableDb:
+    '''Database that is down: every statement connects and fails'''
+
+    def __init__(self):
+        self.connected = False
+        self.closed = 0
+
+    def is_closed(self):
+        return not self.connected
+
+    def close(self):
+        self.connected = False
+        self.closed += 1
+
+    def execute_sql(self, sql, params=None):
+        raise ConnectionError('database unavailable')
+
+
+def run_dispatcher(handlers):
+    dispatcher = IngestDispatcher(1, 100, 1)
+    dispatcher.start()
+    for handler_fn in handlers:
+        dispatcher.submit('dpu_dlm/events', b'{}', handler_fn, key=b'dpu', lane=IngestDispatcher.LANE_EVENT)
+    dispatcher.stop()
+    return dispatcher
+
+
+def test_buffering_handler_runs_without_the_database(monkeypatch):
+    db = UnavailableDb()
+    monkeypatch.setattr(habd_ingest, 'psql_db', db)
+    buffered = []
+    dispatcher = run_dispatcher([buffered.append, buffered.append])
+    assert len(buffered) == 2
+    assert dispatcher.failed == 0
+    assert db.closed == 0
+
+
+def test_sql_handler_fails_and_returns_its_connection(monkeypatch):
+    db = UnavailableDb()
+    monkeypatch.setattr(habd_ingest, 'psql_db', db)
+
+    def write(payload):
+        db.connected = True
+        db.execute_sql('INSERT')
+    dispatcher = run_dispatcher([write])
+    assert dispatcher.failed == 1
+    assert db.closed == 1
+
+
+def test_routing_key():
+    assert IngestDispatcher.routing_key('{"ts": 1.0, "train_id" : "T42", "axle_ids": []}') == b'T42'
+    assert IngestDispatcher.routing_key(encode_train_processed("T43", "DPU_01", 1.0, [1], [60.0], [40.0], [41.0],
+                                                               ["C1"])) == b'T43'
+    assert IngestDispatcher.routing_key(b'{"event_id": "E1"}') == IngestDispatcher.NO_TRAIN_KEY
+
+
+def test_messages_of_a_train_stay_on_one_writer_in_order(monkeypatch):
+    monkeypatch.setattr(habd_ingest, 'psql_db', UnavailableDb())
+    dispatcher = IngestDispatcher(4, 1000, 1)
+    handled = []
+
+    def handler(payload):
+        handled.append((threading.current_thread().name, payload))
+    dispatcher.start()
+    for seq in range(50):
+        for train in range(8):
+            dispatcher.submit('habd_pm/habd_info', ('{"train_id": "T%d", "seq": %d}' % (train, seq)).encode(),
+                              handler)
+    dispatcher.stop()
+    assert len(handled) == 400
+    assert dispatcher.processed == 400
+    for train in range(8):
+        prefix = ('{"train_id": "T%d",' % train).encode()
+        mine = [(writer, payload) for writer, payload in handled if payload.startswith(prefix)]
+        assert len({writer for writer, _ in mine}) == 1
+        assert [payload for _, payload in mine] == \
+            [('{"train_id": "T%d", "seq": %d}' % (train, seq)).encode() for seq in range(50)]
+    # Trains are spread over more than one writer
+    assert len({writer for writer, _ in handled}) > 1
+
+
+def test_full_queue_drops_after_the_enqueue_timeout():
+    dispatcher = IngestDispatcher(1, 2, 0)
+    assert dispatcher.submit('habd_pm/habd_info', b'{"train_id": "T1"}', len)
+    assert dispatcher.submit('habd_pm/habd_info', b'{"train_id": "T1"}', len)
+    assert not dispatcher.submit('habd_pm/habd_info', b'{"train_id": "T1"}', len)
+    assert dispatcher.stats()["dropped"] == 1
+
+
+def event(event_id):
+    return ('{"ts": 1.0, "msg_id": 1, "event_id": "%s", "event_desc": "link down"}' % event_id).encode()
+
+
+def test_lane_queue_serves_by_priority():
+    q = habd_ingest.LaneQueue(10, len(IngestDispatcher.LANE_NAMES))
+    for lane, name in ((2, 'health'), (1, 'event'), (0, 'train'), (1, 'event2')):
+        q.append(habd_ingest.IngestItem(0.0, name, b'', None, None, lane, None))
+    assert [q.pop().topic for _ in range(4)] == ['train', 'event', 'event2', 'health']
+    assert q.pop() is None
+
+
+def test_overload_coalesces_and_sheds_lower_lanes():
+    # No writer threads, so the queue only fills
+    dispatcher = IngestDispatcher(1, 6, 0, event_shed_depth=3, health_shed_depth=2)
+    submit = dispatcher.submit
+    assert submit('dpu_dam/events', event('E1'), len, key=b'dpu', lane=IngestDispatcher.LANE_EVENT)
+    assert submit('dpu_dam/health_info', b'{}', len, key=b'dpu', lane=IngestDispatcher.LANE_HEALTH)
+    assert submit('habd_pm/train_processed_info', b'{}', len, key=b'dpu')
+    # Depth 3: events and health are overloaded
+    assert submit('dpu_dam/events', event('E1'), len, key=b'dpu', lane=IngestDispatcher.LANE_EVENT)
+    assert not submit('dpu_dam/events', event('E2'), len, key=b'dpu', lane=IngestDispatcher.LANE_EVENT)
+    assert submit('dpu_dam/health_info', b'{"S1": "DOWN"}', len, key=b'dpu', lane=IngestDispatcher.LANE_HEALTH)
+    assert not submit('dpu_pm/health_info', b'{}', len, key=b'dpu', lane=IngestDispatcher.LANE_HEALTH)
+    stats = dispatcher.stats()
+    assert stats["coalesced"] == {"event": 1, "health": 1}
+    assert stats["shed"] == {"event": 1, "health": 1}
+    assert stats["lane_depth"] == {"train": 1, "event": 1, "health": 1}
+    # Train messages filling the queue evict the lowest lane first
+    for _ in range(5):
+        assert submit('habd_pm/train_processed_info', b'{}', len, key=b'dpu')
+    stats = dispatcher.stats()
+    assert stats["lane_depth"] == {"train": 6, "event": 0, "health": 0}
+    assert stats["shed"] == {"event": 2, "health": 2}
+    assert dispatcher.queues[0].coalesce == {}
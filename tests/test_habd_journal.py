@@ -0,0 +1,47 @@
+'''
+*****************************************************************************
+*File : test_habd_journal.py
+*Module : tests
+*Purpose : Replay of the write-ahead ingest journal
+*Author : HABD Team
+*Copyright : Copyright 2025, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+from habd_journal import IngestJournal
+
+
+class FakeDispatcher:
+    '''Writes every submitted message at once'''
+
+    def __init__(self):
+        self.submitted = []
+
+    def depth(self):
+        return 0
+
+    def submit(self, topic, payload, handler_fn, key=None, lane=0):
+        self.submitted.append(payload)
+        return True
+
+
+class Handlers:
+    def on_train(self, payload):
+        pass
+
+
+def test_replay_scan_limit_submits_every_record(tmp_path):
+    dispatcher = FakeDispatcher()
+    journal = IngestJournal(str(tmp_path), dispatcher, replay_batch=1)
+    journal.handler_owner = Handlers()
+    journal.outage = True
+    for idx in range(1, 11):
+        journal.submit('habd/train_data', f'{idx}', journal.handler_owner.on_train)
+    journal.offset = 3
+    for _ in range(20):
+        if journal.replay():
+            break
+    assert dispatcher.submitted == [f'{idx}'.encode() for idx in range(4, 11)]
+    assert journal.offset == 10
+    assert journal.stats()["backlog"] == 0
+    journal.close()
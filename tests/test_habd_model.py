@@ -0,0 +1,106 @@
+'''
+*****************************************************************************
+*File : test_habd_model.py
+*Module : tests
+*Purpose : Open / close transitions of the database circuit breaker
+*Author : HABD Team
+*Copyright : Copyright 2025, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+import contextlib
+import threading
+
+import pytest
+
+from habd_model import DatabaseBreaker, DatabaseUnavailable
+
+
+class FakeDatabase:
+    '''Reconnect probes fail until up is set'''
+
+    def __init__(self, breaker):
+        self.breaker = breaker
+        self.up = threading.Event()
+        self.idle_closed = 0
+        self.probes = 0
+
+    def close_idle(self):
+        self.idle_closed += 1
+
+    def connection_context(self):
+        return contextlib.nullcontext()
+
+    def execute_sql(self, sql, params=None):
+        # The probe runs while the circuit is open
+        self.breaker.check()
+        self.probes += 1
+        if not self.up.is_set():
+            raise DatabaseUnavailable('connection refused')
+
+
+@pytest.fixture
+def breaker():
+    breaker = DatabaseBreaker()
+    database = FakeDatabase(breaker)
+    breaker.configure(database, failure_threshold=2, backoff_base_sec=0.001, backoff_max_sec=0.01)
+    breaker.transitions = []
+    breaker.changed = threading.Condition()
+
+    def on_transition(is_open, desc):
+        with breaker.changed:
+            breaker.transitions.append(is_open)
+            breaker.changed.notify_all()
+    breaker.on_transition = on_transition
+    return breaker
+
+
+def wait_transitions(breaker, count):
+    with breaker.changed:
+        assert breaker.changed.wait_for(lambda: len(breaker.transitions) >= count, 5)
+
+
+def test_opens_after_consecutive_failures_and_closes_on_probe(breaker):
+    breaker.record_failure(Exception('server closed the connection'))
+    breaker.record_success()
+    breaker.record_failure(Exception('server closed the connection'))
+    assert not breaker.is_open
+
+    breaker.record_failure(Exception('server closed the connection'))
+    wait_transitions(breaker, 1)
+    assert breaker.is_open
+    assert breaker.database.idle_closed == 1
+    with pytest.raises(DatabaseUnavailable):
+        breaker.check()
+    # Failures while open neither count nor start another reconnect thread
+    breaker.record_failure(Exception('server closed the connection'))
+    assert breaker.opened == 1
+
+    while breaker.database.probes < 3:
+        threading.Event().wait(0.001)
+    assert breaker.is_open
+    breaker.database.up.set()
+    wait_transitions(breaker, 2)
+    assert not breaker.is_open
+    breaker.check()
+    assert breaker.transitions == [True, False]
+    assert breaker.stats()["rejected"] == 1
+    assert breaker.stats()["reconnect_attempts"] >= 3
+
+
+def test_failed_connect_opens_at_once(breaker):
+    breaker.database.up.set()
+    breaker.record_failure(Exception('connection refused'), connect_failed=True)
+    assert breaker.is_open
+    wait_transitions(breaker, 2)
+    assert breaker.transitions == [True, False]
+    assert breaker.failures == 0
+
+
+def test_backoff_delay_is_bounded(breaker):
+    breaker.configure(breaker.database, failure_threshold=0, backoff_base_sec=1.0, backoff_max_sec=30.0)
+    assert breaker.failure_threshold == 1
+    for attempt in range(40):
+        delay = breaker.backoff_delay(attempt)
+        expected = min(30.0, 2.0 ** attempt)
+        assert expected / 2 <= delay <= expected
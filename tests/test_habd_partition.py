@@ -0,0 +1,88 @@
+'''
+*****************************************************************************
+*File : test_habd_partition.py
+*Module : tests
+*Purpose : Partition creation and retention of the PartitionManager
+*Author : HABD Team
+*Copyright : Copyright 2025, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+from contextlib import contextmanager
+
+from habd_model import EventInfo
+from habd_partition import PartitionManager
+
+# 2025-03-15 UTC
+NOW = 1742040000
+
+
+class Cursor:
+    def __init__(self, rows=(), rowcount=0):
+        self.rows = list(rows)
+        self.rowcount = rowcount
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeDb:
+    '''Records the statements, fail_on makes statements containing it raise'''
+
+    def __init__(self, default_rows=False, fail_on=None, partitions=()):
+        self.default_rows = default_rows
+        self.fail_on = fail_on
+        self.partitions = list(partitions)
+        self.statements = []
+        self.transactions = 0
+
+    def table_exists(self, table_name):
+        return False
+
+    @contextmanager
+    def atomic(self):
+        self.transactions += 1
+        yield
+
+    def execute_sql(self, sql, params=None):
+        self.statements.append(sql)
+        if self.fail_on is not None and self.fail_on in sql:
+            raise RuntimeError(f'failed: {sql}')
+        if sql.startswith('SELECT EXISTS'):
+            return Cursor([(self.default_rows,)])
+        if 'pg_inherits' in sql:
+            return Cursor(self.partitions)
+        return Cursor(rowcount=3)
+
+
+def test_create_partitions():
+    db = FakeDb()
+    assert PartitionManager(db, PartitionManager.MONTH, 2).create_partitions(EventInfo, NOW) == 3
+    created = [sql for sql in db.statements if sql.startswith('CREATE TABLE')]
+    assert [sql.split('"')[1] for sql in created] == ['event_info_p202503', 'event_info_p202504',
+                                                       'event_info_p202505']
+    assert db.transactions == 0
+
+
+def test_default_rows_are_moved_into_the_new_partition():
+    db = FakeDb(default_rows=True)
+    PartitionManager(db, PartitionManager.MONTH, 0).create_partitions(EventInfo, NOW)
+    assert db.transactions == 1
+    assert [sql.split(' ')[0] for sql in db.statements[1:]] == ['ALTER', 'CREATE', 'WITH', 'ALTER']
+    assert 'DETACH PARTITION "event_info_default"' in db.statements[1]
+    assert 'ATTACH PARTITION "event_info_default" DEFAULT' in db.statements[4]
+
+
+def test_failed_partition_does_not_stop_the_others():
+    db = FakeDb(fail_on='event_info_p202504')
+    assert PartitionManager(db, PartitionManager.MONTH, 2).create_partitions(EventInfo, NOW) == 2
+    assert any('event_info_p202505' in sql for sql in db.statements)
+
+
+def test_failed_partitions_do_not_stop_the_drop():
+    db = FakeDb(fail_on='PARTITION OF', partitions=[('event_info_p202401', 100), ('event_info_default', 5)])
+    assert PartitionManager(db, PartitionManager.MONTH, 2).maintain(EventInfo, 180) == 103
+    assert 'DROP TABLE IF EXISTS "event_info_p202401"' in db.statements
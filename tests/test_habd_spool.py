@@ -0,0 +1,52 @@
+'''
+*****************************************************************************
+*File : test_habd_spool.py
+*Module : tests
+*Purpose : Recovery of the publish spool segments after a restart
+*Author : HABD Team
+*Copyright : Copyright 2025, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+from habd_common.habd_spool import PublishSpool, HEADER, MAGIC
+
+TOPIC = "habd/dlm/event"
+
+
+def restart(spool):
+    spool.persist()
+    for segment in spool.segments:
+        segment.close()
+    return PublishSpool(spool.spool_dir, ram_max_bytes=0)
+
+
+def drain(spool):
+    messages = []
+    while spool.peek() is not None:
+        messages.append(spool.peek())
+        spool.pop()
+    return messages
+
+
+def test_recovered_segment_stays_sealed_across_restarts(tmp_path):
+    spool = PublishSpool(str(tmp_path), ram_max_bytes=0)
+    for idx in range(4):
+        spool.append(TOPIC, f'{idx}')
+    spool = restart(spool)
+    assert len(spool) == 4
+    spool.pop()
+    spool = restart(spool)
+    assert len(spool) == 3
+    assert [(topic, bytes(payload)) for topic, payload in drain(spool)] == [(TOPIC, b'1'), (TOPIC, b'2'),
+                                                                            (TOPIC, b'3')]
+
+
+def test_zero_filled_tail_is_not_recovered(tmp_path):
+    spool = PublishSpool(str(tmp_path), ram_max_bytes=0)
+    spool.append(TOPIC, '0')
+    segment = spool.segments[0]
+    # Header of a segment sealed by writing its size as the write offset
+    HEADER.pack_into(segment.mm, 0, MAGIC, segment.read_offset, segment.size)
+    spool = restart(spool)
+    assert len(spool) == 1
+    assert spool.peek()[0] == TOPIC
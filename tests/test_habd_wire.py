@@ -0,0 +1,67 @@
+'''
+*****************************************************************************
+*File : test_habd_wire.py
+*Module : tests
+*Purpose : Binary train_processed_info encoding round trip
+*Author : HABD Team
+*Copyright : Copyright 2025, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+import numpy as np
+import pytest
+
+from habd_wire import encode_train_processed, decode_train_processed, read_train_id, is_binary, \
+    WireFormatError, HEADER, MAGIC, VERSION
+
+TRAIN = dict(train_id="T20250315120000", dpu_id="DPU_01", ts=1742040000.25, axle_ids=[1, 2, 3, 4],
+             axle_speeds=[60.5, 61.0, None, 62.5], temp_lefts=[40.0, None, 42.5, 43.0],
+             temp_rights=[39.5, 41.0, 42.0, None], rake_ids=["L1-1", "L1-2", None, "C1-1"])
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_round_trip(compress):
+    payload = encode_train_processed(**TRAIN, compress=compress)
+    assert is_binary(payload)
+    assert read_train_id(payload) == b"T20250315120000"
+    ts, train_id, dpu_id, axle_ids, axle_speeds, temp_lefts, temp_rights, rake_ids = decode_train_processed(payload)
+    assert (ts, train_id, dpu_id) == (1742040000.25, "T20250315120000", "DPU_01")
+    assert axle_ids.tolist() == [1, 2, 3, 4]
+    np.testing.assert_array_equal(axle_speeds, np.array([60.5, 61.0, np.nan, 62.5], dtype=np.float32))
+    np.testing.assert_array_equal(temp_lefts, np.array([40.0, np.nan, 42.5, 43.0], dtype=np.float32))
+    np.testing.assert_array_equal(temp_rights, np.array([39.5, 41.0, 42.0, np.nan], dtype=np.float32))
+    assert rake_ids.tolist() == ["L1-1", "L1-2", None, "C1-1"]
+
+
+def test_compressed_payload_is_smaller_for_long_trains():
+    n = 400
+    train = dict(TRAIN, axle_ids=list(range(1, n + 1)), axle_speeds=[60.0] * n, temp_lefts=[40.0] * n,
+                 temp_rights=[41.0] * n, rake_ids=[f"C{idx // 4}" for idx in range(n)])
+    assert len(encode_train_processed(**train, compress=True)) < len(encode_train_processed(**train))
+
+
+def test_bad_magic():
+    payload = bytearray(encode_train_processed(**TRAIN))
+    payload[:4] = b'XXXX'
+    assert not is_binary(payload)
+    assert read_train_id(bytes(payload)) is None
+    with pytest.raises(WireFormatError, match='magic'):
+        decode_train_processed(bytes(payload))
+
+
+def test_unsupported_version():
+    payload = bytearray(encode_train_processed(**TRAIN))
+    payload[len(MAGIC)] = VERSION + 1
+    with pytest.raises(WireFormatError, match='version'):
+        decode_train_processed(bytes(payload))
+
+
+def test_truncated_payloads():
+    payload = encode_train_processed(**TRAIN)
+    with pytest.raises(WireFormatError):
+        decode_train_processed(payload[:HEADER.size - 1])
+    with pytest.raises(WireFormatError):
+        decode_train_processed(payload[:-20])
+    compressed = encode_train_processed(**TRAIN, compress=True)
+    with pytest.raises(WireFormatError):
+        decode_train_processed(compressed[:-4])
@@ -0,0 +1,123 @@
+'''
+*****************************************************************************
+*File : test_habd_write_buffer.py
+*Module : tests
+*Purpose : Group commit of the write-behind buffer
+*Author : HABD Team
+*Copyright : Copyright 2025, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+import contextlib
+import time
+import types
+
+import pytest
+
+import habd_write_buffer
+from habd_write_buffer import WriteBehindBuffer
+from habd_common.habd_ack import bound_delivery
+
+
+class FakeDb:
+
+    def connection_context(self):
+        return contextlib.nullcontext()
+
+    def atomic(self):
+        return contextlib.nullcontext()
+
+
+class FakeModel:
+    '''Records the batches of insert_many, raises error when set'''
+
+    _meta = types.SimpleNamespace(table_name="event_info")
+
+    def __init__(self):
+        self.batches = []
+        self.error = None
+
+    def insert_many(self, rows):
+        def execute():
+            if self.error is not None:
+                raise self.error
+            self.batches.append(list(rows))
+        return types.SimpleNamespace(execute=execute)
+
+
+class FakeDelivery:
+
+    def __init__(self):
+        self.holds = 0
+        self.released = []
+
+    def hold(self, outside_window=False):
+        self.holds += 1
+
+    def release(self, failed=False, outside_window=False):
+        self.released.append(failed)
+
+
+@pytest.fixture
+def model(monkeypatch):
+    monkeypatch.setattr(habd_write_buffer, "psql_db", FakeDb())
+    return FakeModel()
+
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_flush_at_max_rows(model):
+    buffer = WriteBehindBuffer(model, max_rows=3, max_delay_ms=60000)
+    for idx in range(3):
+        buffer.add({"msg_id": idx})
+    wait_until(lambda: buffer.flush_count == 1)
+    assert model.batches == [[{"msg_id": 0}, {"msg_id": 1}, {"msg_id": 2}]]
+    buffer.stop()
+    assert buffer.flushed_rows == 3
+
+
+def test_flush_after_max_delay(model):
+    buffer = WriteBehindBuffer(model, max_rows=100, max_delay_ms=20)
+    start = time.monotonic()
+    buffer.add({"msg_id": 1})
+    wait_until(lambda: buffer.flush_count == 1)
+    assert time.monotonic() - start >= 0.02
+    buffer.stop()
+    assert model.batches == [[{"msg_id": 1}]]
+
+
+def test_stop_writes_pending_rows(model):
+    buffer = WriteBehindBuffer(model, max_rows=100, max_delay_ms=60000)
+    buffer.add({"msg_id": 1})
+    buffer.add({"msg_id": 2})
+    buffer.stop()
+    assert model.batches == [[{"msg_id": 1}, {"msg_id": 2}]]
+
+
+def test_deliveries_are_held_until_the_commit(model):
+    buffer = WriteBehindBuffer(model, max_rows=100, max_delay_ms=60000)
+    delivery = FakeDelivery()
+    with bound_delivery(delivery):
+        buffer.add({"msg_id": 1})
+    assert delivery.holds == 1
+    assert delivery.released == []
+    buffer.stop()
+    assert delivery.released == [False]
+
+
+def test_failed_batch_releases_failed_and_reports(model):
+    errors = []
+    buffer = WriteBehindBuffer(model, max_rows=100, max_delay_ms=60000, on_error=errors.append)
+    model.error = RuntimeError('relation "event_info" does not exist')
+    delivery = FakeDelivery()
+    with bound_delivery(delivery):
+        buffer.add({"msg_id": 1})
+    buffer.stop()
+    assert delivery.released == [True]
+    assert errors == [model.error]
+    assert buffer.flushed_rows == 0
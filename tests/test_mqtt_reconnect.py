@@ -0,0 +1,108 @@
+'''
+*****************************************************************************
+*File : test_mqtt_reconnect.py
+*Module : tests
+*Purpose : Reconnect backoff and connection state signalling of MqttClient
+*Author : HABD Team
+*Copyright : Copyright 2025, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+import time
+
+from habd_common.MqttClient import MqttClient
+
+
+class FakePahoClient:
+    '''connect() raises the first refused_attempts times, then answers with CONNACK result rc'''
+
+    def __init__(self, owner, refused_attempts=0, rc=0):
+        self.owner = owner
+        self.refused_attempts = refused_attempts
+        self.rc = rc
+        self.connects = 0
+
+    def connect(self, host, port, keepalive):
+        self.connects += 1
+        if self.connects <= self.refused_attempts:
+            raise ConnectionRefusedError('connection refused')
+        self.owner.on_con(self, None, None, self.rc, None)
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def will_set(self, topic, payload):
+        pass
+
+    def username_pw_set(self, username, password):
+        pass
+
+    def subscribe(self, topic, qos):
+        pass
+
+    def message_callback_add(self, topic, callback):
+        pass
+
+
+def new_client(backoff_base_sec=0.001, backoff_max_sec=0.01, **fake_kwargs):
+    client = MqttClient('127.0.0.1', 1883, 'test-reconnect', backoff_base_sec=backoff_base_sec,
+                        backoff_max_sec=backoff_max_sec)
+    fake = FakePahoClient(client, **fake_kwargs)
+    client.new_client = lambda: fake
+    return client, fake
+
+
+def test_backoff_delay_is_bounded():
+    client, _ = new_client(backoff_base_sec=1.0, backoff_max_sec=60.0)
+    for attempt in range(40):
+        delay = client.backoff_delay(attempt)
+        expected = min(60.0, 2.0 ** attempt)
+        assert expected / 2 <= delay <= expected
+
+
+def test_reconnect_retries_until_connected():
+    client, fake = new_client(refused_attempts=2)
+    client.start_reconnect_th()
+    client.th.join(5)
+    assert not client.th.is_alive()
+    assert client.is_connected
+    assert fake.connects == 3
+    stats = client.connection_stats()
+    assert (stats["reconnect_attempts"], stats["reconnects"]) == (3, 1)
+    assert not client.thread_started
+
+
+def test_refused_connack_ends_the_wait_at_once():
+    client, fake = new_client(rc=5)
+    client.client = fake
+    start = time.monotonic()
+    client.connect()
+    assert time.monotonic() - start < MqttClient.CONNECT_TIMEOUT_SEC
+    assert not client.is_connected
+    # Refused, so the reconnect thread keeps trying until disconnect() stops it
+    assert client.thread_started
+    deadline = time.monotonic() + 5
+    while fake.connects < 4:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+    client.disconnect()
+    client.th.join(5)
+    assert not client.th.is_alive()
+    assert not client.is_connected
+
+
+def test_disconnect_ends_the_backoff_wait():
+    client, fake = new_client(backoff_base_sec=60.0, backoff_max_sec=60.0)
+    client.start_reconnect_th()
+    start = time.monotonic()
+    client.disconnect()
+    client.th.join(5)
+    assert not client.th.is_alive()
+    assert time.monotonic() - start < 5
+    assert fake.connects == 0
@@ -0,0 +1,128 @@
+'''
+*****************************************************************************
+*File : test_mqtt_shared_sub.py
+*Module : tests
+*Purpose : Shared subscription callbacks of MqttClient, TrainForwarder and the HashRing
+*Author : HABD Team
+*Copyright : Copyright 2025, Lab to Market Innovations Private Limited
+*****************************************************************************
+'''
+
+import paho.mqtt.client as mqtt
+
+from habd_common.MqttClient import MqttClient
+from habd_supervisor import TrainForwarder, HashRing
+
+TOPIC = "habd/train_data"
+TRAIN_IDS = [f'T{idx:06d}'.encode() for idx in range(4000)]
+
+
+def new_client(manual_ack=False):
+    client = MqttClient('127.0.0.1', 1883, 'test-shared-sub', manual_ack=manual_ack)
+    client.setup_pre_con_params()
+    client.is_connected = True
+    return client
+
+
+def deliver(client, topic, payload=b'{"train_id": "T1"}', qos=0, mid=0):
+    message = mqtt.MQTTMessage(mid=mid, topic=topic.encode())
+    message.payload = payload
+    message.qos = qos
+    client.client._handle_on_message(message)
+
+
+def test_callback_filter():
+    assert MqttClient.callback_filter(f'$share/habd_dlm/{TOPIC}') == TOPIC
+    assert MqttClient.callback_filter(TOPIC) == TOPIC
+    assert MqttClient.callback_filter('$share/habd_dlm') == '$share/habd_dlm'
+
+
+def test_plain_topic_reaches_routed_callback():
+    client = new_client()
+    received = []
+    TrainForwarder(client, 0, 1, 'habd_dlm').subscribe(TOPIC, lambda c, u, m: received.append(m.topic))
+    deliver(client, TOPIC)
+    assert received == [TOPIC]
+
+
+def test_plain_topic_reaches_routed_callback_manual_ack():
+    client = new_client(manual_ack=True)
+    received = []
+    acked = []
+    client.ack = lambda mid, qos: acked.append(mid)
+    client.ack_tracker.ack_fn = client.ack
+    TrainForwarder(client, 0, 1, 'habd_dlm').subscribe(TOPIC, lambda c, u, m: received.append(m.mid), qos=1)
+    deliver(client, TOPIC, qos=1, mid=7)
+    assert received == [7]
+    assert acked == [7]
+
+
+def test_forwarded_topic_reaches_callback():
+    client = new_client()
+    received = []
+    TrainForwarder(client, 1, 2, 'habd_dlm').subscribe(TOPIC, lambda c, u, m: received.append(m.topic))
+    deliver(client, f'{TrainForwarder.FORWARD_PREFIX}/1/{TOPIC}')
+    assert received == [f'{TrainForwarder.FORWARD_PREFIX}/1/{TOPIC}']
+
+
+def test_forward_held_until_puback():
+    client = new_client(manual_ack=True)
+    acked = []
+    client.ack = lambda mid, qos: acked.append(mid)
+    client.ack_tracker.ack_fn = client.ack
+    published = []
+
+    def publish(topic, payload, qos):
+        info = mqtt.MQTTMessageInfo(100 + len(published))
+        published.append((topic, qos))
+        return info
+    client.client.publish = publish
+    forwarder = TrainForwarder(client, 0, 2, 'habd_dlm')
+    forwarder.ring.owner = lambda key: 1
+    forwarder.subscribe(TOPIC, lambda c, u, m: None, qos=1)
+    deliver(client, TOPIC, qos=1, mid=7)
+    assert published == [(f'{TrainForwarder.FORWARD_PREFIX}/1/{TOPIC}', 1)]
+    assert acked == []
+    client.on_pub(client.client, None, 100, mqtt.ReasonCode(mqtt.PacketTypes.PUBACK), None)
+    assert acked == [7]
+    assert client.ack_tracker.stats()["outside_window"] == 0
+
+
+def test_forward_failed_on_disconnect():
+    client = new_client(manual_ack=True)
+    acked = []
+    client.ack = lambda mid, qos: acked.append(mid)
+    client.ack_tracker.ack_fn = client.ack
+    client.client.publish = lambda topic, payload, qos: mqtt.MQTTMessageInfo(100)
+    client.request_redelivery = lambda: None
+    client.ack_tracker.on_failed = client.request_redelivery
+    forwarder = TrainForwarder(client, 0, 2, 'habd_dlm')
+    forwarder.ring.owner = lambda key: 1
+    forwarder.subscribe(TOPIC, lambda c, u, m: None, qos=1)
+    deliver(client, TOPIC, qos=1, mid=7)
+    client.manual_discon = True
+    client.on_discon(client.client, None, None, 0, None)
+    client.on_pub(client.client, None, 100, mqtt.ReasonCode(mqtt.PacketTypes.PUBACK), None)
+    assert acked == []
+    assert client.forwarding == {}
+
+
+def test_hash_ring_is_stable():
+    owners = [HashRing(4).owner(train_id) for train_id in TRAIN_IDS]
+    assert owners == [HashRing(4).owner(train_id) for train_id in TRAIN_IDS]
+    counts = [owners.count(worker) for worker in range(4)]
+    # Every worker owns a share of the trains, none more than twice its fair share
+    assert min(counts) > 0
+    assert max(counts) < 2 * len(TRAIN_IDS) / 4
+
+
+def test_hash_ring_moves_only_trains_of_the_added_worker():
+    ring, grown = HashRing(4), HashRing(5)
+    moved = [train_id for train_id in TRAIN_IDS if ring.owner(train_id) != grown.owner(train_id)]
+    assert all(grown.owner(train_id) == 4 for train_id in moved)
+    assert 0 < len(moved) < len(TRAIN_IDS) / 2
+
+
+def test_single_worker_owns_every_train():
+    ring = HashRing(1)
+    assert {ring.owner(train_id) for train_id in TRAIN_IDS} == {0}